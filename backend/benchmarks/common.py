@@ -0,0 +1,34 @@
+"""
+ابزارهای مشترک بنچمارک‌ها: شناسه‌ی commit، صدک و مسیر فایل نتایج
+"""
+import os
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "results")
+
+
+def git_commit():
+    """hash کوتاه HEAD؛ اگر فایل‌های track‌شده تغییر کرده باشند با پسوند -dirty"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=BASE_DIR, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, cwd=BASE_DIR, check=True,
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, q: float) -> float:
+    """صدک nearest-rank؛ q بین 0 و 1"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def results_path(name: str, commit=None) -> str:
+    return os.path.join(RESULTS_DIR, f"{name}-{commit or 'local'}.json")
@@ -0,0 +1,406 @@
+"""
+بنچمارک استخراج PDF روی یک پیکره‌ی مصنوعی و تکرارپذیر از PDFهای فارسی
+
+    cd backend
+    python -m benchmarks.extraction [--sizes 5 50 500] [--kinds text scanned mixed tables]
+        [--extractors pymupdf pdfplumber ocr advanced] [--out results.json]
+        [--compare benchmarks/results/old.json]
+
+پیکره بدون اینترنت و فقط با fitz ساخته می‌شود (fitz.Story فارسی را شکل‌دهی
+و راست‌به‌چپ رندر می‌کند) و با seed ثابت، بایت‌به‌بایت یکسان است:
+  text     لایه‌ی متنی معمولی
+  scanned  تصویر صفحه بدون لایه‌ی متنی (مسیر OCR)
+  mixed    صفحات زوج متنی و فرد اسکن‌شده
+  tables   متن همراه جدول‌های خط‌کشی‌شده (مسیر pdfplumber)
+فایل‌ها در --corpus-dir (پیش‌فرض پوشه‌ی موقت سیستم) نگه داشته می‌شوند و فقط در صورت نبودن یا تغییر
+نسخه‌ی سازنده دوباره ساخته می‌شوند.
+
+هر اندازه‌گیری (یک سند × یک استخراج‌کننده) در یک پردازه‌ی تازه اجرا می‌شود تا
+peak RSS (ru_maxrss) فقط مال همان اجرا باشد؛ برای process_pdf_advanced بیشینه‌ی
+RSS پردازه‌های extraction_pool هم جدا گزارش می‌شود. زمان کل سند (شامل باز
+کردن فایل) با یک فراخوانی روی همه‌ی صفحات و زمان هر صفحه با فراخوانی جداگانه
+روی --page-sample صفحه‌ی نمونه از همان سند باز اندازه‌گیری می‌شود. OCR (و process_pdf_advanced روی سندهای دارای صفحه‌ی
+اسکن‌شده) به --ocr-pages صفحه‌ی اول محدود است.
+
+نتیجه به صورت JSON ذخیره می‌شود (پیش‌فرض benchmarks/results/extraction-<commit>.json)
+و با --compare با نتیجه‌ی یک commit دیگر مقایسه می‌شود.
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import git_commit, percentile, results_path
+
+CORPUS_VERSION = 1
+KINDS = ("text", "scanned", "mixed", "tables")
+EXTRACTORS = ("pymupdf", "pdfplumber", "ocr", "advanced")
+
+_WORDS = (
+    "قرارداد شرکت سهامی خاص سرمایه مدیر عامل هیئت مدیره مسئول قطعه سند رسمی "
+    "ملک خریدار فروشنده مبلغ ریال تومان پرداخت تاریخ امضا ماده تبصره بند طرفین "
+    "تعهدات فسخ داوری خسارت دادگاه اجاره مستاجر موجر تحویل تضمین بیمه کارفرما "
+    "پیمانکار نظارت گزارش صورتحساب مالیات عوارض شهرداری ثبت اسناد املاک نماینده"
+).split()
+_PAGE_RECT = (0, 0, 595, 842)  # A4
+_MARGIN = 48
+
+
+# ---------------------------------------------------------------- پیکره
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 18))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), f"{rng.randint(1, 99999):,}".replace(",", "٬"))
+    return " ".join(words) + rng.choice((".", ".", "؛", "؟"))
+
+
+def _page_html(rng: random.Random, kind: str, page_no: int) -> str:
+    parts = [f"<h3>صفحه {page_no} — ماده {rng.randint(1, 40)}</h3>"]
+    paragraphs = 3 if kind == "tables" else 7
+    for _ in range(paragraphs):
+        parts.append("<p>" + " ".join(_sentence(rng) for _ in range(3)) + "</p>")
+    if kind == "tables":
+        cell = 'style="border: 1px solid black; padding: 3px"'
+        rows = [f"<tr><th {cell}>ردیف</th><th {cell}>شرح</th><th {cell}>مبلغ (ریال)</th><th {cell}>تاریخ</th></tr>"]
+        for i in range(1, 16):
+            rows.append(
+                f"<tr><td {cell}>{i}</td><td {cell}>{rng.choice(_WORDS)} {rng.choice(_WORDS)}</td>"
+                f"<td {cell}>{rng.randint(1000, 9999999)}</td>"
+                f"<td {cell}>۱۴۰{rng.randint(0, 3)}/{rng.randint(1, 12):02d}/{rng.randint(1, 29):02d}</td></tr>"
+            )
+        parts.append('<table style="border-collapse: collapse; width: 100%">' + "".join(rows) + "</table>")
+    return '<div dir="rtl" style="font-size: 11pt; line-height: 1.5">' + "".join(parts) + "</div>"
+
+
+def _render_text_pdf(pages_html: list) -> bytes:
+    import fitz
+
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    mediabox = fitz.Rect(_PAGE_RECT)
+    where = mediabox + (_MARGIN, _MARGIN, -_MARGIN, -_MARGIN)
+    for html in pages_html:
+        # محتوای بیشتر از یک صفحه بریده می‌شود تا تعداد صفحات دقیق بماند
+        story = fitz.Story(html)
+        device = writer.begin_page(mediabox)
+        story.place(where)
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+    return buffer.getvalue()
+
+
+def build_document(kind: str, pages: int, seed: int = 0) -> bytes:
+    """یک PDF مصنوعی؛ برای kind، pages و seed یکسان همیشه همان بایت‌ها"""
+    import fitz
+
+    rng = random.Random(f"{seed}:{kind}:{pages}")
+    text_pdf = _render_text_pdf([_page_html(rng, kind, i + 1) for i in range(pages)])
+    if kind in ("text", "tables"):
+        return text_pdf
+
+    source = fitz.open(stream=text_pdf, filetype="pdf")
+    out = fitz.open()
+    for i, page in enumerate(source):
+        if kind == "mixed" and i % 2 == 0:
+            out.insert_pdf(source, from_page=i, to_page=i)
+            continue
+        # اسکن خاکستری 150dpi با کمی چرخش، مثل خروجی اسکنر
+        matrix = fitz.Matrix(150 / 72, 150 / 72).prerotate(rng.uniform(-0.8, 0.8))
+        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY)
+        scanned = out.new_page(width=page.rect.width, height=page.rect.height)
+        scanned.insert_image(scanned.rect, pixmap=pix)
+    content = out.tobytes(garbage=3, deflate=True, no_new_id=True)
+    out.close()
+    source.close()
+    return content
+
+
+def ensure_corpus(corpus_dir: str, kinds, sizes, seed: int = 0) -> list:
+    """ساخت فایل‌های نبوده‌ی پیکره و برگرداندن فهرست سندها"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    if manifest.get("version") != CORPUS_VERSION or manifest.get("seed") != seed:
+        manifest = {"version": CORPUS_VERSION, "seed": seed, "documents": {}}
+
+    documents = []
+    for kind in kinds:
+        for size in sizes:
+            name = f"{kind}-{size}"
+            path = os.path.join(corpus_dir, f"{name}.pdf")
+            entry = manifest["documents"].get(name)
+            if entry is None or not os.path.exists(path):
+                started = time.perf_counter()
+                content = build_document(kind, size, seed)
+                with open(path, "wb") as f:
+                    f.write(content)
+                entry = {
+                    "kind": kind,
+                    "pages": size,
+                    "bytes": len(content),
+                    "sha256": hashlib.sha256(content).hexdigest(),
+                }
+                manifest["documents"][name] = entry
+                print(f"📄 {name}.pdf ساخته شد ({len(content) / 1e6:.1f} MB، {time.perf_counter() - started:.1f}s)")
+            documents.append({"name": name, "path": path, **entry})
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return documents
+
+
+# ---------------------------------------------------------------- اندازه‌گیری
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss در لینوکس KB است
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def _sample(pages: list, count: int) -> list:
+    if count <= 0 or len(pages) <= count:
+        return list(pages)
+    step = len(pages) / count
+    return [pages[int(i * step)] for i in range(count)]
+
+
+def _measure_extractor(name: str, content: bytes, page_limit, page_sample: int) -> dict:
+    from services import pdf_extraction
+    from services.pdf_document import PdfDocument
+
+    extractor = {
+        "pymupdf": pdf_extraction.extract_with_pymupdf,
+        "pdfplumber": pdf_extraction.extract_with_pdfplumber,
+        "ocr": pdf_extraction.extract_with_ocr,
+    }[name]
+
+    warmup_started = time.perf_counter()
+    if name == "ocr":
+        if not pdf_extraction.HAS_OCR:
+            return {"success": False, "error": "rapidocr-onnxruntime not installed"}
+        pdf_extraction.get_ocr_engine()
+    warmup = time.perf_counter() - warmup_started
+    rss_before = _peak_rss_mb()
+
+    doc = PdfDocument(content, page_limit)
+    started = time.perf_counter()
+    result = extractor(doc)
+    seconds = time.perf_counter() - started
+    pages = doc.page_limit
+
+    page_ms = []
+    for page in _sample(list(range(pages)), page_sample):
+        page_started = time.perf_counter()
+        extractor(doc, [page])
+        page_ms.append((time.perf_counter() - page_started) * 1000)
+    doc.close()
+
+    return {
+        "success": bool(result.get("success")),
+        "error": result.get("error"),
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "ms_per_page": round(seconds * 1000 / pages, 2) if pages else None,
+        "page_ms": {
+            "samples": len(page_ms),
+            "p50": round(statistics.median(page_ms), 2),
+            "p95": round(percentile(page_ms, 0.95), 2),
+            "max": round(max(page_ms), 2),
+        } if page_ms else None,
+        "chars": len(result.get("text") or ""),
+        "warmup_seconds": round(warmup, 3),
+        "rss_before_mb": rss_before,
+    }
+
+
+def _measure_advanced(content: bytes, page_limit) -> dict:
+    import asyncio
+    from services.extraction_pool import extraction_pool
+    from services.pdf_document import count_pdf_pages, select_pages
+    from services.pdf_extraction import process_pdf_advanced
+
+    async def run():
+        await extraction_pool.start()
+        try:
+            started = time.perf_counter()
+            result = await process_pdf_advanced(content, max_pages=page_limit)
+            return result, time.perf_counter() - started
+        finally:
+            await extraction_pool.shutdown()
+
+    rss_before = _peak_rss_mb()
+    result, seconds = asyncio.run(run())
+    pages = len(select_pages(count_pdf_pages(content), page_limit))
+    return {
+        "success": bool(result.get("blocks")),
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "ms_per_page": round(seconds * 1000 / pages, 2) if pages else None,
+        "method": result.get("extraction_method"),
+        "ocr_pages": result.get("ocr_pages", 0),
+        "quality": result.get("quality"),
+        "chars": result.get("total_characters", 0),
+        "rss_before_mb": rss_before,
+        # workerها بعد از shutdown جمع شده‌اند و در RUSAGE_CHILDREN حساب می‌شوند
+        "worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _measure_child(conn, name: str, path: str, page_limit, page_sample: int):
+    # کش استخراج غیرفعال: هر اجرا باید واقعاً استخراج کند
+    os.environ["EXTRACTION_CACHE_DIR"] = ""
+    # لاگ‌های استخراج‌کننده‌ها (و workerهای extraction_pool که همین fd را به ارث
+    # می‌برند) جدول نتایج را به هم نریزند؛ stderr دست نمی‌خورد
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        if name == "advanced":
+            measurement = _measure_advanced(content, page_limit)
+        else:
+            measurement = _measure_extractor(name, content, page_limit, page_sample)
+        measurement["peak_rss_mb"] = _peak_rss_mb()
+    except Exception as e:
+        measurement = {"success": False, "error": f"{type(e).__name__}: {e}"}
+    conn.send(measurement)
+    conn.close()
+
+
+def measure(name: str, document: dict, page_limit, page_sample: int) -> dict:
+    """اجرای یک اندازه‌گیری در یک پردازه‌ی تازه"""
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(
+        target=_measure_child,
+        args=(child_conn, name, document["path"], page_limit, page_sample),
+    )
+    process.start()
+    child_conn.close()
+    try:
+        measurement = parent_conn.recv()
+    except EOFError:
+        measurement = {"success": False, "error": f"benchmark process exited with {process.exitcode}"}
+    process.join()
+    return measurement
+
+
+# ---------------------------------------------------------------- گزارش
+
+def _environment() -> dict:
+    versions = {}
+    for module in ("fitz", "pdfplumber", "rapidocr_onnxruntime", "hazm"):
+        try:
+            mod = __import__(module)
+            versions[module] = getattr(mod, "VersionBind", None) or getattr(mod, "__version__", "installed")
+        except ImportError:
+            versions[module] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": versions,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    """چاپ تغییرات زمان و حافظه نسبت به نتیجه‌ی قبلی؛ خروجی تعداد پسرفت‌ها"""
+    previous = {(r["document"], r["extractor"]): r for r in old.get("results", [])}
+    regressions = 0
+    print(f"\nمقایسه با {old.get('commit')} (آستانه {threshold:.0%})")
+    print(f"{'document':<16}{'extractor':<12}{'ms/page':>22}{'peak RSS MB':>22}")
+    for r in new["results"]:
+        before = previous.get((r["document"], r["extractor"]))
+        if not before or not before.get("ms_per_page") or not r.get("ms_per_page"):
+            continue
+        change = r["ms_per_page"] / before["ms_per_page"] - 1
+        flag = ""
+        if change > threshold:
+            flag = " ⚠️"
+            regressions += 1
+        elif change < -threshold:
+            flag = " ✅"
+        ms = f"{before['ms_per_page']} → {r['ms_per_page']} ({change:+.0%})"
+        rss = f"{before.get('peak_rss_mb')} → {r.get('peak_rss_mb')}"
+        print(f"{r['document']:<16}{r['extractor']:<12}{ms:>22}{rss:>22}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 500], help="تعداد صفحات سندها")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--extractors", nargs="+", choices=EXTRACTORS, default=list(EXTRACTORS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "extraction-benchmark-corpus"))
+    parser.add_argument("--page-sample", type=int, default=10, help="صفحات نمونه برای زمان هر صفحه")
+    parser.add_argument("--ocr-pages", type=int, default=25,
+                        help="حداکثر صفحات OCR در هر سند (0 یعنی همه)")
+    parser.add_argument("--out", help="مسیر فایل JSON نتایج")
+    parser.add_argument("--compare", help="فایل JSON نتایج قبلی برای مقایسه")
+    parser.add_argument("--threshold", type=float, default=0.10, help="آستانه‌ی پسرفت ms/page")
+    args = parser.parse_args()
+
+    documents = ensure_corpus(args.corpus_dir, args.kinds, args.sizes, args.seed)
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "corpus": {"version": CORPUS_VERSION, "seed": args.seed},
+        "environment": _environment(),
+        "settings": {"page_sample": args.page_sample, "ocr_pages": args.ocr_pages},
+        "results": [],
+    }
+
+    print(f"{'document':<16}{'extractor':<12}{'pages':>6}{'seconds':>10}{'ms/page':>10}{'p95 ms':>10}{'peak MB':>10}{'workers MB':>12}")
+    for document in documents:
+        for name in args.extractors:
+            uses_ocr = name == "ocr" or (name == "advanced" and document["kind"] in ("scanned", "mixed"))
+            page_limit = args.ocr_pages if uses_ocr and args.ocr_pages > 0 else None
+            measurement = measure(name, document, page_limit, args.page_sample)
+            report["results"].append({
+                "document": document["name"],
+                "kind": document["kind"],
+                "document_pages": document["pages"],
+                "extractor": name,
+                **measurement,
+            })
+            if not measurement.get("success"):
+                print(f"{document['name']:<16}{name:<12}  ❌ {measurement.get('error')}")
+                continue
+            p95 = (measurement.get("page_ms") or {}).get("p95", "-")
+            print(
+                f"{document['name']:<16}{name:<12}{measurement['pages']:>6}{measurement['seconds']:>10}"
+                f"{measurement['ms_per_page']:>10}{p95:>10}{measurement['peak_rss_mb']:>10}"
+                f"{measurement.get('worker_peak_rss_mb', '-'):>12}"
+            )
+
+    out = args.out or results_path("extraction", commit)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 نتایج در {out} ذخیره شد")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+سرور جعلی سازگار با chat/completions برای load test
+
+    cd backend
+    python -m benchmarks.fake_llm --port 8100 --ttft-ms 400 --tokens-per-second 50 --output-tokens 120
+
+با LLM_ENDPOINT=http://127.0.0.1:8100 برنامه به جای مدل واقعی به این سرور وصل
+می‌شود. هر پاسخ بعد از ttft (زمان تا اولین توکن) با نرخ tokens-per-second
+تولید می‌شود؛ درخواست جریانی (stream=true) توکن‌ها را به صورت SSE و با همان
+فاصله‌ها می‌فرستد و درخواست عادی بعد از کل این زمان یک پاسخ JSON برمی‌گرداند.
+jitter تأخیرها را به صورت یکنواخت ±jitter تغییر می‌دهد (با seed ثابت).
+GET /stats تعداد درخواست‌ها و بیشینه‌ی درخواست‌های همزمان را برمی‌گرداند.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+_TOKENS = (
+    "سلام رفیق! ✨ با توجه به متن سند، قرارداد بین دو طرف در تاریخ ذکرشده امضا "
+    "شده و مبلغ کل آن در ماده‌ی سوم آمده است. اگر سؤال دیگه‌ای داری بگو "
+).split()
+
+
+class FakeLLM:
+    def __init__(self, ttft_ms: float, tokens_per_second: float, output_tokens: int,
+                 jitter: float = 0.0, seed: int = 0):
+        self.ttft = ttft_ms / 1000
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self.stats = {"requests": 0, "streams": 0, "in_flight": 0, "max_in_flight": 0, "tokens": 0}
+
+    def _vary(self, seconds: float) -> float:
+        if not self.jitter:
+            return seconds
+        return seconds * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _tokens(self):
+        for i in range(self.output_tokens):
+            yield _TOKENS[i % len(_TOKENS)] + " "
+
+    @staticmethod
+    def _envelope(model: str, **fields) -> dict:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "created": int(time.time()),
+            "model": model,
+            **fields,
+        }
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model") or "fake"
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            await asyncio.sleep(self._vary(self.ttft))
+            if body.get("stream"):
+                self.stats["streams"] += 1
+                return await self._stream(request, model)
+
+            await asyncio.sleep(self._vary(self.token_interval * self.output_tokens))
+            content = "".join(self._tokens())
+            self.stats["tokens"] += self.output_tokens
+            return web.json_response(self._envelope(
+                model,
+                object="chat.completion",
+                choices=[{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                usage={
+                    "prompt_tokens": len(json.dumps(body.get("messages", []))) // 4,
+                    "completion_tokens": self.output_tokens,
+                    "total_tokens": self.output_tokens,
+                },
+            ))
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _stream(self, request: web.Request, model: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for token in self._tokens():
+            chunk = self._envelope(
+                model,
+                object="chat.completion.chunk",
+                choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            )
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.stats["tokens"] += 1
+            await asyncio.sleep(self._vary(self.token_interval))
+        done = self._envelope(
+            model,
+            object="chat.completion.chunk",
+            choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        )
+        await response.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/stats", self.handle_stats)
+        # endpoint کلاینت می‌تواند پیشوند داشته باشد (مثلاً /openai/deployments/x)
+        app.router.add_post("/{prefix:.*}chat/completions", self.handle)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft-ms", type=float, default=400, help="زمان تا اولین توکن")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--jitter", type=float, default=0.2, help="تغییر تصادفی تأخیرها (0.2 یعنی ±20٪)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeLLM(args.ttft_ms, args.tokens_per_second, args.output_tokens, args.jitter, args.seed)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,681 @@
+"""
+load test سرتاسری: main:app با Postgres محلی و سرور LLM جعلی
+
+    cd backend
+    python -m benchmarks.loadtest --database-url postgresql://postgres@localhost/yaroo_loadtest \\
+        [--profile mixed] [--rates 2 4 8 16 32 64] [--step-seconds 30] [--compare old.json]
+
+برنامه (benchmarks.loadtest_app:app که همان main:app با اندازه‌گیری تأخیر event
+loop است) و benchmarks.fake_llm در پردازه‌های جدا اجرا می‌شوند؛ LLM_ENDPOINT به
+سرور جعلی اشاره می‌کند. جدول‌های subscriptions و ai_assist اگر نباشند ساخته
+می‌شوند و کاربران loadtest-* از طریق خود API (select_subscription و
+upload_json) ساخته و بعد از اجرا پاک می‌شوند. فقط دیتابیس محلی (localhost یا
+unix socket) پذیرفته می‌شود مگر با --allow-remote-db.
+
+بار open-loop است: درخواست‌ها با فاصله‌های نمایی (Poisson) و نرخ ثابت در هر
+پله فرستاده می‌شوند، پس کند شدن سرور نرخ ورودی را کم نمی‌کند. هر درخواست طبق
+وزن‌های profile یکی از endpointها را صدا می‌زند. برای هر پله و هر endpoint
+throughput، خطاها، صدک‌های 50/95/99 زمان پاسخ (برای ask_stream زمان تا اولین
+توکن هم) و تأخیر event loop در طول درخواست‌ها گزارش می‌شود.
+
+عدد اصلی «requests/sec at SLO» بیشترین نرخ پله‌ای است که خودش و همه‌ی
+پله‌های پایین‌ترش SLO را رعایت کرده‌اند: صدک --slo-percentile هر endpoint
+زیر حد --slo آن (برای ask_stream زمان تا اولین توکن) و نرخ خطا زیر
+--max-error-rate. با seed، profile و تنظیمات LLM جعلی یکسان این عدد بین
+commitها قابل مقایسه است.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+
+from benchmarks.common import git_commit, percentile, results_path
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_PREFIX = "loadtest-"
+
+PROFILES = {
+    "mixed": {"ask": 40, "ask_stream": 15, "get_subscription": 35, "upload_json": 10},
+    "chat": {"ask": 60, "ask_stream": 25, "get_subscription": 15},
+    "ask": {"ask": 100},
+    "ask_stream": {"ask_stream": 100},
+    "subscription": {"get_subscription": 100},
+    "upload": {"upload_json": 100},
+}
+
+# حد پیش‌فرض صدک زمان پاسخ (میلی‌ثانیه)
+DEFAULT_SLO_MS = {
+    "ask": 5000,
+    "ask_stream": 1500,  # زمان تا اولین توکن
+    "get_subscription": 200,
+    "upload_json": 5000,
+}
+
+# جدول‌هایی که برنامه انتظار دارد از قبل وجود داشته باشند (در production روی Supabase)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    user_id TEXT PRIMARY KEY,
+    plan_type TEXT NOT NULL,
+    pages_remaining INTEGER NOT NULL,
+    last_reset TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    is_active BOOLEAN NOT NULL DEFAULT TRUE
+);
+CREATE TABLE IF NOT EXISTS ai_assist (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    category TEXT,
+    data JSONB,
+    related_sources JSONB
+);
+"""
+_CLEANUP_TABLES = ("ai_assist", "subscriptions", "chat_messages", "upload_jobs")
+
+_WORDS = (
+    "قرارداد شرکت سهامی سرمایه مدیر عامل هیئت مدیره قطعه سند رسمی ملک خریدار فروشنده "
+    "مبلغ ریال پرداخت تاریخ امضا ماده تبصره طرفین تعهدات فسخ داوری خسارت اجاره مستاجر "
+    "موجر تحویل تضمین بیمه کارفرما پیمانکار نظارت گزارش مالیات عوارض ثبت نماینده"
+).split()
+
+
+# ---------------------------------------------------------------- محیط اجرا
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _is_local_database(url: str) -> bool:
+    parsed = urlparse(url)
+    host = parse_qs(parsed.query).get("host", [parsed.hostname or ""])[0]
+    return host in ("", "localhost", "127.0.0.1", "::1") or host.startswith("/")
+
+
+def _asyncpg_url(url: str) -> str:
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1).replace("postgres://", "postgresql://", 1)
+
+
+async def prepare_database(url: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(_asyncpg_url(url))
+    try:
+        await conn.execute(_SCHEMA)
+    finally:
+        await conn.close()
+    await cleanup_database(url)
+
+
+async def cleanup_database(url: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(_asyncpg_url(url))
+    try:
+        for table in _CLEANUP_TABLES:
+            exists = await conn.fetchval("SELECT to_regclass($1)", table)
+            if exists:
+                await conn.execute(f"DELETE FROM {table} WHERE user_id LIKE $1", USER_PREFIX + "%")
+    finally:
+        await conn.close()
+
+
+async def unlimited_pages(url: str):
+    """آپلودهای حین تست به سقف صفحات اشتراک نخورند"""
+    import asyncpg
+
+    conn = await asyncpg.connect(_asyncpg_url(url))
+    try:
+        await conn.execute(
+            "UPDATE subscriptions SET pages_remaining = 100000000 WHERE user_id LIKE $1",
+            USER_PREFIX + "%",
+        )
+    finally:
+        await conn.close()
+
+
+class Services:
+    """پردازه‌های سرور LLM جعلی و برنامه"""
+
+    def __init__(self, args):
+        self.args = args
+        self.llm_port = _free_port()
+        self.app_port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.app_port}"
+        self.llm_url = f"http://127.0.0.1:{self.llm_port}"
+        self.log_path = args.app_log or os.path.join(tempfile.gettempdir(), "loadtest-app.log")
+        self._processes = []
+
+    def _spawn(self, cmd, env=None, log=None):
+        process = subprocess.Popen(
+            cmd, cwd=BACKEND_DIR, env=env,
+            stdout=log or subprocess.DEVNULL, stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        self._processes.append(process)
+        return process
+
+    async def start(self):
+        a = self.args
+        self._spawn([
+            sys.executable, "-m", "benchmarks.fake_llm", "--port", str(self.llm_port),
+            "--ttft-ms", str(a.llm_ttft_ms), "--tokens-per-second", str(a.llm_tokens_per_second),
+            "--output-tokens", str(a.llm_output_tokens), "--jitter", str(a.llm_jitter),
+            "--seed", str(a.seed),
+        ])
+        env = {
+            **os.environ,
+            "DATABASE_URL": a.database_url,
+            "LLM_ENDPOINT": self.llm_url,
+            "GITHUB_TOKEN": os.environ.get("GITHUB_TOKEN") or "loadtest",
+            "PYTHONUNBUFFERED": "1",
+        }
+        log = open(self.log_path, "w")
+        self._spawn([
+            sys.executable, "-m", "uvicorn", "benchmarks.loadtest_app:app",
+            "--host", "127.0.0.1", "--port", str(self.app_port),
+            "--log-level", "warning", "--no-access-log",
+        ], env=env, log=log)
+        log.close()
+        await self._wait_ready(f"{self.llm_url}/stats", 30)
+        await self._wait_ready(f"{self.base_url}/", a.startup_timeout)
+
+    async def _wait_ready(self, url: str, timeout: float):
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if any(p.poll() is not None for p in self._processes):
+                    break
+                try:
+                    async with session.get(url) as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.5)
+        raise RuntimeError(f"{url} آماده نشد؛ لاگ برنامه: {self.log_path}")
+
+    def stop(self):
+        for process in reversed(self._processes):
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+        for process in self._processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+
+
+# ---------------------------------------------------------------- سناریوها
+
+def _document(rng: random.Random, paragraphs: int = 20) -> str:
+    lines = []
+    for i in range(paragraphs):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 40)))
+        lines.append(f"ماده {i + 1}. {words} مبلغ {rng.randint(1000, 999999)} ریال.")
+    return "\n".join(lines)
+
+
+class Traffic:
+    def __init__(self, session: aiohttp.ClientSession, base_url: str, users: list, seed: int,
+                 question_pool: int, request_timeout: float):
+        self.session = session
+        self.base_url = base_url
+        self.users = users
+        self.rng = random.Random(seed)
+        self.questions = [
+            f"{self.rng.choice(_WORDS)} و {self.rng.choice(_WORDS)} در ماده {self.rng.randint(1, 20)} چیست؟"
+            for _ in range(question_pool)
+        ]
+        # چند سؤال پرتکرارند (Zipf) تا اثر کش پاسخ هم دیده شود
+        self._question_weights = [1 / (i + 1) for i in range(question_pool)]
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self._uploads = 0
+
+    def _question(self) -> str:
+        return self.rng.choices(self.questions, self._question_weights)[0]
+
+    def _headers(self, endpoint: str) -> dict:
+        return {"x-loadtest-endpoint": endpoint}
+
+    async def ask(self, user: str):
+        async with self.session.post(
+            f"{self.base_url}/ask", json={"user_id": user, "question": self._question()},
+            headers=self._headers("ask"), timeout=self.timeout,
+        ) as response:
+            await response.read()
+            return response.status, None
+
+    async def ask_stream(self, user: str):
+        started = time.perf_counter()
+        first_token = None
+        async with self.session.post(
+            f"{self.base_url}/ask_stream", json={"user_id": user, "question": self._question()},
+            headers=self._headers("ask_stream"), timeout=self.timeout,
+        ) as response:
+            async for line in response.content:
+                if first_token is None and line.startswith((b"event: token", b"event: done")):
+                    first_token = time.perf_counter() - started
+                if line.startswith(b"event: error"):
+                    return 599, first_token
+            return response.status, first_token
+
+    async def get_subscription(self, user: str):
+        async with self.session.get(
+            f"{self.base_url}/get_subscription/{user}",
+            headers=self._headers("get_subscription"), timeout=self.timeout,
+        ) as response:
+            await response.read()
+            return response.status, None
+
+    async def upload_json(self, user: str):
+        self._uploads += 1
+        # محتوای یکتا تا نتیجه از کش استخراج خوانده نشود
+        content = f"{_document(self.rng)}\nشماره {self._uploads}".encode("utf-8")
+        return await self.upload(user, content, f"doc-{self._uploads}.txt")
+
+    async def upload(self, user: str, content: bytes, filename: str):
+        form = aiohttp.FormData()
+        form.add_field("user_id", user)
+        form.add_field("category", "loadtest")
+        form.add_field("file", content, filename=filename, content_type="text/plain")
+        async with self.session.post(
+            f"{self.base_url}/upload_json", data=form,
+            headers=self._headers("upload_json"), timeout=self.timeout,
+        ) as response:
+            await response.read()
+            return response.status, None
+
+
+async def seed_users(traffic: Traffic, count: int, concurrency: int = 8) -> list:
+    users = [f"{USER_PREFIX}{i:05d}" for i in range(count)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def seed(user: str):
+        async with semaphore:
+            async with traffic.session.post(
+                f"{traffic.base_url}/select_subscription",
+                json={"user_id": user, "plan_type": "pro"},
+            ) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"select_subscription {user}: {response.status} {await response.text()}")
+            status, _ = await traffic.upload(user, _document(traffic.rng).encode("utf-8"), "seed.txt")
+            if status != 200:
+                raise RuntimeError(f"upload_json {user}: {status}")
+
+    await asyncio.gather(*(seed(u) for u in users))
+    return users
+
+
+# ---------------------------------------------------------------- اجرای پله‌ها
+
+class StepRecorder:
+    def __init__(self):
+        self.endpoints = {}
+
+    def _entry(self, endpoint: str) -> dict:
+        return self.endpoints.setdefault(endpoint, {
+            "sent": 0, "ok": 0, "errors": 0, "dropped": 0, "timeouts": 0,
+            "latencies": [], "ttft": [], "statuses": {},
+        })
+
+    def dropped(self, endpoint: str):
+        entry = self._entry(endpoint)
+        entry["sent"] += 1
+        entry["dropped"] += 1
+
+    async def run(self, endpoint: str, call):
+        entry = self._entry(endpoint)
+        entry["sent"] += 1
+        started = time.perf_counter()
+        try:
+            status, ttft = await call
+        except asyncio.TimeoutError:
+            entry["timeouts"] += 1
+            entry["errors"] += 1
+            return
+        except (aiohttp.ClientError, OSError) as e:
+            entry["errors"] += 1
+            entry["statuses"][type(e).__name__] = entry["statuses"].get(type(e).__name__, 0) + 1
+            return
+        entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+        if status >= 400:
+            entry["errors"] += 1
+            return
+        entry["ok"] += 1
+        entry["latencies"].append(time.perf_counter() - started)
+        if ttft is not None:
+            entry["ttft"].append(ttft)
+
+
+def _latency_ms(values: list) -> dict:
+    if not values:
+        return {}
+    return {
+        "p50": round(percentile(values, 0.50) * 1000, 1),
+        "p95": round(percentile(values, 0.95) * 1000, 1),
+        "p99": round(percentile(values, 0.99) * 1000, 1),
+        "max": round(max(values) * 1000, 1),
+    }
+
+
+async def run_step(traffic: Traffic, weights: dict, rate: float, seconds: float,
+                   max_in_flight: int, drain_seconds: float) -> tuple:
+    recorder = StepRecorder()
+    endpoints = list(weights)
+    endpoint_weights = [weights[e] for e in endpoints]
+    tasks = set()
+    started = time.perf_counter()
+    next_at = started
+
+    while True:
+        next_at += traffic.rng.expovariate(rate)
+        if next_at - started >= seconds:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = traffic.rng.choices(endpoints, endpoint_weights)[0]
+        if len(tasks) >= max_in_flight:
+            recorder.dropped(endpoint)
+            continue
+        user = traffic.rng.choice(traffic.users)
+        task = asyncio.ensure_future(recorder.run(endpoint, getattr(traffic, endpoint)(user)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    remaining = max(0.0, seconds - (time.perf_counter() - started))
+    await asyncio.sleep(remaining)
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=drain_seconds)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return recorder, time.perf_counter() - started
+
+
+async def _server_stats(session: aiohttp.ClientSession, url: str, reset: bool = False) -> dict:
+    try:
+        async with session.get(url + ("?reset=1" if reset else "")) as response:
+            return await response.json()
+    except (aiohttp.ClientError, ValueError):
+        return {}
+
+
+def summarize_step(rate: float, recorder: StepRecorder, elapsed: float, lag: dict,
+                   slo_ms: dict, slo_q: float, max_error_rate: float) -> dict:
+    endpoints = {}
+    sent = ok = failed = 0
+    passed = True
+    for name, entry in sorted(recorder.endpoints.items()):
+        failures = entry["errors"] + entry["dropped"]
+        error_rate = failures / entry["sent"] if entry["sent"] else 0.0
+        measured = entry["ttft"] if name == "ask_stream" else entry["latencies"]
+        slo_value = round(percentile(measured, slo_q) * 1000, 1) if measured else None
+        limit = slo_ms.get(name)
+        endpoint_ok = error_rate <= max_error_rate and (
+            limit is None or (slo_value is not None and slo_value <= limit)
+        )
+        passed = passed and endpoint_ok
+        endpoints[name] = {
+            "sent": entry["sent"],
+            "ok": entry["ok"],
+            "errors": entry["errors"],
+            "dropped": entry["dropped"],
+            "timeouts": entry["timeouts"],
+            "statuses": entry["statuses"],
+            "error_rate": round(error_rate, 4),
+            "throughput_rps": round(entry["ok"] / elapsed, 2),
+            "latency_ms": _latency_ms(entry["latencies"]),
+            "ttft_ms": _latency_ms(entry["ttft"]),
+            "loop_lag_ms": (lag.get("endpoints") or {}).get(name, {}),
+            "slo": {"limit_ms": limit, "value_ms": slo_value, "passed": endpoint_ok},
+        }
+        sent += entry["sent"]
+        ok += entry["ok"]
+        failed += failures
+    return {
+        "offered_rps": rate,
+        "elapsed_seconds": round(elapsed, 2),
+        "sent": sent,
+        "throughput_rps": round(ok / elapsed, 2),
+        "error_rate": round(failed / sent, 4) if sent else 0.0,
+        "loop_lag_ms": lag.get("loop_lag_ms", {}),
+        "passed": passed and sent > 0,
+        "endpoints": endpoints,
+    }
+
+
+def _print_step(step: dict):
+    mark = "✅" if step["passed"] else "❌"
+    lag = step["loop_lag_ms"]
+    print(
+        f"\n{mark} {step['offered_rps']} req/s → {step['throughput_rps']} req/s، "
+        f"خطا {step['error_rate']:.1%}، loop lag p99 {lag.get('p99', '-')} ms / max {lag.get('max', '-')} ms"
+    )
+    print(f"  {'endpoint':<18}{'sent':>6}{'ok':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'ttft95':>9}{'lag99':>8}  SLO")
+    for name, e in step["endpoints"].items():
+        latency, ttft, lag = e["latency_ms"], e["ttft_ms"], e["loop_lag_ms"]
+        slo = e["slo"]
+        print(
+            f"  {name:<18}{e['sent']:>6}{e['ok']:>6}{e['errors'] + e['dropped']:>5}"
+            f"{latency.get('p50', '-'):>9}{latency.get('p95', '-'):>9}{latency.get('p99', '-'):>9}"
+            f"{ttft.get('p95', '-'):>9}{lag.get('p99', '-'):>8}  "
+            f"{slo['value_ms']}/{slo['limit_ms']} {'✅' if slo['passed'] else '❌'}"
+        )
+
+
+async def run_load(args, services: Services) -> dict:
+    weights = {}
+    for profile in args.profile:
+        for endpoint, weight in PROFILES[profile].items():
+            weights[endpoint] = weights.get(endpoint, 0) + weight
+    slo_ms = {**DEFAULT_SLO_MS, **args.slo}
+    slo_q = args.slo_percentile / 100
+    stats_url = f"{services.base_url}/__loadtest/stats"
+
+    connector = aiohttp.TCPConnector(limit=args.max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        traffic = Traffic(session, services.base_url, [], args.seed, args.question_pool, args.request_timeout)
+        started = time.perf_counter()
+        traffic.users = await seed_users(traffic, args.users)
+        await unlimited_pages(args.database_url)
+        print(f"👥 {len(traffic.users)} کاربر ساخته شد ({time.perf_counter() - started:.1f}s)")
+
+        if args.warmup_seconds > 0:
+            await run_step(traffic, weights, args.rates[0], args.warmup_seconds,
+                           args.max_in_flight, args.drain_seconds)
+
+        steps = []
+
+        async def step_at(rate: float) -> dict:
+            await _server_stats(session, stats_url, reset=True)
+            recorder, elapsed = await run_step(
+                traffic, weights, rate, args.step_seconds, args.max_in_flight, args.drain_seconds
+            )
+            lag = await _server_stats(session, stats_url)
+            step = summarize_step(rate, recorder, elapsed, lag, slo_ms, slo_q, args.max_error_rate)
+            steps.append(step)
+            _print_step(step)
+            return step
+
+        # پله‌ها به ترتیب تا اولین شکست؛ نرخ at-SLO فقط از پله‌های پیوسته‌ی موفق می‌آید
+        last_passed = None
+        first_failed = None
+        for rate in sorted(args.rates):
+            step = await step_at(rate)
+            if step["passed"] and first_failed is None:
+                last_passed = rate
+            elif first_failed is None:
+                first_failed = rate
+                if not args.keep_going:
+                    break
+
+        # بین آخرین پله‌ی موفق و اولین پله‌ی ناموفق با میانگین هندسی نصف می‌کنیم
+        if last_passed is not None and first_failed is not None:
+            low, high = last_passed, first_failed
+            for _ in range(args.refine):
+                rate = round(math.sqrt(low * high), 2)
+                if rate in (low, high):
+                    break
+                if (await step_at(rate))["passed"]:
+                    low = rate
+                else:
+                    high = rate
+            last_passed = low
+
+        llm_stats = await _server_stats(session, f"{services.llm_url}/stats")
+
+    return {
+        "weights": weights,
+        "slo_ms": slo_ms,
+        "steps": steps,
+        "fake_llm": llm_stats,
+        "headline": {
+            "requests_per_second_at_slo": last_passed or 0,
+            "throughput_at_slo": next(
+                (s["throughput_rps"] for s in steps if s["offered_rps"] == last_passed), 0
+            ),
+        },
+    }
+
+
+# ---------------------------------------------------------------- گزارش
+
+def compare(old: dict, new: dict) -> int:
+    """چاپ تغییر عدد اصلی و p95 هر endpoint در نرخ‌های مشترک؛ خروجی: آیا عدد اصلی کم شده"""
+    before = old.get("headline", {}).get("requests_per_second_at_slo", 0)
+    after = new["headline"]["requests_per_second_at_slo"]
+    print(f"\nمقایسه با {old.get('commit')}: requests/sec at SLO {before} → {after}")
+    previous = {s["offered_rps"]: s for s in old.get("steps", [])}
+    for step in new["steps"]:
+        old_step = previous.get(step["offered_rps"])
+        if not old_step:
+            continue
+        for name, e in step["endpoints"].items():
+            o = old_step["endpoints"].get(name)
+            if not o or not o["latency_ms"] or not e["latency_ms"]:
+                continue
+            print(
+                f"  {step['offered_rps']:>7} req/s  {name:<18} p95 "
+                f"{o['latency_ms']['p95']} → {e['latency_ms']['p95']} ms"
+            )
+    return int(after < before)
+
+
+def _slo_arg(value: str) -> tuple:
+    name, _, limit = value.partition("=")
+    if name not in DEFAULT_SLO_MS or not limit:
+        raise argparse.ArgumentTypeError(f"expected endpoint=ms with endpoint in {sorted(DEFAULT_SLO_MS)}")
+    return name, float(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("LOADTEST_DATABASE_URL"),
+                        help="Postgres محلی (پیش‌فرض LOADTEST_DATABASE_URL)")
+    parser.add_argument("--allow-remote-db", action="store_true")
+    parser.add_argument("--profile", nargs="+", choices=sorted(PROFILES), default=["mixed"])
+    parser.add_argument("--rates", type=float, nargs="+", default=[2, 4, 8, 16, 32, 64],
+                        help="نرخ ورودی هر پله (req/s)")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--warmup-seconds", type=float, default=10)
+    parser.add_argument("--drain-seconds", type=float, default=30,
+                        help="انتظار برای درخواست‌های باقیمانده بعد از هر پله")
+    parser.add_argument("--refine", type=int, default=2,
+                        help="تعداد پله‌های میانی بعد از اولین پله‌ی ناموفق")
+    parser.add_argument("--keep-going", action="store_true", help="ادامه‌ی همه‌ی پله‌ها بعد از شکست")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--question-pool", type=int, default=200)
+    parser.add_argument("--max-in-flight", type=int, default=2000)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--slo", type=_slo_arg, action="append", default=[],
+                        help="حد صدک برای یک endpoint، مثلاً --slo ask=3000")
+    parser.add_argument("--slo-percentile", type=float, default=95)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--llm-ttft-ms", type=float, default=400)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50)
+    parser.add_argument("--llm-output-tokens", type=int, default=120)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--app-log", help="مسیر لاگ برنامه (پیش‌فرض پوشه‌ی موقت)")
+    parser.add_argument("--out", help="مسیر فایل JSON نتایج")
+    parser.add_argument("--compare", help="فایل JSON نتایج قبلی برای مقایسه")
+    args = parser.parse_args()
+    args.slo = dict(args.slo)
+
+    if not args.database_url:
+        parser.error("--database-url (یا LOADTEST_DATABASE_URL) لازم است")
+    if not args.allow_remote_db and not _is_local_database(args.database_url):
+        parser.error("فقط دیتابیس محلی پذیرفته می‌شود؛ برای دیتابیس دیگر --allow-remote-db")
+
+    commit = git_commit()
+    asyncio.run(prepare_database(args.database_url))
+    services = Services(args)
+    try:
+        asyncio.run(services.start())
+        result = asyncio.run(run_load(args, services))
+    finally:
+        services.stop()
+        asyncio.run(cleanup_database(args.database_url))
+
+    report = {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            "profile": args.profile,
+            "rates": args.rates,
+            "step_seconds": args.step_seconds,
+            "users": args.users,
+            "question_pool": args.question_pool,
+            "slo_percentile": args.slo_percentile,
+            "max_error_rate": args.max_error_rate,
+            "seed": args.seed,
+            "fake_llm": {
+                "ttft_ms": args.llm_ttft_ms,
+                "tokens_per_second": args.llm_tokens_per_second,
+                "output_tokens": args.llm_output_tokens,
+                "jitter": args.llm_jitter,
+            },
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        **result,
+    }
+
+    headline = report["headline"]
+    print(
+        f"\n🏁 requests/sec at SLO (p{args.slo_percentile:g}): {headline['requests_per_second_at_slo']} "
+        f"(throughput {headline['throughput_at_slo']} req/s)"
+    )
+    out = args.out or results_path("loadtest", commit)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 نتایج در {out} ذخیره شد")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if compare(json.load(f), report):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+main:app همراه با اندازه‌گیری تأخیر event loop، فقط برای load test
+
+    uvicorn benchmarks.loadtest_app:app
+
+یک task هر PROBE_INTERVAL ثانیه می‌خوابد و دیرکرد بیدار شدنش را ثبت می‌کند
+(تأخیر event loop). برای هر درخواست بیشترین تأخیری که در طول عمر آن دیده
+شده، زیر برچسب هدر x-loadtest-endpoint (یا مسیر درخواست) جمع می‌شود.
+GET /__loadtest/stats آمار از آخرین reset را برمی‌گرداند (?reset=1 بعد از
+خواندن آمار را صفر می‌کند). آمار مال همین پردازه است، پس با یک worker
+uvicorn اجرا شود.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from benchmarks.common import percentile
+from main import app as _app
+
+PROBE_INTERVAL = 0.005
+STATS_PATH = "/__loadtest/stats"
+
+
+def _summary_ms(values) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50) * 1000, 2),
+        "p95": round(percentile(values, 0.95) * 1000, 2),
+        "p99": round(percentile(values, 0.99) * 1000, 2),
+        "max": round(max(values) * 1000, 2),
+    }
+
+
+class LoopLagProbe:
+    def __init__(self, interval: float = PROBE_INTERVAL, keep: int = 200_000):
+        self.interval = interval
+        # (زمان پایان خواب، دیرکرد) به ثانیه
+        self.samples = deque(maxlen=keep)
+        self.by_endpoint = {}
+        self._sleep_started = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            self._sleep_started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.samples.append((now, max(0.0, now - self._sleep_started - self.interval)))
+
+    def max_lag_since(self, started: float) -> float:
+        worst = 0.0
+        # خوابی که هنوز تمام نشده (مثلاً همین درخواست loop را بلاک کرده) هم حساب می‌شود
+        if self._sleep_started is not None:
+            worst = max(0.0, time.monotonic() - self._sleep_started - self.interval)
+        for ended, lag in reversed(self.samples):
+            if ended < started:
+                break
+            worst = max(worst, lag)
+        return worst
+
+    def record(self, endpoint: str, lag: float):
+        self.by_endpoint.setdefault(endpoint, []).append(lag)
+
+    def stats(self) -> dict:
+        return {
+            "loop_lag_ms": _summary_ms([lag for _, lag in self.samples]),
+            "endpoints": {name: _summary_ms(lags) for name, lags in self.by_endpoint.items()},
+        }
+
+    def reset(self):
+        self.samples.clear()
+        self.by_endpoint = {}
+
+
+class LoopLagMiddleware:
+    def __init__(self, app, probe: LoopLagProbe):
+        self.app = app
+        self.probe = probe
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["path"] == STATS_PATH:
+            return await self._send_stats(scope, send)
+
+        headers = dict(scope.get("headers") or [])
+        endpoint = headers.get(b"x-loadtest-endpoint", b"").decode() or scope["path"]
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.probe.record(endpoint, self.probe.max_lag_since(started))
+
+    async def _send_stats(self, scope, send):
+        body = json.dumps(self.probe.stats()).encode("utf-8")
+        if b"reset=1" in scope.get("query_string", b""):
+            self.probe.reset()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+probe = LoopLagProbe()
+_app.add_event_handler("startup", probe.start)
+app = LoopLagMiddleware(_app, probe)
@@ -0,0 +1,175 @@
+"""
+بنچمارک نرمال‌سازی متن فارسی: پیاده‌سازی قبلی در برابر موتور کامپایل‌شده
+
+    cd backend
+    python -m benchmarks.normalization [--pages 2000] [--repeat 5] [--file pages.txt]
+
+پیش از اندازه‌گیری، garbled_ratio روی متن فارسی واقعی (که نباید به OCR برسد)
+و روی نمونه‌های لایه‌ی متنی معیوب (که باید برسد) بررسی می‌شود.
+
+برای هر مرحله (fix، normalize، deep_clean و زنجیره‌ی کامل هر صفحه) ابتدا
+یکسان بودن خروجی دو پیاده‌سازی روی همه‌ی صفحات بررسی و سپس توان عملیاتی بر
+حسب MB/s (بایت UTF-8 ورودی) گزارش می‌شود. سهم هر گذر از زمان زنجیره‌ی جدید
+هم جدا گزارش می‌شود تا معلوم باشد چه بخشی از زمان صفحه هنوز در NFKC و
+Normalizer هضم است. بدون --file یک پیکره‌ی مصنوعی با
+کلمات فارسی، حروف و اعداد عربی، کلمات معیوب رایج، تلفن، ایمیل و
+نیم‌فاصله ساخته می‌شود. در فایل ورودی صفحه‌ها با form feed یا خط خالی دوتایی
+جدا می‌شوند.
+"""
+import argparse
+import json
+import random
+import time
+import unicodedata
+
+from benchmarks import normalization_baseline as before
+from config import OCR_GARBLED_RATIO
+from services import text_processing as after
+
+_WORDS = (
+    "قرارداد شرکت سهامی خاص سرمایه مدیر عامل هیئت مدیره مسئول تمام قطعه "
+    "سند رسمی ملک خریدار فروشنده مبلغ ریال تومان پرداخت تاریخ امضا ماده "
+    "تبصره بند طرفین تعهدات فسخ داوری خسارت دادگاه عموم نگار پذیر"
+).split()
+# قطعه‌هایی که قواعد اصلاح و نرمال‌سازی را فعال می‌کنند
+_NOISE = [
+    "ققی", "صی", "قیی", "هرمی", "خ صی", "پی", "مسو", "تمی", "قعفه", "نگر",
+    "هوم", "مدی", "عمل", "دا رودی", "ك", "ي", "ى", "ة", "ؤ", "إ", "أ", "ٱ", "ء",
+    "٠١٢", "٣٤٥٦", "٧٨٩", "021 8888 1234", "info @ example . com", "می رود",
+    "نمی شود", "کتاب ها", "بزرگ ترین", " . ", " ، ", "‌", "\x07", "\x9f",
+    "   ", "\n\n\n", "ﻛﺘﺎﺏ", "ﻱ",
+]
+
+
+# متن فارسی عادی با «و»های فراوان؛ نباید معیوب تشخیص داده شود
+_PERSIAN_PROSE = [
+    "طرفین قرارداد متعهد می‌شوند که مبلغ و تاریخ پرداخت را مطابق بند ۳ و تبصره‌های آن رعایت کنند "
+    "و در صورت بروز اختلاف، موضوع به داوری ارجاع شود.",
+    "خریدار و فروشنده با امضای این سند تأیید می‌کنند که ملک و متعلقات آن را دیده‌اند و هیچ ادعایی ندارند.",
+    "مدیر عامل و اعضای هیئت مدیره و بازرس و حسابرس و نماینده‌ی سهامداران در جلسه حاضر بودند.",
+    "من و تو و او و ما و شما و آن‌ها",
+]
+# لایه‌ی متنی معیوب: حروف جدا افتاده، (cid:NN) و گلیف‌های ناحیه‌ی خصوصی
+_GARBLED = [
+    "ب ا ی د ت و ج ه د ا ش ت ک ه",
+    "(cid:12)(cid:40) (cid:7) (cid:33)(cid:2) (cid:19)",
+    "\ue01a\ue02b \ue011 \ue0f3\ue004 \ue020",
+]
+
+
+def check_garbled_ratio():
+    """متن سالم زیر آستانه‌ی OCR و متن معیوب بالای آن"""
+    for text in _PERSIAN_PROSE:
+        for variant in (text, after.clean_extracted_text(text)):
+            ratio = after.garbled_ratio(variant)
+            if ratio > OCR_GARBLED_RATIO:
+                raise SystemExit(f"❌ garbled_ratio={ratio:.2f} برای متن سالم: {variant}")
+    for text in _GARBLED:
+        ratio = after.garbled_ratio(text)
+        if ratio <= OCR_GARBLED_RATIO:
+            raise SystemExit(f"❌ garbled_ratio={ratio:.2f} برای متن معیوب: {text!r}")
+
+
+def synthetic_pages(count: int, words_per_page: int = 400, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        parts = []
+        for _ in range(words_per_page):
+            parts.append(rng.choice(_NOISE) if rng.random() < 0.15 else rng.choice(_WORDS))
+            parts.append(rng.choice((" ", " ", " ", "\n", ". ", "، ")))
+        pages.append("".join(parts))
+    return pages
+
+
+def load_pages(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+    separator = "\f" if "\f" in raw else "\n\n\n"
+    return [page for page in raw.split(separator) if page.strip()]
+
+
+def _throughput(func, pages: list, size_mb: float, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for page in pages:
+            func(page)
+        best = min(best, time.perf_counter() - started)
+    return size_mb / best if best else float("inf")
+
+
+def chain_shares(pages: list) -> dict:
+    """سهم هر گذر clean_extracted_text (پیاده‌سازی جدید) از زمان کل"""
+    totals = {"fix_farsi_text_issues": 0.0, "normalize_farsi_text": 0.0, "nfkc": 0.0, "hazm_normalizer": 0.0}
+    for page in pages:
+        t0 = time.perf_counter()
+        text = after.fix_farsi_text_issues(page)
+        t1 = time.perf_counter()
+        text = after.normalize_farsi_text(text)
+        t2 = time.perf_counter()
+        text = unicodedata.normalize("NFKC", text).replace("ي", "ی").replace("ك", "ک").replace("\u200c", " ")
+        t3 = time.perf_counter()
+        after.normalizer.normalize(text)
+        t4 = time.perf_counter()
+        totals["fix_farsi_text_issues"] += t1 - t0
+        totals["normalize_farsi_text"] += t2 - t1
+        totals["nfkc"] += t3 - t2
+        totals["hazm_normalizer"] += t4 - t3
+    total = sum(totals.values()) or 1.0
+    return {name: round(seconds / total, 3) for name, seconds in totals.items()}
+
+
+def run(pages: list, repeat: int) -> dict:
+    size_mb = sum(len(p.encode("utf-8")) for p in pages) / (1024 * 1024)
+    stages = [
+        ("fix_farsi_text_issues", before.fix_farsi_text_issues, after.fix_farsi_text_issues),
+        ("normalize_farsi_text", before.normalize_farsi_text, after.normalize_farsi_text),
+        ("deep_clean_farsi_text", before.deep_clean_farsi_text, after.deep_clean_farsi_text),
+        ("clean_extracted_text", before.clean_extracted_text, after.clean_extracted_text),
+    ]
+    results = {"pages": len(pages), "size_mb": round(size_mb, 3), "stages": {}}
+    for name, old, new in stages:
+        mismatches = sum(1 for page in pages if old(page) != new(page))
+        if mismatches:
+            raise SystemExit(f"❌ {name}: خروجی {mismatches} صفحه با پیاده‌سازی قبلی یکسان نیست")
+        old_rate = _throughput(old, pages, size_mb, repeat)
+        new_rate = _throughput(new, pages, size_mb, repeat)
+        results["stages"][name] = {
+            "before_mb_s": round(old_rate, 2),
+            "after_mb_s": round(new_rate, 2),
+            "speedup": round(new_rate / old_rate, 2),
+        }
+    results["chain_shares"] = chain_shares(pages)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000, help="تعداد صفحات پیکره‌ی مصنوعی")
+    parser.add_argument("--repeat", type=int, default=5, help="بهترین زمان از چند اجرا")
+    parser.add_argument("--file", help="فایل متنی UTF-8 به جای پیکره‌ی مصنوعی")
+    parser.add_argument("--json", help="ذخیره‌ی نتایج در این مسیر")
+    args = parser.parse_args()
+
+    check_garbled_ratio()
+    print(f"garbled_ratio: متن سالم زیر و متن معیوب بالای {OCR_GARBLED_RATIO} ✅")
+
+    pages = load_pages(args.file) if args.file else synthetic_pages(args.pages)
+    results = run(pages, args.repeat)
+
+    print(f"{results['pages']} صفحه، {results['size_mb']} MB — خروجی‌ها یکسان ✅")
+    print(f"{'stage':<24}{'before MB/s':>14}{'after MB/s':>14}{'speedup':>10}")
+    for name, r in results["stages"].items():
+        print(f"{name:<24}{r['before_mb_s']:>14}{r['after_mb_s']:>14}{r['speedup']:>9}x")
+    print("سهم هر گذر از زمان clean_extracted_text:")
+    for name, share in results["chain_shares"].items():
+        print(f"  {name:<22}{share:>8.1%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+پیاده‌سازی قبلی نرمال‌سازی متن فارسی (بدون تغییر)
+
+فقط مبنای مقایسه در benchmarks/normalization.py است؛ خروجی موتور جدید
+services/text_processing باید دقیقاً با این توابع یکسان باشد.
+"""
+import re
+import unicodedata
+
+from services.text_processing import normalizer
+
+
+def deep_clean_farsi_text(text: str) -> str:
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    text = text.replace("ي", "ی").replace("ك", "ک")
+    text = text.replace("‌", " ").replace("\u200c", " ")
+    text = normalizer.normalize(text)
+    return text.strip()
+
+
+def normalize_farsi_text(text: str) -> str:
+    """نرمال‌سازی پیشرفته متن فارسی"""
+    if not text:
+        return ""
+    
+    # 1. تبدیل حروف عربی به فارسی
+    arabic_to_farsi = {
+        'ك': 'ک', 'ي': 'ی', 'ى': 'ی',
+        'ة': 'ه', 'ؤ': 'و', 'إ': 'ا',
+        'أ': 'ا', 'ٱ': 'ا', 'ء': ''
+    }
+    
+    for arabic, farsi in arabic_to_farsi.items():
+        text = text.replace(arabic, farsi)
+    
+    # 2. تبدیل اعداد عربی به فارسی
+    arabic_numbers = '٠١٢٣٤٥٦٧٨٩'
+    farsi_numbers = '۰۱۲۳۴۵۶۷۸۹'
+    trans_table = str.maketrans(arabic_numbers, farsi_numbers)
+    text = text.translate(trans_table)
+    
+    # 3. حذف کاراکترهای کنترل و نامرئی
+    text = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F-\x9F]', '', text)
+    
+    # 4. اصلاح فاصله‌های متعدد
+    text = re.sub(r' +', ' ', text)
+    text = re.sub(r'\n\n+', '\n\n', text)
+    
+    # 5. اصلاح نیم‌فاصله
+    text = text.replace('\u200c', ' ')  # حذف نیم‌فاصله نامرئی
+    
+    return text.strip()
+
+def fix_farsi_text_issues(text: str) -> str:
+    """اصلاح مشکلات خاص استخراج PDF فارسی"""
+    if not text:
+        return ""
+    
+    # 1. اصلاح کلمات معیوب رایج
+    common_fixes = {
+        'ققی': 'قرارداد',
+        'صی': 'سرمایه',
+        'قیی': 'شرکت',
+        'هرمی': 'سهامی',
+        'خ صی': 'خصوصی',
+        'پی': 'پذیر',
+        'مسو': 'مسئول',
+        'تمی': 'تمام',
+        'قعفه': 'قطعه',
+        'نگر': 'نگار',
+        'هوم': 'عموم',
+        'مدی': 'مدیر',
+        'عمل': 'عامل',
+        'دا رودی': 'داوردی',
+    }
+    
+    for wrong, correct in common_fixes.items():
+        text = text.replace(wrong, correct)
+    
+    # 2. اصلاح شماره‌های تلفن معیوب
+    text = re.sub(r'(\d{2,3})\s+(\d{3,4})\s+(\d{4})', r'\1-\2-\3', text)
+    
+    # 3. اصلاح ایمیل‌های معیوب
+    text = re.sub(r'(\w+)\s*@\s*(\w+)\s*\.\s*(\w+)', r'\1@\2.\3', text)
+    
+    # 4. حذف کاراکترهای اضافی بین کلمات
+    text = re.sub(r'([آ-ی])\s+([آ-ی])', r'\1\2', text)
+    
+    # 5. اصلاح نقطه‌گذاری
+    text = re.sub(r'\s*\.\s*', '. ', text)
+    text = re.sub(r'\s*،\s*', '، ', text)
+
+    # 6. اصلاح پیشوندها و پسوندهای جدا افتاده (Heuristics)
+    # اتصال "می" و "نمی" به فعل بعدی
+    # Note: (?<=^|\s) is invalid in Python because ^ is zero-width and \s is not.
+    # We use capturing group (^|\s) instead.
+    # IMPORTANT: Replacement string must NOT be raw string if we use \u escape
+    text = re.sub(r'(^|\s)(می|نمی)\s+(?=[آ-ی])', '\\1\\2\u200c', text)
+    
+    # اتصال "ها" و "های" به کلمه قبلی
+    text = re.sub(r'(?<=[آ-ی])\s+(ها|های)(?=\s|$|\.|،)', '\u200c\\1', text)
+    
+    # اتصال "تر" و "ترین"
+    text = re.sub(r'(?<=[آ-ی])\s+(تر|ترین)(?=\s|$|\.|،)', '\u200c\\1', text)
+    
+    return text
+
+
+def clean_extracted_text(text: str) -> str:
+    return deep_clean_farsi_text(normalize_farsi_text(fix_farsi_text_issues(text)))
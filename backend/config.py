@@ -13,8 +13,23 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 
 # App Settings
-MAX_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = int(os.getenv("MAX_CHUNK_SIZE", "1000"))  # حداکثر کاراکتر هر تکه‌ی ایندکس بازیابی
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))  # تعداد تکه‌های مرتبط در پرامپت /ask
+EMBEDDER = os.getenv("EMBEDDER", "hashing")  # hashing یا onnx
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))  # ابعاد بردار embedder hashing
+EMBEDDING_ONNX_MODEL = os.getenv("EMBEDDING_ONNX_MODEL", "models/embedding/model.onnx")
+EMBEDDING_ONNX_TOKENIZER = os.getenv("EMBEDDING_ONNX_TOKENIZER", "models/embedding/tokenizer.json")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "uploads/vectors")
+VECTOR_INDEX_DISK_MAX_MB = int(os.getenv("VECTOR_INDEX_DISK_MAX_MB", "1024"))  # بیشتر از این، قدیمی‌ترین ماتریس‌ها حذف می‌شوند
 MAX_MEMORY = 5  # حافظه مکالمه
+CHAT_MEMORY_MAX_USERS = int(os.getenv("CHAT_MEMORY_MAX_USERS", "10000"))  # کاربران در حافظه‌ی هر پردازه
+CHAT_MEMORY_TTL_SECONDS = float(os.getenv("CHAT_MEMORY_TTL_SECONDS", "5"))  # بعد از این مدت از دیتابیس خوانده می‌شود
+CHAT_MEMORY_FLUSH_SECONDS = float(os.getenv("CHAT_MEMORY_FLUSH_SECONDS", "0.5"))
+CHAT_MEMORY_FLUSH_BATCH = int(os.getenv("CHAT_MEMORY_FLUSH_BATCH", "200"))
+SUBSCRIPTION_CACHE_TTL_SECONDS = float(os.getenv("SUBSCRIPTION_CACHE_TTL_SECONDS", "5"))  # کش اشتراک بین درخواست‌ها
+SUBSCRIPTION_CACHE_MAX_ITEMS = int(os.getenv("SUBSCRIPTION_CACHE_MAX_ITEMS", "10000"))
+SUBSCRIPTION_RESET_DAYS = 365  # ریست سالانه‌ی صفحات اشتراک
+SUBSCRIPTION_RESET_INTERVAL_SECONDS = float(os.getenv("SUBSCRIPTION_RESET_INTERVAL_SECONDS", "3600"))
 
 # CORS Settings
 ALLOWED_ORIGINS = ["*"]
@@ -25,8 +40,78 @@ LIMIT_CONCURRENCY = 100  # افزایش برای تست فشار
 LIMIT_MAX_REQUESTS = 1000  # افزایش برای تست فشار
 
 # File Processing
-MAX_FILE_SIZE_MB = 50  # حداکثر حجم فایل به مگابایت
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))  # حداکثر حجم فایل به مگابایت
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # خواندن فایل آپلودی در تکه‌های 1 مگابایتی
 TEMP_DIR = "/tmp"
+# PDFهای در حال استخراج یک بار اینجا نوشته می‌شوند و workerها فقط مسیر را می‌گیرند (/dev/shm یعنی در حافظه)
+PDF_SPOOL_DIR = os.getenv(
+    "PDF_SPOOL_DIR", "/dev/shm/yaroo-pdf" if os.path.isdir("/dev/shm") else os.path.join(TEMP_DIR, "pdf_spool")
+)
 
-# Logging
+# Upload Jobs (آپلود ناهمزمان)
+UPLOAD_JOBS_DIR = os.getenv("UPLOAD_JOBS_DIR", "uploads/jobs")
+UPLOAD_JOB_CONCURRENCY = int(os.getenv("UPLOAD_JOB_CONCURRENCY", "2"))  # کار همزمان در هر پردازه
+UPLOAD_JOB_POLL_SECONDS = float(os.getenv("UPLOAD_JOB_POLL_SECONDS", "5"))
+UPLOAD_JOB_LEASE_SECONDS = float(os.getenv("UPLOAD_JOB_LEASE_SECONDS", "60"))  # بعد از این مدت بدون heartbeat، کار دوباره برداشته می‌شود
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "3"))
+
+# Extraction Pool
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 2))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "300"))  # ثانیه برای هر کار
+EXTRACTION_START_METHOD = os.getenv("EXTRACTION_START_METHOD", "spawn")
+# در انتظار worker آزاد، هر این مدت سلامت استخر بررسی می‌شود؛ فقط اگر هیچ worker زنده و
+# هیچ ساخت دوباره‌ی امیدوارکننده‌ای نباشد خطا برمی‌گردد (صف عادی زیر بار خطا نمی‌دهد)
+EXTRACTION_ACQUIRE_CHECK_SECONDS = float(os.getenv("EXTRACTION_ACQUIRE_CHECK_SECONDS", "30"))
+EXTRACTION_RESPAWN_MAX_DELAY = float(os.getenv("EXTRACTION_RESPAWN_MAX_DELAY", "30"))  # سقف فاصله‌ی تلاش‌های ساخت دوباره‌ی worker
+EXTRACTION_SHARD_MIN_PAGES = int(os.getenv("EXTRACTION_SHARD_MIN_PAGES", "10"))  # حداقل صفحات هر بخش موازی
+EXTRACTION_SAMPLE_PAGES = int(os.getenv("EXTRACTION_SAMPLE_PAGES", "3"))  # صفحات نمونه برای انتخاب روش
+EXTRACTION_DEGRADE_RATIO = float(os.getenv("EXTRACTION_DEGRADE_RATIO", "0.5"))  # افت کیفیت نسبت به نمونه
+
+# Extraction Cache
+EXTRACTION_CACHE_MAX_ITEMS = int(os.getenv("EXTRACTION_CACHE_MAX_ITEMS", "64"))  # تعداد نتایج در حافظه
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(TEMP_DIR, "extraction_cache")) or None
+EXTRACTION_CACHE_DISK_MAX_MB = int(os.getenv("EXTRACTION_CACHE_DISK_MAX_MB", "1024"))
+
+# OCR صفحه‌به‌صفحه
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "50"))  # صفحات کوتاه‌تر از این OCR می‌شوند
+OCR_GARBLED_RATIO = float(os.getenv("OCR_GARBLED_RATIO", "0.3"))  # نسبت توکن‌های معیوب برای OCR
+
+# LLM Client
+LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "https://models.inference.ai.azure.com")  # مثلاً سرور جعلی load test
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # درخواست همزمان به مدل؛ بقیه در صف می‌مانند
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))  # نگه داشتن اتصال‌های TLS بیکار
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))  # حداکثر سکوت بین دو قطعه‌ی پاسخ
+
+# Answer Cache
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")  # memory یا redis
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "2048"))  # فقط برای backend حافظه
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Profiling (پروفایل opt-in درخواست‌ها؛ پیش‌فرض خاموش)
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")  # هدر X-Profile با همین مقدار درخواست را پروفایل می‌کند
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # نسبت درخواست‌هایی که تصادفی پروفایل می‌شوند
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))  # درخواست‌های پروفایل همزمان؛ بقیه عادی اجرا می‌شوند
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sampling")  # sampling یا cprofile
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # فاصله‌ی نمونه‌برداری
+PROFILE_WORKERS = os.getenv("PROFILE_WORKERS", "true").lower() == "true"  # cProfile کارهای extraction_pool همان درخواست
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(TEMP_DIR, "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))  # تعداد پروفایل‌های نگه‌داشته‌شده روی دیسک
+
+# Tracing (spanهای هر درخواست؛ پیش‌فرض خاموش)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")  # none، jsonl یا otlp
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(TEMP_DIR, "traces.jsonl"))  # برای jsonl
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")  # OTLP/HTTP JSON
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "yaroo-backend")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))  # نسبت درخواست‌هایی که trace می‌شوند
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))  # spanهای منتظر خروجی؛ بیشتر از این دور ریخته می‌شوند
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "1"))
+
+# Logging (صف و thread جداگانه؛ نوشتن لاگ event loop را معطل نمی‌کند)
+# سطح پیش‌فرض و در صورت نیاز سطح هر logger، مثلاً «INFO,services.pdf_extraction=WARNING»
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json (هر خط یک رکورد) یا text
+# نسبت رکوردهای زیر WARNING هر logger که نوشته می‌شوند، مثلاً «services.pdf_extraction=0.1»
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # رکوردهای منتظر نوشتن؛ بیشتر از این دور ریخته می‌شوند
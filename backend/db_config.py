@@ -1,7 +1,17 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import AsyncAdaptedQueue, Empty
 from dotenv import load_dotenv
+import functools
+import logging
 import os
+import re
+import time
+
+from utils.metrics import metrics
+from utils.tracing import start_span
 
 # load environment variables FIRST
 load_dotenv()
@@ -25,13 +35,158 @@ elif DATABASE_URL.startswith("postgres://"):
         1
     )
 
+# ----------------------------
+# Pool settings
+# ----------------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # ثانیه انتظار برای گرفتن اتصال
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # بستن اتصال‌های قدیمی‌تر از این (ثانیه)
+# pre-ping یک رفت‌وبرگشت اضافه در هر checkout است؛ اتصال‌های کهنه را pool_recycle می‌بندد
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+# کش prepared statement هر اتصال در dialect asyncpg؛ پیش‌فرض خود dialect همین 100 است و
+# برنامه کمتر از 100 دستور متفاوت دارد، پس بزرگ‌تر کردنش اثری ندارد (فقط اگر دستورهای
+# پرتکرار از کش بیرون بیفتند لازم است؛ 0 یعنی خاموش، مثلاً پشت pgbouncer در حالت transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # لاگ همه‌ی دستورهای SQL (فقط برای دیباگ)
+# انتظار بیشتر از این برای گرفتن اتصال «کند» شمرده می‌شود
+DB_SLOW_CHECKOUT_SECONDS = float(os.getenv("DB_SLOW_CHECKOUT_SECONDS", "0.1"))
+
+
+class PoolMetrics:
+    """زمان انتظار برای گرفتن اتصال از pool و میزان اشباع آن"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        if seconds >= DB_SLOW_CHECKOUT_SECONDS:
+            self.slow_checkouts += 1
+
+
+pool_metrics = PoolMetrics()
+
+
+class _TimedQueue(AsyncAdaptedQueue):
+    """فقط انتظار برای اتصال آزاد زمان‌گیری می‌شود، نه ساخت اتصال جدید (overflow)"""
+
+    def get(self, block: bool = True, timeout: float = None):
+        # pool فقط وقتی block=True می‌خواهد که overflow پر است؛ در غیر این صورت انتظاری نیست
+        if not block:
+            return super().get(block, timeout)
+        started = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        except Empty:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    _queue_class = _TimedQueue
+
+
+# به جای echo=True (که handler جداگانه‌ای مستقیم روی stdout می‌گذارد)، لاگ SQL
+# از همان صف utils.logging_setup نوشته می‌شود
+if DB_ECHO:
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
 engine = create_async_engine(
     DATABASE_URL,
-    echo=True  # disable this in production unless you enjoy log spam
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
 )
 
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.checkouts += 1
+
+# ----------------------------
+# Query metrics
+# ----------------------------
+QUERY_SECONDS = metrics.histogram(
+    "yaroo_db_query_duration_seconds",
+    "Duration of each SQL statement, labelled by operation and first table",
+    ["query"],
+)
+_QUERY_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+([\w.\"]+)", re.I)
+
+
+@functools.lru_cache(maxsize=512)
+def query_label(statement: str) -> str:
+    """برچسب کم‌تنوع برای هر کوئری، مثلاً «SELECT ai_assist» (پارامترها در متن کوئری نیستند)"""
+    words = statement.split(None, 1)
+    operation = words[0].upper() if words else "UNKNOWN"
+    match = _QUERY_TABLE.search(statement)
+    return f"{operation} {match.group(1).strip(chr(34))}" if match else operation
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    # دستورهای یک اتصال پشت سر هم اجرا می‌شوند؛ دستور ناموفق در _query_failed بسته می‌شود
+    conn.info["query_started"] = time.perf_counter()
+    conn.info["query_span"] = start_span("db.query", **{"db.statement": query_label(statement)})
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        QUERY_SECONDS.labels(query_label(statement)).observe(time.perf_counter() - started)
+    query_span = conn.info.pop("query_span", None)
+    if query_span is not None:
+        query_span.end(rowcount=cursor.rowcount)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _query_failed(context):
+    conn = context.connection
+    if conn is None:
+        return
+    conn.info.pop("query_started", None)
+    query_span = conn.info.pop("query_span", None)
+    if query_span is not None:
+        query_span.record_error(context.original_exception)
+        query_span.end()
+
+
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False
 )
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    checkouts = pool_metrics.checkouts
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "capacity": capacity,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(checked_out / capacity, 4) if capacity else 0.0,
+        "checkouts": checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "slow_checkouts": pool_metrics.slow_checkouts,
+        "wait_ms_avg": round(pool_metrics.wait_seconds_total / checkouts * 1000, 3) if checkouts else 0.0,
+        "wait_ms_max": round(pool_metrics.wait_seconds_max * 1000, 3),
+    }
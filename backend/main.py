@@ -1,18 +1,44 @@
+import asyncio
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 # Import routers
 from routers import categories, subscribtion, upload, chat
+from services.extraction_pool import extraction_pool
+from services.llm_service import llm_client
+from services.chat_memory import chat_memory
+from services.answer_cache import answer_cache
+from services.extraction_cache import extraction_cache
+from services.subscribtion_service import subscription_reset_sweeper
+from services.upload_jobs import ensure_jobs_table, upload_job_worker
+from services.ingestion import UploadSizeLimitMiddleware, UploadTooLarge
+from utils.request_context import RequestContextMiddleware
+from utils.profiling import ProfilingMiddleware
+from utils import tracing
+from utils.metrics import metrics
+from utils.logging_setup import setup_logging, shutdown_logging, log_stats
+from db_config import pool_stats
 
 load_dotenv()
+setup_logging()
 
 # ----------------------------
 # FastAPI setup
 # ----------------------------
 app = FastAPI()
 
+# فایل‌های بزرگ‌تر از MAX_FILE_SIZE_MB قبل از دریافت کامل رد می‌شوند
+app.add_middleware(UploadSizeLimitMiddleware)
+# پروفایل opt-in (هدر X-Profile یا PROFILE_SAMPLE_RATE)؛ داخل RequestContextMiddleware تا request_id داشته باشد
+app.add_middleware(ProfilingMiddleware)
+# span ریشه‌ی هر درخواست (TRACE_EXPORTER)؛ داخل RequestContextMiddleware تا request_id داشته باشد
+app.add_middleware(tracing.TracingMiddleware)
+# memo مخصوص هر درخواست (مثلاً اشتراک کاربر فقط یک بار خوانده می‌شود)
+app.add_middleware(RequestContextMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -21,6 +47,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# آمار لحظه‌ای سرویس‌ها که در /metrics به صورت gauge خوانده می‌شوند
+metrics.collect("llm", "LLM client concurrency (llm_client)", llm_client.stats)
+metrics.collect("extraction_pool", "Extraction worker pool occupancy", extraction_pool.stats)
+metrics.collect("db_pool", "Database connection pool (see /db/stats)", pool_stats)
+metrics.collect("chat_memory", "Chat memory cache (see /chat_memory/stats)", chat_memory.stats)
+metrics.collect("answer_cache", "/ask answer cache (see /answer_cache/stats)", answer_cache.stats)
+metrics.collect("extraction_cache", "PDF extraction cache (see /extraction_cache/stats)", extraction_cache.stats)
+metrics.collect("logging", "Log records waiting for / dropped by the log writer thread", log_stats)
+metrics.collect("trace_exporter", "Trace span exporter queue (TRACE_EXPORTER)", tracing.exporter.stats)
+
+
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large_handler(request: Request, exc: UploadTooLarge):
+    return JSONResponse(status_code=413, content={"error": exc.detail})
+
 # Include routers
 
 
@@ -28,10 +70,50 @@ app.include_router(categories.router, tags=["categories"])
 app.include_router(subscribtion.router, tags=["subscription"])
 app.include_router(upload.router, tags=["upload"])
 app.include_router(chat.router, tags=["chat"])
+
+
+@app.on_event("startup")
+async def startup():
+    # workerهای استخراج PDF با کتابخانه‌های بارگذاری‌شده آماده می‌شوند
+    await extraction_pool.start()
+    # یک کلاینت LLM با اتصال‌های keep-alive برای همه‌ی درخواست‌ها
+    await llm_client.start()
+    # صف آپلود ناهمزمان؛ کارهای ناتمام قبل از ری‌استارت هم دوباره برداشته می‌شوند
+    await ensure_jobs_table()
+    upload_job_worker.start()
+    # حافظه گفتگو: جدول chat_messages و task نوشتن دسته‌ای
+    await chat_memory.start()
+    # ریست سالانه‌ی اشتراک‌ها در پس‌زمینه (مسیر خواندن فقط SELECT است)
+    subscription_reset_sweeper.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upload_job_worker.stop()
+    await subscription_reset_sweeper.stop()
+    await chat_memory.stop()
+    await llm_client.close()
+    await extraction_pool.shutdown()
+    await asyncio.to_thread(tracing.exporter.shutdown)
+    shutdown_logging()
+
+
 @app.get("/")
 async def root():
     return {"message": "API is running"}
 
+
+@app.get("/db/stats")
+async def db_stats():
+    """وضعیت pool اتصال‌های دیتابیس: اشباع و زمان انتظار برای اتصال"""
+    return pool_stats()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """متریک‌ها در قالب متنی Prometheus: زمان هر مرحله، کوئری‌ها، LLM و کارهای در جریان"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
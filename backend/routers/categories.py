@@ -11,7 +11,6 @@ async def select_category(request: Request):
     body = await request.json()
     user_id = body.get("user_id")
     category = body.get("category")
-    print("Raw category received from front:", repr(category))
     
     if not user_id or not category:
         return JSONResponse(status_code=400, content={"error": "user_id and category are required"})
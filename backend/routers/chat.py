@@ -1,8 +1,16 @@
+import asyncio
+import logging
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
-from services.llm_service import github_llm
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.llm_service import github_llm, github_llm_stream
 from services.subscribtion_service import check_and_reset_subscription
+from services.chat_memory import chat_memory
+from services.answer_cache import answer_cache, data_version_of
+from services.retrieval import format_context
+from services.vector_index import hybrid_search
+from config import RETRIEVAL_TOP_K
 from utils.helpers import truncate_text
+from utils.tracing import traced, span, current_span
 from db_config import AsyncSessionLocal
 from sqlalchemy import text
 import json
@@ -10,58 +18,47 @@ from sqlalchemy import text
 import json
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# حافظه چت (می‌توانید آن را در یک دیتابیس ذخیره کنید)
-chat_memory = {}
-MAX_MEMORY = 5
 
-@router.post("/ask")
-async def ask(request: Request):
+# کوئری پرتکرار /ask؛ یک بار ساخته می‌شود و asyncpg آن را prepared نگه می‌دارد.
+# فقط ایندکس بازیابی و نسخه‌ی داده خوانده می‌شوند؛ کل data (با متن کامل سند)
+# فقط برای رکوردهای قدیمی بدون ایندکس یا data_version برمی‌گردد.
+_SELECT_USER_DATA = text(
+    """
+    SELECT category, related_sources,
+           data->'retrieval' AS retrieval,
+           data->>'data_version' AS data_version,
+           CASE WHEN data->'retrieval' IS NULL OR data->>'data_version' IS NULL
+                THEN data END AS legacy_data
+    FROM ai_assist WHERE user_id = :user_id LIMIT 1
+    """
+)
+_SELECT_EXTRACTED_DATA = text(
+    "SELECT category, data, related_sources FROM ai_assist WHERE user_id = :user_id LIMIT 1"
+)
 
-    body = await request.json()
-    user_id = body.get("user_id")
-    question = body.get("question")
-    if not user_id or not question:
-        return JSONResponse(status_code=400, content={"error": "user_id and question required."})
-    
-    subscription = await check_and_reset_subscription(user_id)
-    if not subscription:
-        return JSONResponse(
-            status_code=402,
-            content={"error": "لطفا ابتدا اشتراک خود را انتخاب کنید"}
-        )
 
-    # ✅ گرفتن داده از PostgreSQL با استفاده از AsyncSessionLocal
-    async with AsyncSessionLocal() as session:
+def _ensure_json(v):
+    """ستون‌های JSON که به صورت متن آمده‌اند"""
+    if isinstance(v, str):
         try:
-            q = text("SELECT * FROM ai_assist WHERE user_id = :user_id LIMIT 1")
-            result = await session.execute(q, {"user_id": user_id})
-            row = result.fetchone()
-        except Exception as e:
-            print(f"❌ خطا در اجرای کوئری: {e}")
-            return JSONResponse(status_code=500, content={"error": f"DB query failed: {str(e)}"})
-
-    if not row:
-        return JSONResponse(status_code=400, content={"error": "No data for this user."})
+            return json.loads(v)
+        except Exception:
+            return v
+    return v
 
-    # row._mapping را به dict تبدیل می‌کنیم تا دسترسی راحت‌تر شود
-    record = dict(row._mapping)
 
-    # اگر ستون‌های JSON به صورت متن آمده بودند، آن‌ها را تبدیل کن
-    def ensure_json(v):
-        if isinstance(v, str):
-            try:
-                return json.loads(v)
-            except Exception:
-                return v
-        return v
+def _decode_record(record: dict, *columns) -> dict:
+    """تبدیل ستون‌های JSON (در thread جدا؛ ایندکس بازیابی می‌تواند چند مگابایت باشد)"""
+    for column in columns:
+        record[column] = _ensure_json(record.get(column))
+    return record
 
-    record["data"] = ensure_json(record.get("data"))
-    record["related_sources"] = ensure_json(record.get("related_sources"))
 
+def _legacy_context(data_to_format) -> str:
+    """داده‌هایی که قبل از ایندکس بازیابی ذخیره شده‌اند"""
     # ✅ محدود کردن داده‌ها برای جلوگیری از خطای token limit
-    data_to_format = record.get("data")
-
     # اگر full_text وجود دارد، آن را محدود کن
     if isinstance(data_to_format, dict) and "full_text" in data_to_format:
         data_to_format = data_to_format.copy()
@@ -71,7 +68,53 @@ async def ask(request: Request):
     if isinstance(data_to_format, dict) and "blocks" in data_to_format:
         data_to_format["blocks"] = data_to_format["blocks"][:5]  # فقط 5 بلوک اول
 
-    formatted_data = str(data_to_format)[:3000]
+    return str(data_to_format)[:3000]
+
+
+@traced("ask.build_prompt")
+async def _build_ask_prompt(user_id: str, question: str):
+    """ساخت پرامپت /ask از داده‌های کاربر و حافظه گفتگو
+
+    خروجی (پاسخ خطا، None، None) یا (None، پرامپت، نسخه‌ی داده برای کش پاسخ)
+    """
+    subscription = await check_and_reset_subscription(user_id)
+    if not subscription:
+        return JSONResponse(
+            status_code=402,
+            content={"error": "لطفا ابتدا اشتراک خود را انتخاب کنید"}
+        ), None, None
+
+    # ✅ گرفتن داده از PostgreSQL با استفاده از AsyncSessionLocal
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(_SELECT_USER_DATA, {"user_id": user_id})
+            row = result.fetchone()
+        except Exception as e:
+            logger.exception("❌ خطا در اجرای کوئری", extra={"user_id": user_id})
+            return JSONResponse(status_code=500, content={"error": f"DB query failed: {str(e)}"}), None, None
+
+    if not row:
+        return JSONResponse(status_code=400, content={"error": "No data for this user."}), None, None
+
+    record = await asyncio.to_thread(
+        _decode_record, dict(row._mapping), "retrieval", "legacy_data", "related_sources"
+    )
+    data_version = record["data_version"] or await asyncio.to_thread(
+        data_version_of, record["legacy_data"], record["category"]
+    )
+
+    # ✅ فقط تکه‌های مرتبط با سؤال (ایندکس BM25 و برداری که هنگام آپلود ساخته شده)
+    retrieval = record["retrieval"]
+    if isinstance(retrieval, dict) and retrieval.get("chunks"):
+        with span("retrieval.search", chunks=len(retrieval["chunks"])) as s:
+            relevant = (
+                await asyncio.to_thread(hybrid_search, retrieval, question, RETRIEVAL_TOP_K)
+                or retrieval["chunks"][:RETRIEVAL_TOP_K]
+            )
+            s.set("context_chunks", len(relevant))
+        formatted_data = format_context(relevant)
+    else:
+        formatted_data = _legacy_context(record["legacy_data"])
 
     # محدود کردن منابع وب
     web_sources = ""
@@ -83,7 +126,7 @@ async def ask(request: Request):
                 preview = truncate_text(source['text'], max_chars=300)
                 web_sources += f" محتوا: {preview}\n"
 
-    history = chat_memory.get(user_id, [])
+    history = await chat_memory.get_history(user_id)
     conversation_context = ""
     if history:
         # فقط 3 پیام آخر را نگه دار
@@ -110,53 +153,142 @@ async def ask(request: Request):
 
     پاسخ:
     """
+    return None, prompt, data_version
 
-    answer = await github_llm(prompt)
 
-    history.append({"role": "user", "content": question})
-    history.append({"role": "assistant", "content": answer})
-    chat_memory[user_id] = history[-MAX_MEMORY:]
+def _remember_answer(user_id: str, question: str, answer: str):
+    chat_memory.append(user_id, [
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": answer},
+    ])
+
+
+@router.post("/ask")
+async def ask(request: Request):
+
+    body = await request.json()
+    user_id = body.get("user_id")
+    question = body.get("question")
+    if not user_id or not question:
+        return JSONResponse(status_code=400, content={"error": "user_id and question required."})
+
+    error, prompt, data_version = await _build_ask_prompt(user_id, question)
+    if error:
+        return error
+
+    answer = await answer_cache.get(user_id, data_version, question)
+    current_span().set("answer_cache_hit", answer is not None)
+    if answer is None:
+        answer = await github_llm(prompt)
+        await answer_cache.set(user_id, data_version, question, answer)
+
+    _remember_answer(user_id, question, answer)
 
     return {"answer": answer}
 
+
+@router.get("/chat_memory/stats")
+async def chat_memory_stats():
+    """حجم حافظه گفتگو در این پردازه و وضعیت نوشتن در دیتابیس"""
+    return chat_memory.stats()
+
+
+@router.get("/answer_cache/stats")
+async def answer_cache_stats():
+    """آمار hit/miss کش پاسخ‌های /ask"""
+    return answer_cache.stats()
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@router.post("/ask_stream")
+async def ask_stream(request: Request):
+    """ Server-Sent Events همان /ask: هر قطعه‌ی پاسخ به محض تولید ارسال می‌شود
+
+    رویدادها: token با {"delta": ...}، در پایان done با {"answer": ...} و در صورت خطا error.
+    اگر کاربر اتصال را قطع کند، تولید upstream لغو می‌شود و چیزی در حافظه گفتگو ذخیره نمی‌شود.
+    """
+    body = await request.json()
+    user_id = body.get("user_id")
+    question = body.get("question")
+    if not user_id or not question:
+        return JSONResponse(status_code=400, content={"error": "user_id and question required."})
+
+    error, prompt, data_version = await _build_ask_prompt(user_id, question)
+    if error:
+        return error
+
+    cached = await answer_cache.get(user_id, data_version, question)
+
+    async def event_stream():
+        if cached is not None:
+            _remember_answer(user_id, question, cached)
+            yield _sse("token", {"delta": cached})
+            yield _sse("done", {"answer": cached, "cached": True})
+            return
+
+        parts = []
+        tokens = github_llm_stream(prompt)
+        try:
+            async for delta in tokens:
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+        except asyncio.CancelledError:
+            # قطع اتصال کاربر: Starlette این task را cancel می‌کند
+            logger.info("⚠️ اتصال کاربر قطع شد؛ تولید پاسخ لغو شد", extra={"user_id": user_id})
+            raise
+        except Exception as e:
+            logger.exception("❌ خطا در تولید پاسخ جریانی", extra={"user_id": user_id})
+            yield _sse("error", {"error": str(e)})
+            return
+        finally:
+            # بستن پاسخ upstream (در قطع اتصال هم اجرا می‌شود)
+            await tokens.aclose()
+
+        answer = "".join(parts).strip()
+        _remember_answer(user_id, question, answer)
+        await answer_cache.set(user_id, data_version, question, answer)
+        yield _sse("done", {"answer": answer})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # غیرفعال کردن بافر nginx تا قطعه‌ها همان لحظه برسند
+            "X-Accel-Buffering": "no",
+        }
+    )
+
 @router.get("/get_extracted_data/{user_id}")
 async def get_extracted_data(user_id: str):
     """ دریافت داده‌های JSON استخراج شده برای یک کاربر """
-
-    print(f"\n🔍 درخواست دریافت داده برای user_id: {user_id}")
     try:
         async with AsyncSessionLocal() as session:
-            q = text("SELECT * FROM ai_assist WHERE user_id = :user_id LIMIT 1")
-            result = await session.execute(q, {"user_id": user_id})
+            result = await session.execute(_SELECT_EXTRACTED_DATA, {"user_id": user_id})
             row = result.fetchone()
 
         if not row:
-            print(f"❌ هیچ داده‌ای برای user_id={user_id} یافت نشد")
+            logger.info("❌ هیچ داده‌ای برای کاربر یافت نشد", extra={"user_id": user_id})
             return JSONResponse(
                 status_code=404,
                 content={"error": f"No data found for user_id: {user_id}"}
             )
 
-        record = dict(row._mapping)
+        record = await asyncio.to_thread(_decode_record, dict(row._mapping), "data", "related_sources")
+        # ایندکس بازیابی داخلی است و فقط حجم پاسخ را زیاد می‌کند
+        if isinstance(record["data"], dict):
+            record["data"].pop("retrieval", None)
 
-        # اگر داده‌ها به صورت JSON رشته‌ای بودند، آن‌ها را بارگذاری کن
-        def ensure_json(v):
-            if isinstance(v, str):
-                try:
-                    return json.loads(v)
-                except Exception:
-                    return v
-            return v
-
-        record["data"] = ensure_json(record.get("data"))
-        record["related_sources"] = ensure_json(record.get("related_sources", []))
-
-        print(f"✅ داده یافت شد:")
-        print(f" - Category: {record.get('category')}")
-        try:
-            print(f" - Data keys: {list(record.get('data', {}).keys())}")
-        except Exception:
-            print(" - Data is not a dict")
+        if logger.isEnabledFor(logging.DEBUG):
+            data = record.get("data")
+            logger.debug("✅ داده یافت شد", extra={
+                "user_id": user_id,
+                "category": record.get("category"),
+                "data_keys": len(data) if isinstance(data, dict) else None,
+            })
 
         return {
             "user_id": user_id,
@@ -165,7 +297,7 @@ async def get_extracted_data(user_id: str):
             "related_sources": record.get("related_sources", [])
         }
     except Exception as e:
-        print(f"❌ خطا در دریافت داده: {str(e)}")
+        logger.exception("❌ خطا در دریافت داده", extra={"user_id": user_id})
         return JSONResponse(
             status_code=500,
             content={"error": f"Failed to retrieve data: {str(e)}"}
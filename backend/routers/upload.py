@@ -1,83 +1,77 @@
-import io
-import json
-import traceback
-import tempfile
-import os
+import asyncio
+import logging
 from fastapi import APIRouter, UploadFile, File, Form
 from fastapi.responses import JSONResponse
-import PyPDF2
-from io import BytesIO
-import chardet
-from docx import Document
-from sqlalchemy import text
 
 from services.subscribtion_service import (
     check_and_reset_subscription, 
-    deduct_pages,
     can_upload_file,
-    PLANS
+    reserve_pages,
+    refund_pages,
 )
-from services.pdf_extraction import process_pdf_advanced  # ✅ تغییر اینجا
-from services.text_processing import deep_clean_farsi_text
+from services.pdf_extraction import count_pdf_pages  # ✅ تغییر اینجا
+from services.extraction_pool import extraction_pool
+from services.extraction_cache import extraction_cache
+from services.answer_cache import answer_cache
+from services.ingestion import ingest_upload, InvalidUpload, UploadTooLarge
+from services.upload_processing import (
+    UPLOADS_IN_FLIGHT,
+    page_limit_for,
+    extract_upload_data,
+    save_user_data,
+    build_upload_response,
+)
+from services.upload_jobs import enqueue_job, get_job, QuotaExceeded
 from db_config import AsyncSessionLocal
 
 from types import SimpleNamespace
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def count_pdf_pages(pdf_bytes: bytes) -> int:
-    try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
-        return len(pdf_reader.pages)
-    except Exception as e:
-        print(f"Error counting PDF pages: {e}")
-        return 0
+@router.get("/extraction_cache/stats")
+async def extraction_cache_stats():
+    """آمار hit/miss کش استخراج PDF"""
+    return extraction_cache.stats()
 
-@router.post("/upload_json")
-async def upload_json(
-        user_id: str = Form(...),
-        category: str = Form(...),
-        file: UploadFile = File(...)
-):
-    # 1. Verify subscription
+async def _prepare_upload(user_id: str, category: str, file: UploadFile):
+    """بررسی اشتراک، دریافت فایل و شمارش صفحات؛ خروجی (پاسخ خطا، None) یا (None, آپلود آماده)"""
+    logger.info("📥 فایل آپلودی دریافت شد", extra={"user_id": user_id, "category": category, "file_name": file.filename})
+
+    # 1. بررسی اشتراک کاربر (در طول درخواست فقط یک بار از دیتابیس خوانده می‌شود)
     subscription = await check_and_reset_subscription(user_id)
     if not subscription or subscription.pages_remaining <= 0 or not subscription.is_active:
         return JSONResponse(
             status_code=402,
             content={"error": "لطفا ابتدا اشتراک خود را انتخاب کنید"}
-        )
-    print("=" * 60)
-    print(f"📥 UPLOAD_JSON RECEIVED")
-    print(f"👤 User ID: {user_id}")
-    print(f"📂 Category: {category}")
-    print(f"📄 Filename: {file.filename}")
+        ), None
 
-    # 1. بررسی اشتراک کاربر
-    subscription = await check_and_reset_subscription(user_id)
-    if not subscription:
+    # 2. خواندن تکه‌تکه‌ی فایل (سقف حجم، هش و تشخیص نوع) و محاسبه تعداد صفحات
+    try:
+        upload = await ingest_upload(file)
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": e.detail}), None
+    except InvalidUpload as e:
+        return JSONResponse(status_code=400, content={"error": str(e)}), None
+
+    if upload.file_type is None:
         return JSONResponse(
-            status_code=402,
-            content={"error": "لطفا ابتدا اشتراک خود را انتخاب کنید"}
-        )
-    
-    print(f"✅ اشتراک کاربر: {subscription.plan_type}")
+            status_code=400,
+            content={"error": "فرمت فایل پشتیبانی نمی‌شود. فقط JSON, PDF, TXT, DOCX."}
+        ), None
 
-    # 2. خواندن فایل و محاسبه تعداد صفحات
-    content = await file.read()
-    filename = file.filename.lower() if file.filename else ""
+    content = await upload.read()
 
     # محاسبه تعداد صفحات
     pages_count = 1  # پیش‌فرض برای فایل‌های غیر PDF
-    if filename.endswith(".pdf"):
-        pages_count = count_pdf_pages(content)
+    if upload.file_type == "pdf":
+        pages_count = await extraction_pool.run(count_pdf_pages, content, upload.content_hash)
         if pages_count == 0:
             return JSONResponse(
                 status_code=400,
                 content={"error": "فایل PDF نامعتبر است یا قابل خواندن نیست"}
-            )
-    
-    print(f"📊 تعداد صفحات فایل: {pages_count}")
+            ), None
 
     # 3. بررسی آیا کاربر می‌تواند این فایل را آپلود کند
     can_upload, message = await can_upload_file(user_id, pages_count)
@@ -85,163 +79,149 @@ async def upload_json(
         return JSONResponse(
             status_code=402,
             content={"error": message}
-        )
-    
-    print(f"✅ کاربر مجاز به آپلود فایل است")
+        ), None
 
-    # 4. پردازش فایل
-    json_data = {}
+    logger.info("✅ کاربر مجاز به آپلود فایل است", extra={
+        "plan": subscription.plan_type, "file_type": upload.file_type, "bytes": upload.size, "pages": pages_count,
+    })
+
+    return None, SimpleNamespace(
+        subscription=subscription,
+        upload=upload,
+        content=content,
+        pages_count=pages_count,
+        max_pages=page_limit_for(subscription, pages_count),
+    )
+
+@router.post("/upload_json")
+async def upload_json(
+        user_id: str = Form(...),
+        category: str = Form(...),
+        file: UploadFile = File(...)
+):
+    with UPLOADS_IN_FLIGHT.labels("sync").track():
+        return await _upload_json(user_id, category, file)
+
+async def _upload_json(user_id: str, category: str, file: UploadFile):
+    error, prepared = await _prepare_upload(user_id, category, file)
+    if error:
+        return error
+
+    subscription = prepared.subscription
+    upload = prepared.upload
+    pages_count = prepared.pages_count
+
+    # 4. رزرو اتمیک صفحات قبل از پردازش (فقط برای کاربران پولی)
+    reserved_pages = 0
+    pages_remaining = 0
+    if subscription.plan_type != "free":
+        success, result = await reserve_pages(user_id, pages_count)
+        if not success:
+            return JSONResponse(status_code=402, content={"error": result})
+        reserved_pages = pages_count
+        pages_remaining = result
+        logger.debug("💰 صفحات از اشتراک کسر شد", extra={"pages": pages_count, "pages_remaining": result})
+
+    # 5. پردازش فایل؛ در صورت خطا صفحات رزروشده برگردانده می‌شوند
     try:
-        if filename.endswith(".json"):
-            json_data = json.loads(content.decode("utf-8", errors="ignore"))
-
-        elif filename.endswith(".pdf"):
-            print(f"📄 شروع پردازش پیشرفته PDF...")
-            
-            # تعیین محدودیت صفحات برای کاربران رایگان
-            max_pages = None
-            if subscription.plan_type == "free":
-                plan = PLANS.get("free")
-                if plan and pages_count > plan.max_pages:
-                    max_pages = plan.max_pages
-                    print(f"⚠️ محدود کردن به {max_pages} صفحه اول (پلن رایگان)")
-            
-            # استفاده از پردازشگر پیشرفته
-            processed = await process_pdf_advanced(content, max_pages)
-            
-            json_data = {
-                "filename": file.filename,
-                "category": category.strip().lower(),
-                "extraction_method": processed["extraction_method"],
-                "total_characters": processed["total_characters"],
-                "total_blocks": processed["total_blocks"],
-                "pages_total": pages_count,
-                "pages_processed": len(processed["blocks"]),
-                "full_text": processed["full_text"],
-                "blocks": processed["blocks"],
-                "quality": processed.get("quality", "unknown"),
-                "metadata": {
-                    "file_size_bytes": len(content),
-                    "extraction_quality": processed.get("quality", "unknown")
-                }
-            }
-
-        elif filename.endswith(".txt"):
-            detected = chardet.detect(content)
-            encoding = detected.get("encoding") or "utf-8"
-            raw_text = content.decode(encoding, errors="ignore")
-            json_data = {"text": deep_clean_farsi_text(raw_text)}
-
-        elif filename.endswith(".docx"):
-            doc = Document(io.BytesIO(content))
-            full_text = "\n".join([para.text for para in doc.paragraphs])
-            json_data = {"text": deep_clean_farsi_text(full_text)}
-
-        else:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "فرمت فایل پشتیبانی نمی‌شود. فقط JSON, PDF, TXT, DOCX."}
-            )
-
-        # 5. کسر صفحات از اشتراک (فقط برای کاربران پولی)
-        if subscription.plan_type != "free":
-            print(f"💰 کسر {pages_count} صفحه از اشتراک کاربر...")
-            success, result = await deduct_pages(user_id, pages_count)
-            if not success:
-                print(f"⚠️ خطا در کسر صفحات: {result}")
-            else:
-                print(f"✅ {pages_count} صفحه کسر شد. صفحات باقیمانده: {result}")
-        else:
-            print(f"ℹ️ صفحات کسر نمی‌شود (پلن رایگان)")
-
-        related_data = []
-        # Use AsyncSessionLocal to read/write ai_assist in Postgres (sva)
-        existing = SimpleNamespace(data=None)
+        json_data = await extract_upload_data(
+            prepared.content, upload.file_type, file.filename, category,
+            pages_count, prepared.max_pages, upload.content_hash
+        )
 
+        # Use AsyncSessionLocal to read/write ai_assist in Postgres (sva)
         async with AsyncSessionLocal() as session:
-            # find existing record
-            result = await session.execute(
-                text("SELECT * FROM ai_assist WHERE user_id = :user_id LIMIT 1"),
-                {"user_id": user_id}
-            )
-            row = result.fetchone()
-            if row:
-                mapping = dict(row._mapping) if hasattr(row, "_mapping") else dict(row)
-                existing.data = mapping.get("data")
-
-                # update existing record
-                await session.execute(
-                    text(
-                        """
-                        UPDATE ai_assist
-                        SET category = :category,
-                            data = :data,
-                            related_sources = :related
-                        WHERE user_id = :user_id
-                        """
-                    ),
-                    {
-                        "category": category,
-                        "data": json.dumps(json_data, ensure_ascii=False),
-                        "related": json.dumps(related_data, ensure_ascii=False),
-                        "user_id": user_id
-                    }
-                )
-            else:
-                existing.data = None
-                # insert new record
-                await session.execute(
-                    text(
-                        """
-                        INSERT INTO ai_assist (user_id, category, data, related_sources)
-                        VALUES (:user_id, :category, :data, :related)
-                        """
-                    ),
-                    {
-                        "user_id": user_id,
-                        "category": category,
-                        "data": json.dumps(json_data, ensure_ascii=False),
-                        "related": json.dumps(related_data, ensure_ascii=False)
-                    }
-                )
-
+            await save_user_data(session, user_id, category, json_data)
             await session.commit()
 
-        # Persist to Postgres (ai_assist table) using AsyncSessionLocal from db_config
-        # The insert/update has already been performed in the previous block;
-        # this duplicate block was removed to avoid indentation and logic errors.
-
-        plan = PLANS.get(subscription.plan_type)
-        response = {
-            "message": f"فایل '{file.filename}' با موفقیت آپلود شد ✅",
-            "category": category,
-            "file_type": filename.split('.')[-1],
-            "subscription_info": {
-                "plan": subscription.plan_type,
-                "plan_name": plan.name if plan else "نامشخص",
-                "pages_used": pages_count if subscription.plan_type != "free" else 0,
-                "pages_remaining": subscription.pages_remaining - pages_count if subscription.plan_type != "free" else 0,
-                "max_allowed_pages": plan.max_pages if plan else 0,
-                "file_pages": pages_count,
-                "upload_status": "موفق"
-            },
-            "extraction_summary": {
-                "method": json_data.get("extraction_method", "unknown"),
-                "quality": json_data.get("quality", "unknown"),
-                "total_characters": json_data.get("total_characters", 0),
-                "total_blocks": json_data.get("total_blocks", 0),
-                "pages_processed": json_data.get("pages_processed", 0)
-            },
-            "json_data_preview": json.dumps(json_data, ensure_ascii=False)[:500] if isinstance(json_data, dict) else str(json_data)[:500],
-        }
+    except asyncio.CancelledError:
+        # قطع اتصال کاربر در حین پردازش
+        await refund_pages(user_id, reserved_pages)
+        raise
+    except Exception as e:
+        logger.exception("❌ خطا در پردازش upload_json", extra={"user_id": user_id})
+        await refund_pages(user_id, reserved_pages)
+        return JSONResponse(status_code=500, content={"error": f"Processing failed: {str(e)}"})
 
-        print("upload succesfully!")
-        print("=" * 60)
-        
-        return response
+    # پاسخ‌های کش‌شده درباره‌ی داده‌ی قبلی دیگر معتبر نیستند
+    await answer_cache.invalidate_user(user_id)
 
+    response = build_upload_response(
+        file.filename, category, upload.file_type, subscription, pages_count, json_data, pages_remaining
+    )
+
+    logger.info("✅ آپلود انجام شد", extra={"user_id": user_id, "pages": pages_count})
+
+    return response
+
+@router.post("/upload_json_async")
+async def upload_json_async(
+        user_id: str = Form(...),
+        category: str = Form(...),
+        file: UploadFile = File(...)
+):
+    """ثبت فایل در صف پردازش و برگرداندن فوری job_id (صفحات همراه ثبت کار رزرو می‌شوند)"""
+    error, prepared = await _prepare_upload(user_id, category, file)
+    if error:
+        return error
+
+    try:
+        job = await enqueue_job(
+            user_id, category, file.filename, prepared.upload.file_type,
+            prepared.content, prepared.upload.content_hash,
+            prepared.pages_count, prepared.max_pages,
+            reserve=prepared.subscription.plan_type != "free"
+        )
+    except QuotaExceeded as e:
+        return JSONResponse(status_code=402, content={"error": str(e)})
     except Exception as e:
-        print(f"❌ ERROR in upload_json: {str(e)}")
-        traceback.print_exc()
-        print("=" * 60)
-        return JSONResponse(status_code=500, content={"error": f"Processing failed: {str(e)}"})
\ No newline at end of file
+        logger.exception("❌ خطا در ثبت upload_json_async", extra={"user_id": user_id})
+        return JSONResponse(status_code=500, content={"error": f"Failed to queue upload: {str(e)}"})
+
+    logger.info("🗂️ کار آپلود در صف قرار گرفت", extra={"job_id": job["id"], "user_id": user_id})
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job["id"],
+            "status": job["status"],
+            "file_pages": job["pages_count"],
+            "status_url": f"/upload_jobs/{job['id']}",
+            "result_url": f"/upload_jobs/{job['id']}/result",
+        }
+    )
+
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "user_id": job["user_id"],
+        "category": job["category"],
+        "filename": job["filename"],
+        "file_type": job["file_type"],
+        "file_pages": job["pages_count"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "created_at": job["created_at"].isoformat() if job["created_at"] else None,
+        "finished_at": job["finished_at"].isoformat() if job["finished_at"] else None,
+    }
+
+@router.get("/upload_jobs/{job_id}")
+async def upload_job_status(job_id: str):
+    """وضعیت کار آپلود: queued, running, done یا failed"""
+    job = await get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": f"No upload job found: {job_id}"})
+    return _job_status(job)
+
+@router.get("/upload_jobs/{job_id}/result")
+async def upload_job_result(job_id: str):
+    """نتیجه کار آپلود؛ تا وقتی کار تمام نشده 202 برمی‌گردد"""
+    job = await get_job(job_id, include_result=True)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": f"No upload job found: {job_id}"})
+
+    if job["status"] == "done":
+        return job["result"]
+    if job["status"] == "failed":
+        return JSONResponse(status_code=500, content={"error": job["error"], **_job_status(job)})
+    return JSONResponse(status_code=202, content=_job_status(job))
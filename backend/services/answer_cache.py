@@ -0,0 +1,197 @@
+"""
+کش پاسخ‌های /ask
+
+کلید از هش user_id، نسخه‌ی داده‌ی ai_assist کاربر (data_version) و سؤال
+نرمال‌شده ساخته می‌شود؛ پس سؤال‌های تقریباً یکسان درباره‌ی همان سند دوباره به
+مدل فرستاده نمی‌شوند. با آپلود فایل جدید data_version عوض می‌شود و پاسخ‌های
+قبلی کاربر هم حذف می‌شوند.
+
+دو backend دارد: LRU با TTL در حافظه‌ی همین پردازه (پیش‌فرض) و Redis برای
+اشتراک بین پردازه‌ها. اگر redis نصب یا در دسترس نباشد، همان کش حافظه استفاده
+می‌شود.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import (
+    ANSWER_CACHE_BACKEND,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_ITEMS,
+    REDIS_URL,
+)
+from services.text_processing import deep_clean_farsi_text
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[؟?!.,،؛;:«»\"'()\[\]{}\-–—…]+")
+_SPACES = re.compile(r"\s+")
+# کاراکترهای خاص الگوی MATCH در SCAN ردیس
+_REDIS_GLOB = re.compile(r"([*?\[\]\\])")
+
+
+def normalize_question(question: str) -> str:
+    """نرمال‌سازی سؤال برای کلید کش: حروف فارسی یکسان، بدون علائم و فاصله‌های اضافه"""
+    text = deep_clean_farsi_text(question or "").lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def compute_data_version(data, category: str = None) -> str:
+    """نسخه‌ی داده‌ی کاربر بر اساس محتوا (برای رکوردهای قدیمی بدون data_version هم کار می‌کند)"""
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(f"{category or ''}:{raw}".encode("utf-8")).hexdigest()[:32]
+
+
+def source_data_version(content_hash: str, category: str = None, *settings) -> str:
+    """نسخه‌ی داده‌ای که از فایل آپلودی ساخته شده: از هش فایل و تنظیمات استخراج، بدون سریال‌کردن داده"""
+    raw = ":".join(str(s) for s in (category or "", content_hash, *settings))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def data_version_of(data, category: str = None) -> str:
+    if isinstance(data, dict) and data.get("data_version"):
+        return data["data_version"]
+    return compute_data_version(data, category)
+
+
+class MemoryAnswerBackend:
+    def __init__(self, max_items: int = ANSWER_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._items[key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(key)
+        evicted = 0
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    async def delete_prefix(self, prefix: str) -> int:
+        keys = [k for k in self._items if k.startswith(prefix)]
+        for k in keys:
+            del self._items[k]
+        return len(keys)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RedisAnswerBackend:
+    """کش مشترک بین پردازه‌ها؛ TTL با SETEX و LRU با maxmemory-policy خود Redis"""
+
+    def __init__(self, client, namespace: str = "answer_cache"):
+        self._redis = client
+        self._namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f"{self._namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(self._key(key))
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._redis.set(self._key(key), value, ex=max(int(ttl), 1))
+        return 0
+
+    async def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        pattern = _REDIS_GLOB.sub(r"\\\1", self._key(prefix)) + "*"
+        async for k in self._redis.scan_iter(match=pattern, count=500):
+            deleted += await self._redis.delete(k)
+        return deleted
+
+    def __len__(self):
+        return 0
+
+
+def _make_backend():
+    if ANSWER_CACHE_BACKEND == "redis":
+        try:
+            import redis.asyncio as aioredis
+            return RedisAnswerBackend(aioredis.from_url(REDIS_URL))
+        except ImportError:
+            logger.warning("⚠️ پکیج redis نصب نیست؛ کش پاسخ در حافظه نگه داشته می‌شود")
+    return MemoryAnswerBackend()
+
+
+class AnswerCache:
+    def __init__(self, backend=None, ttl: float = ANSWER_CACHE_TTL_SECONDS):
+        self.backend = backend if backend is not None else _make_backend()
+        self.ttl = ttl
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "errors": 0}
+
+    @staticmethod
+    def user_prefix(user_id: str) -> str:
+        """بخش کاربر در کلید؛ هش با طول ثابت، پس پیشوند یک کاربر با کاربر دیگری (مثلاً «a» و «a:b») یکی نمی‌شود"""
+        return hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32] + ":"
+
+    @classmethod
+    def make_key(cls, user_id: str, data_version: str, question: str) -> str:
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        return f"{cls.user_prefix(user_id)}{data_version}:{digest}"
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "backend": type(self.backend).__name__,
+            "items": len(self.backend),
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    # خطای backend (مثلاً قطع Redis) نباید /ask را از کار بیندازد
+    async def get(self, user_id: str, data_version: str, question: str) -> Optional[str]:
+        try:
+            value = await self.backend.get(self.make_key(user_id, data_version, question))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("⚠️ خطا در خواندن کش پاسخ", extra={"error": str(e)})
+            return None
+        self._stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def set(self, user_id: str, data_version: str, question: str, answer: str):
+        if not answer:
+            return
+        try:
+            evicted = await self.backend.set(self.make_key(user_id, data_version, question), answer, self.ttl)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("⚠️ خطا در ذخیره کش پاسخ", extra={"error": str(e)})
+            return
+        self._stats["stores"] += 1
+        self._stats["evictions"] += evicted or 0
+
+    async def invalidate_user(self, user_id: str):
+        """حذف همه‌ی پاسخ‌های کش‌شده‌ی کاربر (بعد از جایگزینی داده‌ها)"""
+        try:
+            removed = await self.backend.delete_prefix(self.user_prefix(user_id))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("⚠️ خطا در باطل کردن کش پاسخ", extra={"user_id": user_id, "error": str(e)})
+            return
+        self._stats["invalidations"] += removed
+
+
+answer_cache = AnswerCache()
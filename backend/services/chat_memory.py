@@ -0,0 +1,244 @@
+"""
+حافظه گفتگوی کاربران
+
+پیام‌ها در جدول chat_messages در Postgres ذخیره می‌شوند تا بعد از ری‌استارت
+باقی بمانند و همه‌ی workerهای uvicorn تاریخچه‌ی یکسانی ببینند. هر پردازه یک
+لایه‌ی LRU محدود (CHAT_MEMORY_MAX_USERS کاربر) با TTL کوتاه دارد؛ بعد از
+انقضای TTL تاریخچه دوباره از دیتابیس خوانده می‌شود، پس پیام‌هایی که worker
+دیگری نوشته حداکثر بعد از CHAT_MEMORY_TTL_SECONDS دیده می‌شوند.
+
+نوشتن write-behind است: append فقط لایه‌ی محلی را به‌روز می‌کند و پیام را در صف
+می‌گذارد؛ یک task پس‌زمینه هر CHAT_MEMORY_FLUSH_SECONDS (یا وقتی صف پر شد)
+همه را با یک INSERT چندسطری می‌نویسد و پیام‌های قدیمی‌تر از MAX_MEMORY را حذف
+می‌کند.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from config import (
+    MAX_MEMORY,
+    CHAT_MEMORY_MAX_USERS,
+    CHAT_MEMORY_TTL_SECONDS,
+    CHAT_MEMORY_FLUSH_SECONDS,
+    CHAT_MEMORY_FLUSH_BATCH,
+)
+from db_config import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE = text("""
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id BIGSERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+""")
+
+_CREATE_INDEX = text(
+    "CREATE INDEX IF NOT EXISTS chat_messages_user_idx ON chat_messages (user_id, id DESC)"
+)
+
+# اگر دیتابیس در دسترس نباشد، بیشتر از این پیام در صف نگه داشته نمی‌شود
+_MAX_PENDING = 10000
+
+
+class ChatMemoryStore:
+    def __init__(
+        self,
+        max_messages: int = MAX_MEMORY,
+        max_users: int = CHAT_MEMORY_MAX_USERS,
+        ttl: float = CHAT_MEMORY_TTL_SECONDS,
+        flush_interval: float = CHAT_MEMORY_FLUSH_SECONDS,
+        flush_batch: int = CHAT_MEMORY_FLUSH_BATCH,
+    ):
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        # user_id -> (loaded_at, messages, bytes)
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        # جمع پیام‌ها و بایت‌های لایه‌ی محلی؛ در _remember به‌روز می‌شوند تا stats پیمایش نکند
+        self._messages_cached = 0
+        self._bytes_cached = 0
+        self._pending: List[dict] = []
+        self._flushing: List[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "appended": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "dropped": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    async def start(self):
+        async with AsyncSessionLocal() as session:
+            await session.execute(_CREATE_TABLE)
+            await session.execute(_CREATE_INDEX)
+            await session.commit()
+        self._flush_now = asyncio.Event()
+        self._flush_task = asyncio.ensure_future(self._flush_loop())
+        logger.info("✅ Chat memory store started")
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        # پیام‌های باقیمانده قبل از خاموش شدن نوشته می‌شوند
+        await self.flush()
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "users_cached": len(self._local),
+            "messages_cached": self._messages_cached,
+            "bytes_cached": self._bytes_cached,
+            "pending_writes": len(self._pending) + len(self._flushing),
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    async def get_history(self, user_id: str) -> List[dict]:
+        """آخرین MAX_MEMORY پیام کاربر (کپی)"""
+        entry = self._local.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self._local.move_to_end(user_id)
+            self._stats["hits"] += 1
+            return list(entry[1])
+
+        self._stats["misses"] += 1
+        try:
+            messages = await self._load(user_id)
+        except Exception as e:
+            logger.warning("⚠️ خطا در خواندن حافظه گفتگو از دیتابیس", extra={"user_id": user_id, "error": str(e)})
+            return list(entry[1]) if entry is not None else []
+
+        # پیام‌هایی که هنوز flush نشده‌اند در دیتابیس نیستند
+        messages.extend(
+            {"role": p["role"], "content": p["content"]}
+            for p in self._flushing + self._pending if p["user_id"] == user_id
+        )
+        messages = messages[-self.max_messages:]
+        self._remember(user_id, messages)
+        return list(messages)
+
+    def append(self, user_id: str, messages: List[dict]):
+        """افزودن پیام‌ها به لایه‌ی محلی و صف نوشتن (بدون انتظار برای دیتابیس)"""
+        entry = self._local.get(user_id)
+        history = list(entry[1]) if entry is not None else []
+        history.extend(messages)
+        # زمان بارگذاری قبلی حفظ می‌شود تا پیام‌های workerهای دیگر هم به موقع خوانده شوند
+        loaded_at = entry[0] if entry is not None else float("-inf")
+        self._remember(user_id, history[-self.max_messages:], loaded_at)
+
+        for msg in messages:
+            self._pending.append({"user_id": user_id, "role": msg["role"], "content": msg["content"]})
+        self._stats["appended"] += len(messages)
+
+        if len(self._pending) > _MAX_PENDING:
+            overflow = len(self._pending) - _MAX_PENDING
+            del self._pending[:overflow]
+            self._stats["dropped"] += overflow
+        if len(self._pending) >= self.flush_batch and self._flush_now is not None:
+            self._flush_now.set()
+
+    def _remember(self, user_id: str, messages: List[dict], loaded_at: float = None):
+        size = sum(len(msg["content"].encode("utf-8")) for msg in messages)
+        old = self._local.get(user_id)
+        if old is not None:
+            self._forget(old)
+        self._local[user_id] = (time.monotonic() if loaded_at is None else loaded_at, messages, size)
+        self._local.move_to_end(user_id)
+        self._messages_cached += len(messages)
+        self._bytes_cached += size
+        while len(self._local) > self.max_users:
+            _, evicted = self._local.popitem(last=False)
+            self._forget(evicted)
+            self._stats["evictions"] += 1
+
+    def _forget(self, entry: tuple):
+        self._messages_cached -= len(entry[1])
+        self._bytes_cached -= entry[2]
+
+    async def _load(self, user_id: str) -> List[dict]:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                text("""
+                    SELECT role, content FROM chat_messages
+                    WHERE user_id = :uid
+                    ORDER BY id DESC
+                    LIMIT :limit
+                """),
+                {"uid": user_id, "limit": self.max_messages}
+            )
+            rows = result.fetchall()
+        return [{"role": r.role, "content": r.content} for r in reversed(rows)]
+
+    async def flush(self):
+        if not self._pending or self._flushing:
+            return
+        batch = self._flushing = self._pending
+        self._pending = []
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    text("INSERT INTO chat_messages (user_id, role, content) VALUES (:user_id, :role, :content)"),
+                    batch
+                )
+                # فقط MAX_MEMORY پیام آخر هر کاربر نگه داشته می‌شود
+                await session.execute(
+                    text("""
+                        DELETE FROM chat_messages c
+                        USING (
+                            SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY id DESC) AS rn
+                            FROM chat_messages
+                            WHERE user_id = ANY(:uids)
+                        ) ranked
+                        WHERE c.id = ranked.id AND ranked.rn > :keep
+                    """),
+                    {"uids": list({m["user_id"] for m in batch}), "keep": self.max_messages}
+                )
+                await session.commit()
+        except asyncio.CancelledError:
+            self._pending = batch + self._pending
+            raise
+        except Exception as e:
+            self._stats["flush_errors"] += 1
+            logger.warning("⚠️ خطا در ذخیره حافظه گفتگو", extra={"messages": len(batch), "error": str(e)})
+            # ترتیب پیام‌ها حفظ می‌شود؛ دفعه‌ی بعد دوباره تلاش می‌شود
+            self._pending = batch + self._pending
+            return
+        finally:
+            self._flushing = []
+
+        self._stats["flushes"] += 1
+        self._stats["flushed"] += len(batch)
+        self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+
+chat_memory = ChatMemoryStore()
+
@@ -0,0 +1,188 @@
+"""
+کش نتایج استخراج PDF بر اساس هش محتوای فایل
+
+دو لایه دارد: یک LRU محدود در حافظه و یک لایه‌ی پایدار روی دیسک (فایل‌های
+json فشرده). کلید از SHA-256 محتوای فایل، max_pages و نسخه‌ی استخراج‌کننده
+ساخته می‌شود، پس تغییر منطق استخراج با بالا بردن EXTRACTOR_VERSION کش را
+باطل می‌کند.
+
+فراخواننده‌ها نتیجه را تغییر می‌دهند (ادغام blocks، OCR و ...)، پس هم هنگام
+ذخیره و هم هنگام خواندن یک کپی عمیق جدا (خارج از event loop) ساخته می‌شود.
+حجم کل فایل‌های دیسک به صورت افزایشی نگه داشته می‌شود و پوشه فقط وقتی از
+سقف بگذرد پیمایش و هرس می‌شود.
+"""
+import asyncio
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import (
+    EXTRACTION_CACHE_MAX_ITEMS,
+    EXTRACTION_CACHE_DIR,
+    EXTRACTION_CACHE_DISK_MAX_MB,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def hash_content(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(
+        self,
+        max_items: int = EXTRACTION_CACHE_MAX_ITEMS,
+        cache_dir: Optional[str] = EXTRACTION_CACHE_DIR,
+        disk_max_mb: int = EXTRACTION_CACHE_DISK_MAX_MB,
+    ):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        # حجم فایل‌های کش روی دیسک؛ با اولین نوشتن یک بار شمرده می‌شود
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def make_key(content_hash: str, max_pages: Optional[int], version: str) -> str:
+        raw = f"{content_hash}:{max_pages or 'all'}:{version}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def stats(self) -> dict:
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        return {
+            **self._stats,
+            "memory_items": len(self._memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return await asyncio.to_thread(copy.deepcopy, value)
+
+        if self.cache_dir:
+            value = await asyncio.to_thread(self._read_disk, key)
+            if value is not None:
+                self._stats["disk_hits"] += 1
+                self._remember(key, await asyncio.to_thread(copy.deepcopy, value))
+                return value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        self._remember(key, await asyncio.to_thread(copy.deepcopy, value))
+        self._stats["stores"] += 1
+        if self.cache_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, value)
+            except Exception as e:
+                logger.warning("⚠️ خطا در ذخیره کش استخراج روی دیسک", extra={"error": str(e)})
+
+    def _remember(self, key: str, value: dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # برای حذف LRU روی دیسک
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("⚠️ فایل کش خراب است و حذف می‌شود", extra={"path": path, "error": str(e)})
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key: str, value: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk()[1]
+            else:
+                self._disk_bytes += size - replaced
+            if self._disk_bytes > self.disk_max_bytes:
+                self._prune_disk()
+
+    def _scan_disk(self) -> tuple:
+        """(فهرست (mtime, size, path)، حجم کل) همه‌ی فایل‌های کش روی دیسک"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return entries, total
+
+    def _prune_disk(self):
+        """حذف قدیمی‌ترین فایل‌ها تا زیر سقف (با _disk_lock صدا زده می‌شود)"""
+        entries, total = self._scan_disk()
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self._stats["evictions"] += 1
+        self._disk_bytes = total
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,298 @@
+"""
+استخر پردازه‌ها برای کارهای CPU-bound استخراج PDF
+
+هر worker یک پردازه‌ی جداگانه است که fitz / pdfplumber / RapidOCR را از قبل
+بارگذاری کرده و کارها را از طریق یک Pipe دریافت می‌کند. event loop فقط منتظر
+نتیجه می‌ماند؛ در صورت timeout یا لغو درخواست، فقط همان worker کشته و دوباره
+ساخته می‌شود و بقیه‌ی کارها ادامه پیدا می‌کنند.
+
+متریک‌هایی که کار در worker ثبت می‌کند (مثلاً زمان هر صفحه) همراه نتیجه
+برگردانده و در رجیستری پردازه‌ی اصلی جمع می‌شوند.
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import (
+    EXTRACTION_WORKERS,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_START_METHOD,
+    EXTRACTION_ACQUIRE_CHECK_SECONDS,
+    EXTRACTION_RESPAWN_MAX_DELAY,
+)
+from utils.metrics import metrics, STAGE_SECONDS
+from utils.profiling import active_profile, profiled_call
+from utils.logging_setup import setup_logging, shutdown_logging
+from utils.tracing import span, current_span, worker_context, traced_call, export_records
+
+_QUEUE_WAIT_SECONDS = STAGE_SECONDS.labels("extraction_queue_wait")
+logger = logging.getLogger(__name__)
+
+
+class ExtractionTimeout(Exception):
+    """زمان اجرای کار استخراج از حد مجاز گذشت"""
+
+
+class ExtractionWorkerError(Exception):
+    """پردازه‌ی worker در حین اجرای کار از بین رفت"""
+
+
+def _warm_imports():
+    # بارگذاری کتابخانه‌های سنگین (fitz, pdfplumber, RapidOCR) یک بار در هر پردازه
+    from services import pdf_extraction
+    pdf_extraction.get_ocr_engine()
+
+
+def _worker_main(conn):
+    """حلقه‌ی اصلی پردازه‌ی worker"""
+    setup_logging()
+    try:
+        _serve(conn)
+    finally:
+        # multiprocessing در پایان worker، atexit را اجرا نمی‌کند
+        shutdown_logging()
+
+
+def _serve(conn):
+    try:
+        _warm_imports()
+        conn.send(("ready", None))
+    except Exception as e:
+        conn.send(("error", RuntimeError(f"worker warm-up failed: {e}")))
+        return
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        fn, args, kwargs = job
+        try:
+            result = fn(*args, **kwargs)
+            message = ("ok", result, metrics.drain())
+        except Exception as e:
+            message = ("error", e, metrics.drain())
+
+        try:
+            conn.send(message)
+        except Exception:
+            # exception/نتیجه قابل pickle نبود
+            conn.send(("error", RuntimeError(traceback.format_exc()), message[2]))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        parent_conn, child_conn = ctx.Pipe()
+        self.conn = parent_conn
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+
+class ExtractionPool:
+    """استخر مدیریت‌شده با اندازه‌ی ثابت و timeout برای هر کار"""
+
+    def __init__(
+        self,
+        max_workers: int = EXTRACTION_WORKERS,
+        timeout: float = EXTRACTION_TIMEOUT,
+        start_method: str = EXTRACTION_START_METHOD,
+        acquire_check_interval: float = EXTRACTION_ACQUIRE_CHECK_SECONDS,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.acquire_check_interval = acquire_check_interval
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: set = set()
+        # taskهای ساخت دوباره‌ی worker (ارجاع نگه داشته می‌شود تا garbage collect نشوند)
+        self._respawns: set = set()
+        # تعداد taskهای ساخت دوباره که حداقل یک بار شکست خورده‌اند و در فاصله‌ی انتظارند
+        self._stalled_respawns = 0
+        self.respawn_failures = 0
+        # برای send/recv روی Pipe که blocking هستند
+        self._io = ThreadPoolExecutor(
+            max_workers=self.max_workers * 2,
+            thread_name_prefix="extraction-io",
+        )
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._started = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def stats(self) -> dict:
+        idle = self._idle.qsize() if self._idle is not None else 0
+        return {
+            "max_workers": self.max_workers,
+            "workers": len(self._workers),
+            "idle_workers": idle,
+            "busy_workers": max(len(self._workers) - idle, 0),
+            "respawning": len(self._respawns),
+            "respawn_failures": self.respawn_failures,
+        }
+
+    async def start(self):
+        """ساخت همه‌ی workerها و صبر تا گرم شدن کامل آن‌ها"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+            self._idle = asyncio.Queue()
+            workers = await asyncio.gather(*(self._spawn() for _ in range(self.max_workers)))
+            for worker in workers:
+                self._idle.put_nowait(worker)
+            self._started = True
+            logger.info("✅ Extraction pool started", extra={"workers": self.max_workers})
+
+    async def shutdown(self):
+        if not self._started:
+            return
+        self._started = False
+        for task in list(self._respawns):
+            task.cancel()
+        workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+        await asyncio.gather(*(self._discard(worker) for worker in workers))
+        self._io.shutdown(wait=False, cancel_futures=True)
+
+    async def _spawn(self) -> _Worker:
+        loop = asyncio.get_running_loop()
+        worker = _Worker(self._ctx)
+        self._workers.add(worker)
+        try:
+            status, payload = await loop.run_in_executor(self._io, worker.conn.recv)
+        except BaseException:
+            # worker قبل از ready از بین رفت (EOFError) یا ساخت لغو شد
+            await asyncio.shield(self._discard(worker))
+            raise
+        if status != "ready":
+            await self._discard(worker)
+            raise payload
+        return worker
+
+    async def _discard(self, worker: _Worker):
+        self._workers.discard(worker)
+        # kill تا 5 ثانیه join می‌کند
+        await asyncio.to_thread(worker.kill)
+
+    def _schedule_replace(self, worker: _Worker):
+        task = asyncio.ensure_future(self._replace(worker))
+        self._respawns.add(task)
+        task.add_done_callback(self._respawns.discard)
+
+    async def _replace(self, worker: _Worker):
+        """جایگزینی worker از دست رفته؛ تا موفقیت با فاصله‌ی افزایشی تکرار می‌شود"""
+        await self._discard(worker)
+        delay = 1.0
+        stalled = False
+        try:
+            while self._started:
+                try:
+                    self._idle.put_nowait(await self._spawn())
+                    return
+                except Exception as e:
+                    self.respawn_failures += 1
+                    if not stalled:
+                        stalled = True
+                        self._stalled_respawns += 1
+                    logger.warning("❌ Failed to respawn extraction worker", extra={"error": str(e), "retry_in": delay})
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, EXTRACTION_RESPAWN_MAX_DELAY)
+        finally:
+            if stalled:
+                self._stalled_respawns -= 1
+
+    def _exhausted(self) -> bool:
+        """هیچ worker زنده (یا در حال ساخت) نیست و همه‌ی ساخت‌های دوباره شکست خورده‌اند"""
+        return not self._started or (not self._workers and self._stalled_respawns >= len(self._respawns))
+
+    async def run(self, fn: Callable, *args, timeout: float = None, **kwargs) -> Any:
+        """اجرای fn(*args) در یک worker و برگرداندن نتیجه"""
+        with span(f"pool.{getattr(fn, '__name__', 'job')}"):
+            job_fn, job_args = fn, args
+            # درخواست در حال trace: spanهای worker همراه نتیجه برمی‌گردند
+            parent = worker_context()
+            if parent is not None:
+                job_fn, job_args = traced_call, (parent, fn, *args)
+
+            profile = active_profile()
+            if profile is not None and profile.profile_workers:
+                # درخواست در حال پروفایل: کار در worker زیر cProfile اجرا می‌شود
+                result, stats = await self._run(profiled_call, (job_fn, *job_args), kwargs, timeout, fn)
+                profile.worker_stats.append(stats)
+            else:
+                result = await self._run(job_fn, job_args, kwargs, timeout, fn)
+
+            if parent is not None:
+                result, spans = result
+                export_records(spans)
+            return result
+
+    async def _run(self, job_fn: Callable, args: tuple, kwargs: dict, timeout: Optional[float],
+                   fn: Callable) -> Any:
+        if not self._started:
+            await self.start()
+
+        loop = asyncio.get_running_loop()
+        waiting_since = time.perf_counter()
+        # زیر بار، کارهای طولانی (مثلاً shardهای یک PDF چندصدصفحه‌ای) می‌توانند همه‌ی
+        # workerها را مدت زیادی نگه دارند؛ فقط استخر بدون worker خطا می‌دهد
+        while True:
+            try:
+                worker = await asyncio.wait_for(self._idle.get(), self.acquire_check_interval)
+                break
+            except asyncio.TimeoutError:
+                if self._exhausted():
+                    raise ExtractionWorkerError(
+                        f"no extraction worker alive ({len(self._respawns)} respawns failing)"
+                    )
+        waited = time.perf_counter() - waiting_since
+        _QUEUE_WAIT_SECONDS.observe(waited)
+        current_span().set("queue_wait_ms", round(waited * 1000, 2))
+        healthy = False
+        try:
+            await loop.run_in_executor(self._io, worker.conn.send, (job_fn, args, kwargs))
+            status, payload, observed = await asyncio.wait_for(
+                loop.run_in_executor(self._io, worker.conn.recv),
+                timeout if timeout is not None else self.timeout,
+            )
+            healthy = True
+        except asyncio.TimeoutError:
+            raise ExtractionTimeout(f"{getattr(fn, '__name__', fn)} timed out")
+        except (EOFError, OSError, BrokenPipeError) as e:
+            raise ExtractionWorkerError(str(e))
+        finally:
+            if healthy:
+                self._idle.put_nowait(worker)
+            else:
+                # timeout، لغو درخواست یا مرگ worker: فقط همین worker جایگزین می‌شود
+                self._schedule_replace(worker)
+
+        metrics.merge(observed)
+        if status == "error":
+            raise payload
+        return payload
+
+
+extraction_pool = ExtractionPool()
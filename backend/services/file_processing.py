@@ -1,80 +1,64 @@
 import io
 import json
+import logging
 import chardet
-import tempfile
-import os
-import traceback
 from docx import Document
-from langchain_community.document_loaders import PyPDFLoader
+from services.pdf_document import PdfDocument
 from services.text_processing import deep_clean_farsi_text, looks_garbled
 
+logger = logging.getLogger(__name__)
+
 async def process_pdf(content: bytes, pages_to_process: int = None) -> dict:
     """پردازش فایل PDF با پشتیبانی از OCR"""
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_pdf:
-        tmp_pdf.write(content)
-        pdf_path = tmp_pdf.name
-
     context = ""
     context_blocks = []
     use_ocr = False
 
-    try:
-        # مرحله 1: استخراج متن با PyPDFLoader
+    # سند یک بار از حافظه باز می‌شود و هر دو مرحله از همان استفاده می‌کنند
+    with PdfDocument(content, pages_to_process) as doc:
+        # مرحله 1: استخراج لایه متنی
         try:
-            reader = PyPDFLoader(pdf_path)
-            pages = reader.load()
-            
-            if pages_to_process and len(pages) > pages_to_process:
-                pages = pages[:pages_to_process]
-                print(f"⚠️ محدود کردن صفحات به {pages_to_process} صفحه اول")
+            page_range = doc.pages_to_process()
+            if doc.page_limit < doc.page_count:
+                logger.info("⚠️ محدود کردن صفحات به صفحات اول", extra={"max_pages": pages_to_process})
 
-            print(f"✅ تعداد صفحات پیدا شده: {len(pages)}")
+            logger.info("✅ تعداد صفحات پیدا شده", extra={"pages": len(page_range)})
             
-            for page_num, page in enumerate(pages, 1):
-                page_text = page.page_content
+            for page_num in page_range:
+                page_text = doc.fitz_page(page_num).get_text()
                 cleaned_text = deep_clean_farsi_text(page_text)
                 if cleaned_text:
                     context += cleaned_text + "\n\n"
                     context_blocks.append({
-                        "page": page_num,
+                        "page": page_num + 1,
                         "text": cleaned_text,
                         "char_count": len(cleaned_text),
-                        "method": "pypdfloader"
+                        "method": "text_layer"
                     })
             
             # بررسی کیفیت متن استخراج شده
             total_chars = len(context.strip())
-            print(f"📊 تعداد کاراکترهای استخراج شده: {total_chars}")
+            logger.info("📊 تعداد کاراکترهای استخراج شده", extra={"chars": total_chars})
             
             if total_chars < 100 or looks_garbled(context):
-                print(f"⚠️ متن استخراج شده ناکافی یا نامناسب است")
+                logger.info("⚠️ متن استخراج شده ناکافی یا نامناسب است", extra={"chars": total_chars})
                 use_ocr = True
                 
         except Exception as e:
-            print(f"❌ خطا در PyPDFLoader: {str(e)}")
+            logger.warning("❌ خطا در استخراج لایه متنی", extra={"error": str(e)})
             use_ocr = True
 
-        # مرحله 2: اگر نیاز به OCR بود، از PyMuPDF استفاده می‌کنیم
+        # مرحله 2: اگر نیاز به OCR بود، از استخراج پیشرفته PyMuPDF استفاده می‌کنیم
         if use_ocr:
-            print("🔍 استفاده از PyMuPDF برای استخراج متن...")
             try:
-                import fitz  # PyMuPDF
-                
-                doc = fitz.open(pdf_path)
-                print(f"📄 تعداد صفحات در PyMuPDF: {len(doc)}")
-                
-                # تعیین محدوده صفحات
-                if pages_to_process and len(doc) > pages_to_process:
-                    page_range = range(min(pages_to_process, len(doc)))
-                else:
-                    page_range = range(len(doc))
+                logger.info("🔍 استفاده از PyMuPDF برای استخراج متن", extra={"pages_total": doc.page_count})
                 
                 # ریست کردن context
                 context = ""
                 context_blocks = []
                 
-                for page_num in page_range:
-                    page = doc.load_page(page_num)
+                for page_num in doc.pages_to_process():
+                    page = doc.fitz_page(page_num)
                     
                     # روش 1: استخراج متن ساده
                     text = page.get_text()
@@ -101,25 +85,12 @@ async def process_pdf(content: bytes, pages_to_process: int = None) -> dict:
                             "method": "pymupdf"
                         })
                 
-                doc.close()
-                print(f"✅ PyMuPDF: {len(context_blocks)} صفحه پردازش شد")
+                logger.info("✅ PyMuPDF: صفحات پردازش شد", extra={"pages": len(context_blocks)})
                 
-            except ImportError:
-                print("❌ PyMuPDF نصب نیست! لطفا آن را نصب کنید:")
-                print("   pip install pymupdf")
-                raise Exception("PyMuPDF نصب نیست. لطفا آن را نصب کنید.")
             except Exception as e:
-                print(f"❌ خطا در PyMuPDF: {str(e)}")
-                traceback.print_exc()
+                logger.exception("❌ خطا در PyMuPDF")
                 raise Exception(f"خطا در استخراج متن از PDF: {str(e)}")
 
-    finally:
-        # حذف فایل موقت
-        try:
-            os.unlink(pdf_path)
-        except Exception as e:
-            print(f"⚠️ خطا در حذف فایل موقت: {str(e)}")
-
     return {
         "extraction_method": "ocr" if use_ocr else "text",
         "total_characters": len(context),
@@ -0,0 +1,142 @@
+"""
+دریافت فایل آپلودی به صورت جریانی و با سقف حجم
+
+UploadSizeLimitMiddleware بدنه‌ی درخواست را هنگام دریافت می‌شمارد و فایل‌های
+بزرگ‌تر از MAX_FILE_SIZE_MB را قبل از دریافت کامل رد می‌کند (اگر Content-Length
+بزرگ باشد، حتی قبل از خواندن اولین بایت). Starlette قسمت فایل را تکه‌تکه در یک
+SpooledTemporaryFile می‌نویسد و ingest_upload همان را تکه‌تکه می‌خواند، هش
+SHA-256 را به‌صورت افزایشی حساب می‌کند و نوع فایل را از magic bytes تشخیص
+می‌دهد. bytes کامل فقط یک بار و فقط وقتی پردازش لازم است ساخته می‌شود.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from config import MAX_FILE_SIZE_MB, UPLOAD_CHUNK_SIZE
+from utils.tracing import traced, current_span
+
+MAX_UPLOAD_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# فضای اضافه برای فیلدهای فرم و boundaryهای multipart
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        super().__init__(
+            status_code=413,
+            detail=f"حجم فایل بیشتر از حد مجاز ({max_bytes // (1024 * 1024)} مگابایت) است"
+        )
+
+
+class InvalidUpload(Exception):
+    """محتوای فایل با نوع اعلام‌شده (پسوند) همخوانی ندارد"""
+
+
+def sniff_file_type(head: bytes, filename: str) -> Optional[str]:
+    """تشخیص نوع فایل از چند بایت اول؛ پسوند فقط برای فرمت‌های متنی ملاک است"""
+    filename = (filename or "").lower()
+
+    # بعضی PDFها قبل از هدر چند بایت اضافه دارند
+    if b"%PDF-" in head[:1024]:
+        return "pdf"
+    if filename.endswith(".pdf"):
+        raise InvalidUpload("فایل PDF نامعتبر است یا قابل خواندن نیست")
+
+    if filename.endswith(".docx"):
+        if head.startswith(b"PK\x03\x04"):
+            return "docx"
+        raise InvalidUpload("فایل DOCX نامعتبر است")
+
+    if filename.endswith(".json"):
+        return "json"
+    if filename.endswith(".txt"):
+        return "txt"
+    return None
+
+
+class IngestedUpload:
+    def __init__(self, file: UploadFile, size: int, content_hash: str, file_type: Optional[str]):
+        self._file = file
+        self.filename = file.filename or ""
+        self.size = size
+        self.content_hash = content_hash
+        self.file_type = file_type
+        self._content: Optional[bytes] = None
+
+    async def read(self) -> bytes:
+        """bytes کامل فایل (یک بار ساخته و نگه داشته می‌شود)"""
+        if self._content is None:
+            await self._file.seek(0)
+            self._content = await self._file.read()
+        return self._content
+
+
+@traced("upload.ingest")
+async def ingest_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedUpload:
+    """خواندن تکه‌تکه‌ی فایل: بررسی حجم، هش افزایشی و تشخیص نوع"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if not head:
+            head = chunk[:2048]
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+
+    file_type = sniff_file_type(head, file.filename)
+    current_span().set_attributes(bytes=size, file_type=file_type)
+    return IngestedUpload(file, size, digest.hexdigest(), file_type)
+
+
+class UploadSizeLimitMiddleware:
+    """رد کردن بدنه‌های بزرگ‌تر از سقف مجاز قبل از دریافت کامل"""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # HTTPException است تا FastAPI آن را به خطای 400 تبدیل نکند
+                    raise UploadTooLarge(self.max_bytes - MULTIPART_OVERHEAD_BYTES)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        error = UploadTooLarge(self.max_bytes - MULTIPART_OVERHEAD_BYTES).detail
+        payload = json.dumps({"error": error}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -1,73 +1,242 @@
+import asyncio
+import logging
 import os
-from azure.ai.inference import ChatCompletionsClient
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+from azure.ai.inference.aio import ChatCompletionsClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport
 from azure.ai.inference.models import UserMessage
 from dotenv import load_dotenv
 from utils.helpers import estimate_tokens
+from utils.metrics import metrics, STAGE_SECONDS
+from utils.tracing import span, start_span, NOOP_SPAN
+from config import (
+    LLM_ENDPOINT,
+    LLM_MODEL,
+    LLM_MAX_CONCURRENCY,
+    LLM_KEEPALIVE_SECONDS,
+    LLM_READ_TIMEOUT,
+)
 
 load_dotenv()
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-ENDPOINT = "https://models.inference.ai.azure.com"
-MODEL_NAME = "gpt-4o"
+ENDPOINT = LLM_ENDPOINT
+MODEL_NAME = LLM_MODEL
 
-async def github_llm(prompt: str) -> str:
+LLM_SECONDS = metrics.histogram(
+    "yaroo_llm_request_duration_seconds",
+    "github_llm / github_llm_stream duration including the wait for a concurrency slot",
+    ["mode"],
+)
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "yaroo_llm_time_to_first_token_seconds",
+    "Time until the first streamed token of github_llm_stream",
+)
+LLM_PROMPT_TOKENS = metrics.histogram(
+    "yaroo_llm_prompt_tokens",
+    "Estimated prompt tokens sent to the model (before truncation)",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 12000, 16000, 32000),
+)
+_SLOT_WAIT_SECONDS = STAGE_SECONDS.labels("llm_queue_wait")
+logger = logging.getLogger(__name__)
+
+def _limit_prompt(prompt: str, llm_span=NOOP_SPAN) -> str:
     estimated_tokens = estimate_tokens(prompt)
-    print(f"📊 تخمین تعداد توکن‌های پرامپت: {estimated_tokens}")
+    LLM_PROMPT_TOKENS.observe(estimated_tokens)
 
-    if estimated_tokens > 7000:
-        print(f"⚠️ پرامپت خیلی بزرگ است ({estimated_tokens} توکن). در حال کوتاه کردن...")
+    truncated = estimated_tokens > 7000
+    if truncated:
+        logger.warning("⚠️ پرامپت خیلی بزرگ است؛ در حال کوتاه کردن", extra={"prompt_tokens": estimated_tokens})
         prompt = prompt[:28000]
+    llm_span.set_attributes(prompt_tokens=estimated_tokens, truncated=truncated)
+    return prompt
 
-    client = ChatCompletionsClient(
-        endpoint=ENDPOINT,
-        credential=AzureKeyCredential(GITHUB_TOKEN)
-    )
-
-    # system prompt engineering.
-    system_instruction = (
-        "تو یک دستیار هوشمند، فوق‌العاده متخصص و در عین حال یک رفیق صمیمی و 'خاکی' هستی. "
-        "نام تو محفوظ است اما لحن تو باید کاملاً دوستانه و محاوره‌ای (Persian Informal) باشد. "
-        "فکر کن داری با بهترین دوستت چت می‌کنی.\n\n"
-        
-        "اصول شخصیتی تو:\n"
-        "1. **باهوش و عمیق**: سطحی جواب نده. اگر سوال فنی یا علمی پرسید، مثل یک متخصص جواب بده اما با زبان ساده.\n"
-        "2. **صمیمی و مشتی**: از کلمات کتابی استفاده نکن. به جای 'من می‌توانم'، بگو 'در خدمتم، بگو ببینم چیکار می‌تونیم بکنیم'.\n"
-        "3. **همدل و همراه**: اگر کاربر خسته بود یا مشکلی داشت، بهش انرژی بده. تو فقط یک کد نیستی، تو رفیقشی.\n"
-        "4. **رک و راست**: اگر چیزی را نمی‌دانی، خیلی راحت بگو، اما سعی کن با هم راه‌حلی براش پیدا کنید.\n\n"
-        
-        "دستورالعمل نگارشی:\n"
-        "- از ایموجی‌ها به جا و درست استفاده کن (نه خیلی زیاد، نه خیلی کم) ✨.\n"
-        "- جملاتت رو کوتاه و قابل فهم نگه دار.\n"
-        "- لحنت نباید چاپلوسانه باشه، باید مقتدر اما رفیقانه باشه."
-    )
-
-    final_text = ""
 
-    try:
-        response = client.complete(
-            stream=False,
-            messages=[
-                # system message
-                {"role": "system", "content": system_instruction},
-                # user message
-                {"role": "user", "content": prompt}
-            ],
-            model=MODEL_NAME,
-            temperature=0.7 # temperature for creativity
+# system prompt engineering.
+SYSTEM_INSTRUCTION = (
+    "تو یک دستیار هوشمند، فوق‌العاده متخصص و در عین حال یک رفیق صمیمی و 'خاکی' هستی. "
+    "نام تو محفوظ است اما لحن تو باید کاملاً دوستانه و محاوره‌ای (Persian Informal) باشد. "
+    "فکر کن داری با بهترین دوستت چت می‌کنی.\n\n"
+    
+    "اصول شخصیتی تو:\n"
+    "1. **باهوش و عمیق**: سطحی جواب نده. اگر سوال فنی یا علمی پرسید، مثل یک متخصص جواب بده اما با زبان ساده.\n"
+    "2. **صمیمی و مشتی**: از کلمات کتابی استفاده نکن. به جای 'من می‌توانم'، بگو 'در خدمتم، بگو ببینم چیکار می‌تونیم بکنیم'.\n"
+    "3. **همدل و همراه**: اگر کاربر خسته بود یا مشکلی داشت، بهش انرژی بده. تو فقط یک کد نیستی، تو رفیقشی.\n"
+    "4. **رک و راست**: اگر چیزی را نمی‌دانی، خیلی راحت بگو، اما سعی کن با هم راه‌حلی براش پیدا کنید.\n\n"
+    
+    "دستورالعمل نگارشی:\n"
+    "- از ایموجی‌ها به جا و درست استفاده کن (نه خیلی زیاد، نه خیلی کم) ✨.\n"
+    "- جملاتت رو کوتاه و قابل فهم نگه دار.\n"
+    "- لحنت نباید چاپلوسانه باشه، باید مقتدر اما رفیقانه باشه."
+)
+
+
+def _build_messages(prompt: str) -> list:
+    return [
+        # system message
+        {"role": "system", "content": SYSTEM_INSTRUCTION},
+        # user message
+        {"role": "user", "content": prompt}
+    ]
+
+
+async def _close(obj):
+    # پاسخ جریانی aio متد aclose دارد و کلاینت‌ها close
+    close_fn = getattr(obj, "aclose", None) or getattr(obj, "close", None)
+    if close_fn:
+        if callable(close_fn):
+            maybe_awaitable = close_fn()
+            if hasattr(maybe_awaitable, "__await__"):
+                await maybe_awaitable
+
+
+class LLMClient:
+    """یک کلاینت async مشترک برای کل پردازه
+
+    اتصال‌های HTTP (و TLS) در یک aiohttp.ClientSession نگه داشته و دوباره
+    استفاده می‌شوند. حداکثر LLM_MAX_CONCURRENCY درخواست همزمان به مدل فرستاده
+    می‌شود و بقیه پشت semaphore در صف می‌مانند.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._client: Optional[ChatCompletionsClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                keepalive_timeout=LLM_KEEPALIVE_SECONDS,
+            ),
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=LLM_READ_TIMEOUT),
+        )
+        self._client = ChatCompletionsClient(
+            endpoint=ENDPOINT,
+            credential=AzureKeyCredential(GITHUB_TOKEN),
+            transport=AioHttpTransport(session=self._session, session_owner=False),
         )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.info("✅ LLM client started", extra={"max_concurrency": self.max_concurrency})
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+        }
 
+    async def close(self):
+        if self._client is not None:
+            await _close(self._client)
+            self._client = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @asynccontextmanager
+    async def _slot(self):
+        await self.start()
+        self.waiting += 1
+        waiting_since = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            _SLOT_WAIT_SECONDS.observe(time.perf_counter() - waiting_since)
+        self.in_flight += 1
+        try:
+            yield self._client
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def complete(self, prompt: str) -> str:
+        async with self._slot() as client:
+            response = await client.complete(
+                stream=False,
+                messages=_build_messages(prompt),
+                model=MODEL_NAME,
+                temperature=0.7 # temperature for creativity
+            )
         if response.choices and response.choices[0].message and response.choices[0].message.content:
-            final_text = response.choices[0].message.content
+            return response.choices[0].message.content
+        return ""
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """جایگاه همزمانی تا پایان جریان (یا بسته شدن آن) نگه داشته می‌شود"""
+        async with self._slot() as client:
+            response = await client.complete(
+                stream=True,
+                messages=_build_messages(prompt),
+                model=MODEL_NAME,
+                temperature=0.7 # temperature for creativity
+            )
+            try:
+                async for update in response:
+                    if update.choices and update.choices[0].delta and update.choices[0].delta.content:
+                        yield update.choices[0].delta.content
+            finally:
+                await _close(response)
+
+
+llm_client = LLMClient()
+
+
+async def github_llm(prompt: str) -> str:
+    with span("llm.complete", model=MODEL_NAME) as s:
+        prompt = _limit_prompt(prompt, s)
+
+        try:
+            with LLM_SECONDS.labels("complete").time():
+                final_text = await llm_client.complete(prompt)
+        except Exception as e:
+            raise Exception(f"Azure AI Inference returned error: {str(e)}")
+
+        s.set("response_chars", len(final_text))
+        return final_text.strip()
+
 
-    except Exception as e:
-        raise Exception(f"Azure AI Inference returned error: {str(e)}")
+async def github_llm_stream(prompt: str) -> AsyncIterator[str]:
+    """تولید پاسخ به صورت جریانی؛ هر قطعه‌ی متن همان لحظه که مدل تولید می‌کند yield می‌شود
+
+    اگر مصرف‌کننده زودتر متوقف شود (مثلاً قطع اتصال کاربر)، پاسخ upstream بسته
+    می‌شود تا تولید ادامه پیدا نکند.
+    """
+    # span جاری نمی‌شود: generator بین yieldها در context مصرف‌کننده اجرا می‌شود
+    llm_span = start_span("llm.stream", model=MODEL_NAME)
+    prompt = _limit_prompt(prompt, llm_span)
+
+    started = time.perf_counter()
+    tokens = llm_client.stream(prompt)
+    response_chars = 0
+    try:
+        try:
+            first = await tokens.__anext__()
+        except StopAsyncIteration:
+            return
+        except Exception as e:
+            llm_span.record_error(e)
+            raise Exception(f"Azure AI Inference returned error: {str(e)}")
+        first_token = time.perf_counter() - started
+        LLM_FIRST_TOKEN_SECONDS.observe(first_token)
+        llm_span.set("ttft_ms", round(first_token * 1000, 2))
+        response_chars += len(first)
+        yield first
+        async for delta in tokens:
+            response_chars += len(delta)
+            yield delta
     finally:
-        close_fn = getattr(client, "close", None)
-        if close_fn:
-            if callable(close_fn):
-                maybe_awaitable = close_fn()
-                if hasattr(maybe_awaitable, "__await__"):
-                    await maybe_awaitable
-
-    return final_text.strip()
+        await tokens.aclose()
+        LLM_SECONDS.labels("stream").observe(time.perf_counter() - started)
+        llm_span.end(response_chars=response_chars)
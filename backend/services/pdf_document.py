@@ -0,0 +1,209 @@
+"""
+سند PDF در حافظه که یک بار باز می‌شود و بین همه‌ی استخراج‌کننده‌ها مشترک است
+
+به جای نوشتن فایل موقت و باز کردن دوباره‌ی آن توسط هر کتابخانه، bytes فایل
+مستقیماً با fitz (stream=) و pdfplumber (BytesIO) باز می‌شود. هر worker
+سندهای اخیر را باز نگه می‌دارد، پس نمونه‌گیری، shardها و OCR همان فایل
+دوباره parse نمی‌شوند.
+
+process_pdf_advanced سند را با spooled_document یک بار در PDF_SPOOL_DIR (با
+نام هش) می‌نویسد و کارهای extraction_pool فقط مسیر و هش را می‌فرستند؛ worker
+فقط وقتی سند را باز ندارد فایل را باز می‌کند، پس bytes فایل (تا سقف حجم
+آپلود) برای هر کار دوباره از Pipe عبور نمی‌کند.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import fitz
+import pdfplumber
+
+from config import PDF_SPOOL_DIR
+from utils.metrics import STAGE_SECONDS
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def select_pages(total_pages: int, max_pages: int = None, pages: List[int] = None) -> List[int]:
+    """شماره صفحات (از صفر) که باید پردازش شوند؛ pages برای پردازش یک بازه‌ی مشخص است"""
+    limit = min(max_pages, total_pages) if max_pages else total_pages
+    if pages is None:
+        return list(range(limit))
+    return [p for p in pages if 0 <= p < limit]
+
+
+class PdfDocument:
+    def __init__(self, content: Optional[bytes], max_pages: int = None, content_hash: str = None,
+                 path: str = None):
+        self.content = content
+        self.max_pages = max_pages
+        self.content_hash = content_hash or hashlib.sha256(content).hexdigest()
+        # نسخه‌ی spool‌شده‌ی همین bytes (spooled_document)
+        self.path = path
+        self._fitz_doc = None
+        self._plumber_doc = None
+
+    # فقط bytes (یا مسیر فایل spool‌شده) و تنظیمات بین پردازه‌ها جابه‌جا می‌شوند، نه اشیای باز fitz/pdfplumber
+    def __getstate__(self):
+        return {
+            "content": None if self.path else self.content,
+            "path": self.path,
+            "max_pages": self.max_pages,
+            "content_hash": self.content_hash,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["content"], state["max_pages"], state["content_hash"], state["path"])
+
+    @property
+    def size(self) -> int:
+        return len(self.content) if self.content is not None else os.path.getsize(self.path)
+
+    @property
+    def fitz(self) -> "fitz.Document":
+        if self._fitz_doc is None:
+            if self.content is None:
+                self._fitz_doc = fitz.open(self.path, filetype="pdf")
+            else:
+                self._fitz_doc = fitz.open(stream=self.content, filetype="pdf")
+        return self._fitz_doc
+
+    @property
+    def plumber(self) -> "pdfplumber.PDF":
+        if self._plumber_doc is None:
+            self._plumber_doc = pdfplumber.open(self.path if self.content is None else io.BytesIO(self.content))
+        return self._plumber_doc
+
+    @property
+    def page_count(self) -> int:
+        return len(self.fitz)
+
+    @property
+    def page_limit(self) -> int:
+        """تعداد صفحاتی که با توجه به max_pages پردازش می‌شوند"""
+        return len(select_pages(self.page_count, self.max_pages))
+
+    def pages_to_process(self, pages: List[int] = None) -> List[int]:
+        return select_pages(self.page_count, self.max_pages, pages)
+
+    def fitz_page(self, page_num: int) -> "fitz.Page":
+        return self.fitz.load_page(page_num)
+
+    def plumber_page(self, page_num: int):
+        return self.plumber.pages[page_num]
+
+    def close(self):
+        if self._fitz_doc is not None:
+            self._fitz_doc.close()
+            self._fitz_doc = None
+        if self._plumber_doc is not None:
+            self._plumber_doc.close()
+            self._plumber_doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# سندهای باز در همین پردازه (در workerهای extraction_pool)
+_OPEN_DOCUMENTS_LIMIT = 2
+_open_documents: "OrderedDict[str, PdfDocument]" = OrderedDict()
+
+
+def open_document(doc: PdfDocument) -> PdfDocument:
+    """نسخه‌ی باز سند در این پردازه؛ سند تکراری دوباره parse نمی‌شود"""
+    cached = _open_documents.get(doc.content_hash)
+    if cached is not None:
+        # کارها در هر worker پشت سر هم اجرا می‌شوند، پس تغییر محدودیت صفحات امن است
+        cached.max_pages = doc.max_pages
+        _open_documents.move_to_end(doc.content_hash)
+        return cached
+
+    with span("pdf.open", bytes=doc.size, spooled=doc.content is None) as s:
+        doc.fitz  # PDF نامعتبر همین‌جا خطا می‌دهد و در کش نمی‌ماند
+        s.set("page_count", doc.fitz.page_count)
+    _open_documents[doc.content_hash] = doc
+    while len(_open_documents) > _OPEN_DOCUMENTS_LIMIT:
+        _, old = _open_documents.popitem(last=False)
+        old.close()
+    return doc
+
+
+def count_document_pages(doc: PdfDocument) -> int:
+    with STAGE_SECONDS.labels("count_pdf_pages").time():
+        return open_document(doc).page_count
+
+
+def count_pdf_pages(pdf_bytes: bytes, content_hash: Optional[str] = None) -> int:
+    try:
+        with STAGE_SECONDS.labels("count_pdf_pages").time():
+            return open_document(PdfDocument(pdf_bytes, content_hash=content_hash)).page_count
+    except Exception as e:
+        logger.warning("Error counting PDF pages", extra={"error": str(e)})
+        return 0
+
+
+# ----------------------------
+# Spool (فقط در پردازه‌ی اصلی)
+# ----------------------------
+# content_hash → [تعداد استفاده‌ی همزمان، task نوشتن فایل]
+_spooled: dict = {}
+
+
+def _write_spool(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _remove_spool(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+@asynccontextmanager
+async def spooled_document(content: bytes, max_pages: int = None, content_hash: str = None):
+    """سندی که کارهای extraction_pool فقط مسیرش را می‌فرستند
+
+    آپلودهای همزمان همان فایل یک نسخه‌ی مشترک دارند و فایل با پایان آخرین
+    استفاده حذف می‌شود. اگر نوشتن ممکن نباشد، سند معمولی (با bytes) برمی‌گردد.
+    """
+    content_hash = content_hash or hashlib.sha256(content).hexdigest()
+    path = os.path.join(PDF_SPOOL_DIR, f"{content_hash}.pdf")
+    entry = _spooled.get(content_hash)
+    if entry is None:
+        entry = _spooled[content_hash] = [0, asyncio.ensure_future(asyncio.to_thread(_write_spool, path, content))]
+    entry[0] += 1
+    try:
+        try:
+            await asyncio.shield(entry[1])
+            doc = PdfDocument(content, max_pages, content_hash, path)
+        except OSError as e:
+            logger.warning("⚠️ نوشتن PDF در spool ناموفق بود؛ bytes به هر کار فرستاده می‌شود", extra={"error": str(e)})
+            doc = PdfDocument(content, max_pages, content_hash)
+        yield doc
+    finally:
+        entry[0] -= 1
+        if entry[0] == 0:
+            del _spooled[content_hash]
+            await asyncio.to_thread(_remove_spool, path)
@@ -1,35 +1,99 @@
-import io
-import tempfile
-import os
+import asyncio
+import logging
 import re
+import math
+import time
+from typing import List
 import fitz  
-import pdfplumber
-from services.text_processing import deep_clean_farsi_text
+from services.text_processing import (
+    clean_extracted_text,
+    fix_farsi_text_issues,
+    normalize_farsi_text,
+    garbled_ratio,
+)
+from services.extraction_pool import extraction_pool, ExtractionTimeout
+from services.extraction_cache import extraction_cache, hash_content
+from services.pdf_document import (
+    PdfDocument,
+    open_document,
+    select_pages,
+    count_pdf_pages,
+    count_document_pages,
+    spooled_document,
+)
+from config import (
+    EXTRACTION_SHARD_MIN_PAGES,
+    EXTRACTION_SAMPLE_PAGES,
+    EXTRACTION_DEGRADE_RATIO,
+    OCR_MIN_PAGE_CHARS,
+    OCR_GARBLED_RATIO,
+)
+from utils.metrics import metrics, STAGE_SECONDS
+from utils.tracing import start_span, span
 import arabic_reshaper
 from bidi.algorithm import get_display
 
+logger = logging.getLogger(__name__)
+
+# با هر تغییر در منطق استخراج بالا برود تا کش نتایج قبلی باطل شود
+EXTRACTOR_VERSION = "5"
+
 # Try to import RapidOCR, handle case if not installed yet
 try:
     from rapidocr_onnxruntime import RapidOCR
-    ocr_engine = RapidOCR()
     HAS_OCR = True
 except ImportError:
     HAS_OCR = False
-    print("⚠️ RapidOCR not installed. OCR fallback will be disabled.")
+    logger.warning("⚠️ RapidOCR not installed. OCR fallback will be disabled.")
+
+# موتور OCR فقط در پردازه‌های extraction_pool ساخته می‌شود
+_ocr_engine = None
+
+def get_ocr_engine():
+    global _ocr_engine
+    if _ocr_engine is None and HAS_OCR:
+        _ocr_engine = RapidOCR()
+    return _ocr_engine
 
-def extract_with_pymupdf(pdf_path: str, max_pages: int = None) -> dict:
+# در workerها ثبت و همراه نتیجه‌ی هر کار به پردازه‌ی اصلی فرستاده می‌شوند
+EXTRACTOR_SECONDS = metrics.histogram(
+    "yaroo_extractor_duration_seconds",
+    "Duration of one extractor run (one shard or sample) inside an extraction worker",
+    ["extractor"],
+)
+EXTRACTOR_PAGE_SECONDS = metrics.histogram(
+    "yaroo_extractor_page_duration_seconds",
+    "Duration of extracting a single page, including normalization",
+    ["extractor"],
+)
+_PYMUPDF_PAGE_SECONDS = EXTRACTOR_PAGE_SECONDS.labels("pymupdf")
+_PDFPLUMBER_PAGE_SECONDS = EXTRACTOR_PAGE_SECONDS.labels("pdfplumber")
+_OCR_PAGE_SECONDS = EXTRACTOR_PAGE_SECONDS.labels("ocr")
+
+def extract_pages(extractor, doc: PdfDocument, pages: List[int] = None) -> dict:
+    """اجرای یک استخراج‌کننده در worker روی نسخه‌ی باز سند (بدون parse دوباره)"""
+    name = extractor.__name__.replace("extract_with_", "")
+    with EXTRACTOR_SECONDS.labels(name).time(), span(f"extract.{name}") as s:
+        result = extractor(open_document(doc), pages)
+        s.set_attributes(
+            pages=len(pages) if pages is not None else None,
+            success=result["success"],
+            chars=result.get("total_chars"),
+        )
+        return result
+
+def extract_with_pymupdf(doc: PdfDocument, pages: List[int] = None) -> dict:
     """استخراج متن با PyMuPDF - بهترین روش برای فارسی"""
     context = ""
     context_blocks = []
     
     try:
-        doc = fitz.open(pdf_path)
-        total_pages = len(doc)
-        
-        page_range = range(min(max_pages, total_pages)) if max_pages else range(total_pages)
+        page_range = doc.pages_to_process(pages)
         
         for page_num in page_range:
-            page = doc.load_page(page_num)
+            page_started = time.perf_counter()
+            page_span = start_span("page", page=page_num + 1)
+            page = doc.fitz_page(page_num)
             
             # روش 1: استخراج با حفظ layout
             text = page.get_text("text", sort=True)
@@ -98,9 +162,7 @@ def extract_with_pymupdf(pdf_path: str, max_pages: int = None) -> dict:
             
             if text:
                 # اصلاح و پاکسازی متن
-                text = fix_farsi_text_issues(text)
-                text = normalize_farsi_text(text)
-                cleaned_text = deep_clean_farsi_text(text)
+                cleaned_text = clean_extracted_text(text)
                 
                 if cleaned_text and len(cleaned_text.strip()) > 10:
                     context += cleaned_text + "\n\n"
@@ -111,8 +173,8 @@ def extract_with_pymupdf(pdf_path: str, max_pages: int = None) -> dict:
                         "word_count": len(cleaned_text.split()),
                         "method": "pymupdf_advanced"
                     })
-        
-        doc.close()
+            _PYMUPDF_PAGE_SECONDS.observe(time.perf_counter() - page_started)
+            page_span.end(chars=len(text or ""))
         
         return {
             "success": True,
@@ -124,56 +186,56 @@ def extract_with_pymupdf(pdf_path: str, max_pages: int = None) -> dict:
         }
         
     except Exception as e:
-        print(f"❌ خطا در PyMuPDF: {str(e)}")
+        logger.exception("❌ خطا در PyMuPDF")
         return {"success": False, "error": str(e)}
 
-def extract_with_pdfplumber(pdf_path: str, max_pages: int = None) -> dict:
+def extract_with_pdfplumber(doc: PdfDocument, pages: List[int] = None) -> dict:
     """استخراج با pdfplumber - دقیق برای layout"""
     context = ""
     context_blocks = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            total_pages = len(pdf.pages)
-            pages_to_process = min(max_pages, total_pages) if max_pages else total_pages
+        page_range = doc.pages_to_process(pages)
+        
+        for page_num in page_range:
+            page_started = time.perf_counter()
+            page_span = start_span("page", page=page_num + 1)
+            page = doc.plumber_page(page_num)
             
-            for page_num in range(pages_to_process):
-                page = pdf.pages[page_num]
-                
-                # استخراج با تنظیمات بهینه برای فارسی
-                text = page.extract_text(
-                    x_tolerance=2,
-                    y_tolerance=2,
-                    layout=True,
-                    x_density=7.25,
-                    y_density=13
-                )
-                
-                # اگر نتیجه خوب نبود، از روش دیگر استفاده کن
-                if not text or len(text.strip()) < 50:
-                    text = page.extract_text()
-                
-                # استخراج جداول هم اگر وجود داشت
-                tables = page.extract_tables()
-                if tables:
-                    for table in tables:
-                        table_text = "\n".join([" | ".join([str(cell) if cell else "" for cell in row]) for row in table])
-                        text += f"\n\n{table_text}"
+            # استخراج با تنظیمات بهینه برای فارسی
+            text = page.extract_text(
+                x_tolerance=2,
+                y_tolerance=2,
+                layout=True,
+                x_density=7.25,
+                y_density=13
+            )
+            
+            # اگر نتیجه خوب نبود، از روش دیگر استفاده کن
+            if not text or len(text.strip()) < 50:
+                text = page.extract_text()
+            
+            # استخراج جداول هم اگر وجود داشت
+            tables = page.extract_tables()
+            if tables:
+                for table in tables:
+                    table_text = "\n".join([" | ".join([str(cell) if cell else "" for cell in row]) for row in table])
+                    text += f"\n\n{table_text}"
+            
+            if text:
+                cleaned_text = clean_extracted_text(text)
                 
-                if text:
-                    text = fix_farsi_text_issues(text)
-                    text = normalize_farsi_text(text)
-                    cleaned_text = deep_clean_farsi_text(text)
-                    
-                    if cleaned_text and len(cleaned_text.strip()) > 10:
-                        context += cleaned_text + "\n\n"
-                        context_blocks.append({
-                            "page": page_num + 1,
-                            "text": cleaned_text,
-                            "char_count": len(cleaned_text),
-                            "word_count": len(cleaned_text.split()),
-                            "method": "pdfplumber"
-                        })
+                if cleaned_text and len(cleaned_text.strip()) > 10:
+                    context += cleaned_text + "\n\n"
+                    context_blocks.append({
+                        "page": page_num + 1,
+                        "text": cleaned_text,
+                        "char_count": len(cleaned_text),
+                        "word_count": len(cleaned_text.split()),
+                        "method": "pdfplumber"
+                    })
+            _PDFPLUMBER_PAGE_SECONDS.observe(time.perf_counter() - page_started)
+            page_span.end(chars=len(text or ""), tables=len(tables or ()))
         
         return {
             "success": True,
@@ -185,10 +247,10 @@ def extract_with_pdfplumber(pdf_path: str, max_pages: int = None) -> dict:
         }
         
     except Exception as e:
-        print(f"❌ خطا در pdfplumber: {str(e)}")
+        logger.exception("❌ خطا در pdfplumber")
         return {"success": False, "error": str(e)}
 
-def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
+def extract_with_ocr(doc: PdfDocument, pages: List[int] = None) -> dict:
     """استخراج متن با OCR - برای فایل‌های اسکن شده"""
     if not HAS_OCR:
         return {"success": False, "error": "Library rapidocr-onnxruntime not installed"}
@@ -197,14 +259,14 @@ def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
     context_blocks = []
     
     try:
-        doc = fitz.open(pdf_path)
-        total_pages = len(doc)
-        pages_to_process = min(max_pages, total_pages) if max_pages else total_pages
+        page_range = doc.pages_to_process(pages)
         
-        print(f"📷 شروع پردازش OCR برای {pages_to_process} صفحه...")
+        logger.debug("📷 شروع پردازش OCR", extra={"pages": len(page_range)})
         
-        for page_num in range(pages_to_process):
-            page = doc.load_page(page_num)
+        for page_num in page_range:
+            page_started = time.perf_counter()
+            page_span = start_span("page", page=page_num + 1)
+            page = doc.fitz_page(page_num)
             
             # تبدیل صفحه به تصویر با کیفیت بالا (zoom=2)
             mat = fitz.Matrix(2, 2)
@@ -212,7 +274,7 @@ def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
             img_bytes = pix.tobytes("png")
             
             # اجرای OCR
-            result, elapse = ocr_engine(img_bytes)
+            result, elapse = get_ocr_engine()(img_bytes)
             
             if result:
                 # نتیجه لیست شامل [تخت، جعبه، امتیاز] است
@@ -220,9 +282,7 @@ def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
                 
                 if page_text:
                     # اصلاح و پاکسازی
-                    text = fix_farsi_text_issues(page_text)
-                    text = normalize_farsi_text(text)
-                    cleaned_text = deep_clean_farsi_text(text)
+                    cleaned_text = clean_extracted_text(page_text)
                     
                     if cleaned_text and len(cleaned_text.strip()) > 10:
                         context += cleaned_text + "\n\n"
@@ -233,8 +293,8 @@ def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
                             "word_count": len(cleaned_text.split()),
                             "method": "rapidocr"
                         })
-        
-        doc.close()
+            _OCR_PAGE_SECONDS.observe(time.perf_counter() - page_started)
+            page_span.end(lines=len(result or ()))
         
         return {
             "success": True,
@@ -246,187 +306,302 @@ def extract_with_ocr(pdf_path: str, max_pages: int = None) -> dict:
         }
         
     except Exception as e:
-        print(f"❌ خطا در OCR: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ خطا در OCR")
         return {"success": False, "error": str(e)}
 
+_FARSI_CHARS = re.compile(r'[\u0600-\u06FF\uFB50-\uFDFF\uFE70-\uFEFF]')
+
 def contains_farsi(text: str) -> bool:
     """بررسی اینکه آیا متن شامل حروف فارسی است"""
-    farsi_pattern = re.compile(r'[\u0600-\u06FF\uFB50-\uFDFF\uFE70-\uFEFF]')
-    return bool(farsi_pattern.search(text))
+    return bool(_FARSI_CHARS.search(text))
 
-def normalize_farsi_text(text: str) -> str:
-    """نرمال‌سازی پیشرفته متن فارسی"""
-    if not text:
-        return ""
-    
-    # 1. تبدیل حروف عربی به فارسی
-    arabic_to_farsi = {
-        'ك': 'ک', 'ي': 'ی', 'ى': 'ی',
-        'ة': 'ه', 'ؤ': 'و', 'إ': 'ا',
-        'أ': 'ا', 'ٱ': 'ا', 'ء': ''
-    }
-    
-    for arabic, farsi in arabic_to_farsi.items():
-        text = text.replace(arabic, farsi)
-    
-    # 2. تبدیل اعداد عربی به فارسی
-    arabic_numbers = '٠١٢٣٤٥٦٧٨٩'
-    farsi_numbers = '۰۱۲۳۴۵۶۷۸۹'
-    trans_table = str.maketrans(arabic_numbers, farsi_numbers)
-    text = text.translate(trans_table)
-    
-    # 3. حذف کاراکترهای کنترل و نامرئی
-    text = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F-\x9F]', '', text)
-    
-    # 4. اصلاح فاصله‌های متعدد
-    text = re.sub(r' +', ' ', text)
-    text = re.sub(r'\n\n+', '\n\n', text)
-    
-    # 5. اصلاح نیم‌فاصله
-    text = text.replace('\u200c', ' ')  # حذف نیم‌فاصله نامرئی
-    
-    return text.strip()
+def split_pages(pages: List[int], shard_count: int) -> List[List[int]]:
+    """تقسیم لیست صفحات به بازه‌های پیوسته و تقریباً هم‌اندازه"""
+    shard_count = max(1, min(shard_count, len(pages)))
+    size, extra = divmod(len(pages), shard_count)
+    ranges = []
+    start = 0
+    for i in range(shard_count):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(pages[start:end])
+        start = end
+    return ranges
 
-def fix_farsi_text_issues(text: str) -> str:
-    """اصلاح مشکلات خاص استخراج PDF فارسی"""
-    if not text:
-        return ""
-    
-    # 1. اصلاح کلمات معیوب رایج
-    common_fixes = {
-        'ققی': 'قرارداد',
-        'صی': 'سرمایه',
-        'قیی': 'شرکت',
-        'هرمی': 'سهامی',
-        'خ صی': 'خصوصی',
-        'پی': 'پذیر',
-        'مسو': 'مسئول',
-        'تمی': 'تمام',
-        'قعفه': 'قطعه',
-        'نگر': 'نگار',
-        'هوم': 'عموم',
-        'مدی': 'مدیر',
-        'عمل': 'عامل',
-        'دا رودی': 'داوردی',
+def merge_extraction_results(results: List[dict]) -> dict:
+    """ادغام نتایج shardها به ترتیب صفحه، با همان ساختار خروجی استخراج‌کننده‌ها"""
+    failed = [r for r in results if not r.get("success")]
+    if failed:
+        return {"success": False, "error": "; ".join(str(r.get("error")) for r in failed)}
+
+    blocks = sorted((b for r in results for b in r["blocks"]), key=lambda b: b["page"])
+    context = "".join(b["text"] + "\n\n" for b in blocks)
+    return {
+        "success": True,
+        "text": context,
+        "blocks": blocks,
+        "method": results[0]["method"],
+        "total_chars": len(context),
+        "total_pages": len(blocks)
     }
-    
-    for wrong, correct in common_fixes.items():
-        text = text.replace(wrong, correct)
-    
-    # 2. اصلاح شماره‌های تلفن معیوب
-    text = re.sub(r'(\d{2,3})\s+(\d{3,4})\s+(\d{4})', r'\1-\2-\3', text)
-    
-    # 3. اصلاح ایمیل‌های معیوب
-    text = re.sub(r'(\w+)\s*@\s*(\w+)\s*\.\s*(\w+)', r'\1@\2.\3', text)
-    
-    # 4. حذف کاراکترهای اضافی بین کلمات
-    text = re.sub(r'([آ-ی])\s+([آ-ی])', r'\1\2', text)
-    
-    # 5. اصلاح نقطه‌گذاری
-    text = re.sub(r'\s*\.\s*', '. ', text)
-    text = re.sub(r'\s*،\s*', '، ', text)
-
-    # 6. اصلاح پیشوندها و پسوندهای جدا افتاده (Heuristics)
-    # اتصال "می" و "نمی" به فعل بعدی
-    # Note: (?<=^|\s) is invalid in Python because ^ is zero-width and \s is not.
-    # We use capturing group (^|\s) instead.
-    # IMPORTANT: Replacement string must NOT be raw string if we use \u escape
-    text = re.sub(r'(^|\s)(می|نمی)\s+(?=[آ-ی])', '\\1\\2\u200c', text)
-    
-    # اتصال "ها" و "های" به کلمه قبلی
-    text = re.sub(r'(?<=[آ-ی])\s+(ها|های)(?=\s|$|\.|،)', '\u200c\\1', text)
-    
-    # اتصال "تر" و "ترین"
-    text = re.sub(r'(?<=[آ-ی])\s+(تر|ترین)(?=\s|$|\.|،)', '\u200c\\1', text)
-    
-    return text
 
-async def process_pdf_advanced(content: bytes, max_pages: int = None) -> dict:
-    """پردازش چندمرحله‌ای PDF با انتخاب بهترین روش"""
-    
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_pdf:
-        tmp_pdf.write(content)
-        pdf_path = tmp_pdf.name
+def _shard_count(page_count: int) -> int:
+    return min(
+        extraction_pool.max_workers,
+        math.ceil(page_count / max(1, EXTRACTION_SHARD_MIN_PAGES))
+    )
+
+async def _gather_shards(coros) -> list:
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # اگر یک بخش شکست خورد، بقیه هم لغو می‌شوند تا workerها آزاد شوند
+        for task in tasks:
+            task.cancel()
+        raise
+
+async def run_extractor(extractor, doc: PdfDocument, page_count: int, pages: List[int] = None) -> dict:
+    """اجرای یک استخراج‌کننده؛ اسناد بزرگ به بازه‌های صفحه تقسیم و موازی پردازش می‌شوند"""
+    pages_to_process = select_pages(page_count, doc.max_pages, pages)
+    shard_count = _shard_count(len(pages_to_process))
+    if shard_count <= 1:
+        return await extraction_pool.run(extract_pages, extractor, doc, pages)
+
+    logger.debug("⚡ تقسیم صفحات به بخش‌های موازی", extra={"pages": len(pages_to_process), "shards": shard_count})
+    results = await _gather_shards(
+        extraction_pool.run(extract_pages, extractor, doc, page_range)
+        for page_range in split_pages(pages_to_process, shard_count)
+    )
+    return merge_extraction_results(results)
+
+def sample_pages(pages: List[int], sample_size: int) -> List[int]:
+    """انتخاب چند صفحه با فاصله‌ی یکنواخت (شامل اولین و آخرین صفحه)"""
+    if sample_size <= 0 or len(pages) <= sample_size:
+        return list(pages)
+    if sample_size == 1:
+        return [pages[0]]
+    step = (len(pages) - 1) / (sample_size - 1)
+    return sorted({pages[round(i * step)] for i in range(sample_size)})
+
+def quality_score(result: dict) -> int:
+    """امتیاز کیفیت: طول متن + امتیاز کلمات؛ متن خیلی کوتاه امتیاز صفر می‌گیرد"""
+    text_length = len(result["text"].strip())
+    if text_length < 50:
+        return 0
+    return text_length + (len(result["text"].split()) * 2)
+
+def best_blocks_per_page(primary: dict, fallback: dict) -> dict:
+    """برای هر صفحه، بلوک طولانی‌تر از بین دو نتیجه انتخاب می‌شود"""
+    if not fallback.get("success"):
+        return primary
+    if not primary.get("success"):
+        return fallback
+
+    blocks = {b["page"]: b for b in primary["blocks"]}
+    for block in fallback["blocks"]:
+        current = blocks.get(block["page"])
+        if current is None or block["char_count"] > current["char_count"]:
+            blocks[block["page"]] = block
+    return merge_extraction_results([{
+        "success": True,
+        "blocks": list(blocks.values()),
+        "method": primary["method"]
+    }])
+
+async def commit_extraction(extractor, fallback, doc: PdfDocument,
+                            pages: List[int], expected_chars_per_page: float) -> dict:
+    """اجرای روش برنده روی صفحات باقیمانده؛ بخش‌هایی که افت کیفیت دارند با روش دوم هم استخراج می‌شوند"""
+
+    async def run_shard(shard: List[int]) -> dict:
+        result = await extraction_pool.run(extract_pages, extractor, doc, shard)
+        if fallback is None:
+            return result
+
+        chars_per_page = result["total_chars"] / len(shard) if result.get("success") else 0
+        if chars_per_page < expected_chars_per_page * EXTRACTION_DEGRADE_RATIO:
+            logger.info("⚠️ افت کیفیت در بخش، اجرای روش جایگزین", extra={
+                "first_page": shard[0] + 1, "last_page": shard[-1] + 1, "chars_per_page": round(chars_per_page),
+            })
+            result = best_blocks_per_page(
+                result,
+                await extraction_pool.run(extract_pages, fallback, doc, shard)
+            )
+        return result
+
+    shard_count = max(1, _shard_count(len(pages)))
+    results = await _gather_shards(run_shard(shard) for shard in split_pages(pages, shard_count))
+    return merge_extraction_results(results)
+
+def page_needs_ocr(block: dict) -> bool:
+    """آیا لایه متنی این صفحه خالی، خیلی کوتاه یا معیوب است؟"""
+    if not block:
+        return True
+    if block["char_count"] < OCR_MIN_PAGE_CHARS:
+        return True
+    return garbled_ratio(block["text"]) > OCR_GARBLED_RATIO
+
+def merge_ocr_pages(text_result: dict, ocr_result: dict) -> dict:
+    """جایگزینی صفحات خالی/معیوب لایه متنی با نتیجه OCR همان صفحات"""
+    blocks = {b["page"]: b for b in text_result["blocks"]} if text_result else {}
+    replaced = 0
+
+    for block in ocr_result["blocks"]:
+        current = blocks.get(block["page"])
+        if (current is None
+                or garbled_ratio(current["text"]) > OCR_GARBLED_RATIO
+                or block["char_count"] > current["char_count"]):
+            blocks[block["page"]] = block
+            replaced += 1
+
+    if not text_result or not text_result["blocks"]:
+        method = ocr_result["method"]
+    elif replaced:
+        method = f"{text_result['method']}+{ocr_result['method']}"
+    else:
+        method = text_result["method"]
+
+    merged = merge_extraction_results([{
+        "success": True,
+        "blocks": list(blocks.values()),
+        "method": method
+    }])
+    merged["ocr_pages"] = replaced
+    return merged
+
+async def process_pdf_advanced(content: bytes, max_pages: int = None, total_pages: int = None,
+                               content_hash: str = None) -> dict:
+    """پردازش چندمرحله‌ای PDF با انتخاب بهترین روش
+
+    استخراج‌ها در extraction_pool اجرا می‌شوند و event loop فقط منتظر نتیجه است.
+    نتیجه بر اساس هش محتوا کش می‌شود تا آپلود دوباره‌ی همان فایل استخراج نشود.
+    """
     
+    with span("process_pdf_advanced", bytes=len(content), max_pages=max_pages) as s:
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(hash_content, content)
+        cache_key = extraction_cache.make_key(content_hash, max_pages, EXTRACTOR_VERSION)
+        cached = await extraction_cache.get(cache_key)
+        s.set("cache_hit", cached is not None)
+        if cached is not None:
+            logger.debug("♻️ نتیجه استخراج از کش خوانده شد", extra={"content_hash": content_hash[:12]})
+            return cached
+
+        # bytes یک بار در spool نوشته می‌شود؛ هر کار فقط مسیر را می‌فرستد
+        async with spooled_document(content, max_pages, content_hash) as doc:
+            if total_pages is None:
+                total_pages = await extraction_pool.run(count_document_pages, doc)
+            with STAGE_SECONDS.labels("process_pdf_advanced").time():
+                processed = await _select_best_extraction(doc, total_pages)
+        s.set_attributes(
+            total_pages=total_pages,
+            method=processed["extraction_method"],
+            chars=processed["total_characters"],
+            ocr_pages=processed["ocr_pages"],
+        )
+
+        await extraction_cache.set(cache_key, processed)
+        return processed
+
+async def _select_best_extraction(doc: PdfDocument, total_pages: int) -> dict:
     results = []
     methods = [
         ("PyMuPDF", extract_with_pymupdf),
         ("PDFPlumber", extract_with_pdfplumber),
     ]
     
-    best_result = None
-    max_quality_score = 0
+    all_pages = select_pages(total_pages, doc.max_pages)
+    sample = sample_pages(all_pages, EXTRACTION_SAMPLE_PAGES)
+    sampled = set(sample)
+    remaining = [p for p in all_pages if p not in sampled]
     
+    # مرحله 1: امتیازدهی همه روش‌ها فقط روی صفحات نمونه
+    candidates = []
     for method_name, extractor in methods:
-        print(f"🔍 تست روش {method_name}...")
-        
         try:
-            result = extractor(pdf_path, max_pages)
+            result = await run_extractor(extractor, doc, total_pages, pages=sample)
             
             if result["success"]:
                 text_length = len(result["text"].strip())
                 word_count = len(result["text"].split())
-                
-                # محاسبه امتیاز کیفیت
-                # فرمول: طول متن + امتیاز کلمات
-                # اگر متن خیلی کوتاه باشد، امتیاز منفی می‌گیرد
-                if text_length < 50:
-                    quality_score = 0
-                else:
-                    quality_score = text_length + (word_count * 2)
+                score = quality_score(result)
                 
                 results.append({
                     "method": method_name,
                     "chars": text_length,
                     "words": word_count,
-                    "score": quality_score
+                    "score": score,
+                    "sample_pages": len(sample)
                 })
                 
-                print(f"✅ {method_name}: {text_length} کاراکتر، {word_count} کلمه (امتیاز: {quality_score})")
-                
-                if quality_score > max_quality_score:
-                    max_quality_score = quality_score
-                    best_result = result
+                logger.debug("✅ نتیجه‌ی صفحات نمونه", extra={
+                    "method": method_name, "sample_pages": len(sample), "chars": text_length,
+                    "words": word_count, "score": score,
+                })
+                candidates.append((score, method_name, extractor, result))
             else:
-                print(f"❌ {method_name} ناموفق: {result.get('error', 'خطای ناشناخته')}")
+                logger.warning("❌ روش استخراج ناموفق بود", extra={"method": method_name, "error": result.get("error")})
                 
-        except Exception as e:
-            print(f"❌ خطا در {method_name}: {str(e)}")
+        except ExtractionTimeout:
+            logger.warning("⏱️ روش استخراج از زمان مجاز بیشتر طول کشید", extra={"method": method_name})
+        except Exception:
+            logger.exception("❌ خطا در روش استخراج", extra={"method": method_name})
+    
+    best_result = None
+    if candidates:
+        # در امتیاز برابر، ترتیب methods حفظ می‌شود (sort پایدار است)
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        _, best_name, best_extractor, best_result = candidates[0]
+        fallback = candidates[1][2] if len(candidates) > 1 else None
+        
+        # مرحله 2: فقط روش برنده روی بقیه صفحات اجرا می‌شود
+        if remaining:
+            logger.debug("🏆 استخراج صفحات باقیمانده با روش برنده", extra={"method": best_name, "pages": len(remaining)})
+            try:
+                committed = await commit_extraction(
+                    best_extractor, fallback, doc, remaining,
+                    best_result["total_chars"] / len(sample)
+                )
+                if committed["success"]:
+                    best_result = merge_extraction_results([best_result, committed])
+                else:
+                    logger.warning("❌ روش استخراج ناموفق بود", extra={"method": best_name, "error": committed.get("error")})
+            except ExtractionTimeout:
+                logger.warning("⏱️ روش استخراج از زمان مجاز بیشتر طول کشید", extra={"method": best_name})
+            except Exception:
+                logger.exception("❌ خطا در روش استخراج", extra={"method": best_name})
             
-    # اگر نتیجه ضعیف بود و OCR داریم، OCR را تست کن
-    if (not best_result or max_quality_score < 200) and HAS_OCR:
-        print("⚠️ کیفیت استخراج پایین بود. تلاش با OCR...")
-        try:
-            ocr_result = extract_with_ocr(pdf_path, max_pages)
-            if ocr_result["success"]:
-                text_length = len(ocr_result["text"].strip())
-                # OCR معمولاً دقیق‌تر است برای اسکن، پس ضریب بالاتر
-                quality_score = text_length * 3 
-                
-                results.append({
-                    "method": "RapidOCR",
-                    "chars": text_length,
-                    "words": len(ocr_result["text"].split()),
-                    "score": quality_score
-                })
-                
-                if quality_score > max_quality_score:
-                    print(f"✅ OCR نتیجه بهتری داد: {text_length} کاراکتر")
-                    best_result = ocr_result
+    # OCR فقط برای صفحاتی که لایه متنی خالی یا معیوب دارند
+    if HAS_OCR:
+        text_blocks = {b["page"]: b for b in best_result["blocks"]} if best_result else {}
+        all_pages = select_pages(total_pages, doc.max_pages)
+        ocr_pages = [p for p in all_pages if page_needs_ocr(text_blocks.get(p + 1))]
+
+        if ocr_pages:
+            logger.info("⚠️ صفحات بدون لایه متنی مناسب؛ اجرای OCR روی همین صفحات", extra={
+                "ocr_pages": len(ocr_pages), "pages": len(all_pages),
+            })
+            try:
+                ocr_result = await run_extractor(
+                    extract_with_ocr, doc, total_pages, pages=ocr_pages
+                )
+                if ocr_result["success"]:
+                    text_length = len(ocr_result["text"].strip())
+                    results.append({
+                        "method": "RapidOCR",
+                        "chars": text_length,
+                        "words": len(ocr_result["text"].split()),
+                        "pages": len(ocr_pages)
+                    })
+                    merged = merge_ocr_pages(best_result, ocr_result)
+                    if merged["blocks"]:
+                        best_result = merged
+                    logger.debug("✅ نتیجه‌ی OCR", extra={"pages": len(ocr_result["blocks"]), "chars": text_length})
                 else:
-                     print(f"ℹ️ OCR هم نتیجه بهتری نداشت ({text_length} کاراکتر)")
-        except Exception as e:
-             print(f"❌ خطا در اجرای OCR: {e}")
+                    logger.warning("❌ OCR ناموفق بود", extra={"error": ocr_result.get("error")})
+            except Exception:
+                logger.exception("❌ خطا در اجرای OCR")
     
-    # حذف فایل موقت
-    try:
-        os.unlink(pdf_path)
-    except:
-        pass
-    
-    if not best_result:
+    if not best_result or not best_result["blocks"]:
         raise Exception("❌ هیچ روشی نتوانست متن را استخراج کند")
     
     # ارزیابی کیفیت نهایی
@@ -435,13 +610,13 @@ async def process_pdf_advanced(content: bytes, max_pages: int = None) -> dict:
     
     quality = "عالی" if total_chars > 1000 else "خوب" if total_chars > 500 else "متوسط" if total_chars > 100 else "ضعیف"
     
-    print(f"\n{'='*60}")
-    print(f"📊 بهترین روش: {best_result['method']}")
-    print(f"📝 کل کاراکترها: {total_chars:,}")
-    print(f"📝 کل کلمات: {total_words:,}")
-    print(f"📄 تعداد صفحات: {len(best_result['blocks'])}")
-    print(f"⭐ کیفیت: {quality}")
-    print(f"{'='*60}\n")
+    logger.info("📊 استخراج PDF تمام شد", extra={
+        "method": best_result["method"],
+        "chars": total_chars,
+        "words": total_words,
+        "pages": len(best_result["blocks"]),
+        "quality": quality,
+    })
     
     return {
         "extraction_method": best_result["method"],
@@ -451,6 +626,7 @@ async def process_pdf_advanced(content: bytes, max_pages: int = None) -> dict:
         "full_text": best_result["text"],
         "blocks": best_result["blocks"],
         "quality": quality,
+        "ocr_pages": best_result.get("ocr_pages", 0),
         "all_methods_tested": results
     }
 
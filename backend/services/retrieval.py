@@ -0,0 +1,157 @@
+"""
+بازیابی تکه‌های مرتبط سند برای /ask
+
+هنگام آپلود، متن سند (بلوک‌های صفحه‌به‌صفحه‌ی PDF یا متن txt/docx/json) به
+تکه‌هایی حداکثر به اندازه‌ی MAX_CHUNK_SIZE کاراکتر تقسیم می‌شود و یک ایندکس
+معکوس BM25 برای آن‌ها ساخته و کنار داده‌ها در ai_assist ذخیره می‌شود. در /ask
+فقط top-k تکه‌ی مرتبط با سؤال به پرامپت اضافه می‌شود.
+"""
+import math
+import re
+from collections import Counter
+from typing import List
+
+from config import MAX_CHUNK_SIZE, RETRIEVAL_TOP_K
+
+INDEX_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?؟؛])\s+|\n+")
+_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا",
+    "‌": " ", "‏": " ", "‎": " ",
+})
+# حرکه‌ها و تطویل در ایندکس نادیده گرفته می‌شوند
+_DIACRITICS = re.compile(r"[ً-ٰٟـ]")
+
+STOP_WORDS = frozenset("""
+و در به از که این آن با را برای است تا یا هم بر می نمی شود شده شد کرد کند
+های ها ای یک هر اما اگر نیز بود باشد دارد بین پس چه چی چیست ما من تو او
+the a an of to in and or is are was for on with by as at be
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    text = _DIACRITICS.sub("", (text or "").lower().translate(_CHAR_MAP))
+    return [t for t in _TOKEN.findall(text) if len(t) > 1 and t not in STOP_WORDS]
+
+
+def chunk_text(text: str, max_chars: int = MAX_CHUNK_SIZE) -> List[str]:
+    """تقسیم متن در مرز جمله/خط به تکه‌های حداکثر max_chars کاراکتری"""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # جمله‌ی طولانی‌تر از یک تکه در مرز کلمه شکسته می‌شود
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _flatten(value, prefix: str = "") -> List[str]:
+    """متن‌های یک JSON دلخواه به صورت سطرهای «کلید: مقدار»"""
+    if isinstance(value, dict):
+        lines = []
+        for k, v in value.items():
+            lines.extend(_flatten(v, f"{prefix}{k}: " if not isinstance(v, (dict, list)) else f"{prefix}{k} / "))
+        return lines
+    if isinstance(value, list):
+        lines = []
+        for v in value:
+            lines.extend(_flatten(v, prefix))
+        return lines
+    if value is None:
+        return []
+    return [f"{prefix}{value}"]
+
+
+def document_sections(json_data) -> List[dict]:
+    """بخش‌های متنی سند؛ برای PDF هر صفحه یک بخش با شماره صفحه است"""
+    if isinstance(json_data, dict):
+        blocks = json_data.get("blocks")
+        if isinstance(blocks, list) and blocks:
+            return [
+                {"page": b.get("page"), "text": b.get("text", "")}
+                for b in blocks if isinstance(b, dict) and b.get("text")
+            ]
+        for key in ("full_text", "text"):
+            if isinstance(json_data.get(key), str) and json_data[key].strip():
+                return [{"page": None, "text": json_data[key]}]
+        json_data = {k: v for k, v in json_data.items() if k not in ("retrieval", "data_version")}
+    return [{"page": None, "text": "\n".join(_flatten(json_data))}]
+
+
+def build_retrieval_index(json_data, max_chars: int = MAX_CHUNK_SIZE) -> dict:
+    """تکه‌ها و ایندکس BM25 (قابل ذخیره به صورت JSON)"""
+    chunks = []
+    for section in document_sections(json_data):
+        for piece in chunk_text(section["text"], max_chars):
+            chunks.append({"id": len(chunks), "page": section["page"], "text": piece})
+
+    postings = {}
+    lengths = []
+    for chunk in chunks:
+        counts = Counter(tokenize(chunk["text"]))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append([chunk["id"], tf])
+
+    n = len(chunks)
+    return {
+        "version": INDEX_VERSION,
+        "max_chunk_size": max_chars,
+        "chunks": chunks,
+        "doc_lengths": lengths,
+        "avg_length": (sum(lengths) / n) if n else 0.0,
+        "postings": postings,
+    }
+
+
+def search(index: dict, query: str, k: int = RETRIEVAL_TOP_K) -> List[dict]:
+    """top-k تکه‌ی مرتبط با سؤال به ترتیب امتیاز BM25"""
+    chunks = index.get("chunks") or []
+    n = len(chunks)
+    if not n:
+        return []
+    lengths = index["doc_lengths"]
+    avg_length = index["avg_length"] or 1.0
+    postings = index["postings"]
+
+    scores = {}
+    for term in set(tokenize(query)):
+        plist = postings.get(term)
+        if not plist:
+            continue
+        idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        for chunk_id, tf in plist:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[chunk_id] / avg_length)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [{**chunks[chunk_id], "score": round(score, 4)} for chunk_id, score in best]
+
+
+def format_context(chunks: List[dict]) -> str:
+    parts = []
+    for chunk in chunks:
+        label = f"[صفحه {chunk['page']}]" if chunk.get("page") is not None else f"[بخش {chunk['id'] + 1}]"
+        parts.append(f"{label} {chunk['text']}")
+    return "\n\n".join(parts)
@@ -1,108 +1,210 @@
+import asyncio
 from typing import Optional, Tuple
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from models.subscribtion_models import UserSubscription, PLANS
-from db_config import AsyncSessionLocal  # db_config must expose an asyncpg.Pool (use init_db_pool to set _db_pool)
-import asyncpg
-import traceback
+from db_config import AsyncSessionLocal
 import logging
+import time
+from collections import OrderedDict
 from sqlalchemy import text
+from config import (
+    SUBSCRIPTION_CACHE_TTL_SECONDS,
+    SUBSCRIPTION_CACHE_MAX_ITEMS,
+    SUBSCRIPTION_RESET_DAYS,
+    SUBSCRIPTION_RESET_INTERVAL_SECONDS,
+)
+from utils.request_context import request_state
+from utils.tracing import traced, current_span
 
-_db_pool: asyncpg.Pool | None = None
+logger = logging.getLogger(__name__)
 
-async def init_db_pool(dsn: str):
-    global _db_pool
-    if _db_pool is None:
-        _db_pool = await asyncpg.create_pool(dsn)
+# ----------------------------
+# Annual reset
+# ----------------------------
+# اشتراکی که SUBSCRIPTION_RESET_DAYS از آخرین ریست آن گذشته باشد، موجودی کامل
+# پلن را دارد. این «موجودی مؤثر» در خود SQL حساب می‌شود (خواندن، رزرو و کسر)،
+# پس مسیر خواندن هیچ UPDATE ای انجام نمی‌دهد؛ SubscriptionResetSweeper ردیف‌های
+# منقضی را دوره‌ای و با یک دستور ریست می‌کند.
+def _plan_max_pages_sql(default: str) -> str:
+    return "CASE plan_type {} ELSE {} END".format(
+        " ".join(f"WHEN '{name}' THEN {plan.max_pages}" for name, plan in PLANS.items()),
+        default,
+    )
 
-async def get_user_subscription(user_id: str) -> Optional[UserSubscription]:
-    try:
-        # Prefer asyncpg pool if initialized for simple fetch; otherwise fall back to AsyncSessionLocal
-        row = None
-        if _db_pool:
-            async with _db_pool.acquire() as conn:
-                row = await conn.fetchrow(
-                    "SELECT user_id, plan_type, pages_remaining, last_reset, is_active "
-                    "FROM subscriptions WHERE user_id = $1 LIMIT 1",
-                    user_id
-                )
-                data = dict(row) if row else None
-        else:
-            async with AsyncSessionLocal() as session:
-                result = await session.execute(
-                    text(
-                        "SELECT user_id, plan_type, pages_remaining, last_reset, is_active "
-                        "FROM subscriptions WHERE user_id = :user_id LIMIT 1"
-                    ),
-                    {"user_id": user_id}
-                )
-                row_obj = result.fetchone()
-                data = dict(row_obj._mapping) if row_obj else None
-
-        if not data:
-            return None
 
-        last_reset = data.get("last_reset")
-        if isinstance(last_reset, str):
-            try:
-                lr = last_reset
-                if lr.endswith("Z"):
-                    lr = lr[:-1] + "+00:00"
-                data["last_reset"] = datetime.fromisoformat(lr)
-            except Exception:
-                data["last_reset"] = datetime.now(timezone.utc)
-        elif last_reset is None:
-            data["last_reset"] = datetime.now(timezone.utc)
+_RESET_DUE_SQL = f"(last_reset IS NULL OR last_reset <= now() - interval '{SUBSCRIPTION_RESET_DAYS} days')"
+_EFFECTIVE_PAGES_SQL = f"(CASE WHEN {_RESET_DUE_SQL} THEN {_plan_max_pages_sql('pages_remaining')} ELSE pages_remaining END)"
+_EFFECTIVE_LAST_RESET_SQL = f"(CASE WHEN {_RESET_DUE_SQL} THEN now() ELSE last_reset END)"
 
-        return UserSubscription(**data)
-    except Exception as e:
-        logging.exception("Error getting subscription")
+# پیشرفت ریست در همان دستوری که موجودی را تغییر می‌دهد ذخیره می‌شود
+_APPLY_RESET_SQL = f"last_reset = {_EFFECTIVE_LAST_RESET_SQL}"
+
+# ----------------------------
+# Subscription cache
+# ----------------------------
+# دو لایه: memo مخصوص همان درخواست (request_state) و یک LRU با TTL کوتاه بین
+# درخواست‌ها. هر تغییر اشتراک (create_or_update_subscription، deduct_pages و
+# کسر صفحات در صف آپلود) با invalidate_subscription هر دو لایه را پاک می‌کند.
+_MISSING = object()
+_subscription_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _request_memo() -> Optional[dict]:
+    state = request_state()
+    if state is None:
+        return None
+    return state.setdefault("subscriptions", {})
+
+
+def _copy(subscription: Optional[UserSubscription]) -> Optional[UserSubscription]:
+    # فراخواننده‌ها شیء را تغییر می‌دهند؛ نسخه‌ی کش نباید عوض شود
+    if subscription is None:
         return None
+    # pydantic v2: model_copy، v1: copy
+    return getattr(subscription, "model_copy", subscription.copy)()
+
+
+def _cached_subscription(user_id: str):
+    memo = _request_memo()
+    if memo is not None and user_id in memo:
+        return memo[user_id]
+
+    entry = _subscription_cache.get(user_id)
+    if entry is not None:
+        expires_at, subscription = entry
+        if expires_at > time.monotonic():
+            _subscription_cache.move_to_end(user_id)
+            if memo is not None:
+                memo[user_id] = subscription
+            return subscription
+        del _subscription_cache[user_id]
+    return _MISSING
+
+
+def _store_subscription(user_id: str, subscription: Optional[UserSubscription]):
+    memo = _request_memo()
+    if memo is not None:
+        memo[user_id] = subscription
+    _subscription_cache[user_id] = (time.monotonic() + SUBSCRIPTION_CACHE_TTL_SECONDS, subscription)
+    _subscription_cache.move_to_end(user_id)
+    while len(_subscription_cache) > SUBSCRIPTION_CACHE_MAX_ITEMS:
+        _subscription_cache.popitem(last=False)
+
+
+def invalidate_subscription(user_id: str):
+    memo = _request_memo()
+    if memo is not None:
+        memo.pop(user_id, None)
+    _subscription_cache.pop(user_id, None)
+
 
+async def get_user_subscription(user_id: str) -> Optional[UserSubscription]:
+    """اشتراک کاربر از کش؛ در صورت نبود، همان خواندن check_and_reset_subscription"""
+    return await check_and_reset_subscription(user_id)
+
+
+@traced("subscription.check")
 async def check_and_reset_subscription(user_id: str) -> Optional[UserSubscription]:
+    """حداکثر یک خواندن از جدول subscriptions در هر درخواست (و در طول TTL کش)"""
+    cached = _cached_subscription(user_id)
+    current_span().set("cache_hit", cached is not _MISSING)
+    if cached is not _MISSING:
+        return _copy(cached)
+
     try:
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                text("SELECT * FROM subscriptions WHERE user_id = :uid"),
-                {"uid": user_id}
-            )
-            row = result.first()
-            if not row:
-                return None
-
-            subscription = UserSubscription(
-                user_id=row.user_id,
-                plan_type=row.plan_type,
-                pages_remaining=row.pages_remaining,
-                last_reset=row.last_reset,
-                is_active=row.is_active
-            )
+        subscription = await _load_subscription(user_id)
+    except Exception:
+        # خطای دیتابیس کش نمی‌شود
+        logger.exception("Error in check_and_reset_subscription", extra={"user_id": user_id})
+        return None
 
-            # Reset pages if 365 days passed
-            now = datetime.now(timezone.utc)
-            last_reset = subscription.last_reset
-            if last_reset.tzinfo is None:
-                last_reset = last_reset.replace(tzinfo=timezone.utc)
-
-            if (now - last_reset) >= timedelta(days=365):
-                plan = PLANS.get(subscription.plan_type)
-                pages_to_reset = plan.max_pages if plan.plan_type != "free" else plan.max_pages
-                await session.execute(
-                    text("""
-                        UPDATE subscriptions
-                        SET pages_remaining=:pages, last_reset=:lr, updated_at=:ua
-                        WHERE user_id=:uid
-                    """),
-                    {"pages": pages_to_reset, "lr": now, "ua": now, "uid": user_id}
-                )
-                await session.commit()
-                subscription.pages_remaining = pages_to_reset
-                subscription.last_reset = now
+    _store_subscription(user_id, subscription)
+    return _copy(subscription)
 
-            return subscription
-    except Exception as e:
-        print("Error in check_and_reset_subscription:", e)
+
+_SELECT_SUBSCRIPTION = text(f"""
+    SELECT user_id, plan_type,
+           {_EFFECTIVE_PAGES_SQL} AS pages_remaining,
+           {_EFFECTIVE_LAST_RESET_SQL} AS last_reset,
+           is_active
+    FROM subscriptions WHERE user_id = :uid
+""")
+
+
+async def _load_subscription(user_id: str) -> Optional[UserSubscription]:
+    """فقط خواندن؛ ریست سالانه در خود کوئری اعمال می‌شود"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(_SELECT_SUBSCRIPTION, {"uid": user_id})
+        row = result.first()
+    if not row:
         return None
 
+    return UserSubscription(
+        user_id=row.user_id,
+        plan_type=row.plan_type,
+        pages_remaining=row.pages_remaining,
+        last_reset=row.last_reset,
+        is_active=row.is_active
+    )
+
+
+_SWEEP_LOCK_KEY = 0x5EED5EED  # advisory lock برای اینکه فقط یک پردازه همزمان ریست کند
+
+_RESET_EXPIRED = text(f"""
+    UPDATE subscriptions
+    SET pages_remaining = {_plan_max_pages_sql('pages_remaining')},
+        last_reset = now(), updated_at = now()
+    WHERE {_RESET_DUE_SQL}
+    RETURNING user_id
+""")
+
+
+async def reset_expired_subscriptions() -> Optional[int]:
+    """ریست همه‌ی اشتراک‌های منقضی با یک دستور؛ None یعنی پردازه‌ی دیگری در حال ریست است"""
+    async with AsyncSessionLocal() as session:
+        locked = await session.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _SWEEP_LOCK_KEY}
+        )
+        if not locked.scalar():
+            await session.rollback()
+            return None
+        result = await session.execute(_RESET_EXPIRED)
+        user_ids = [r.user_id for r in result.fetchall()]
+        await session.commit()
+
+    for user_id in user_ids:
+        invalidate_subscription(user_id)
+    return len(user_ids)
+
+
+class SubscriptionResetSweeper:
+    def __init__(self, interval: float = SUBSCRIPTION_RESET_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                count = await reset_expired_subscriptions()
+                if count:
+                    logger.info("🔄 اشتراک‌های منقضی ریست شد", extra={"count": count})
+            except Exception:
+                logger.exception("❌ خطا در ریست اشتراک‌ها")
+            await asyncio.sleep(self.interval)
+
+
+subscription_reset_sweeper = SubscriptionResetSweeper()
+
 
 
 async def create_or_update_subscription(user_id: str, plan_type: str):
@@ -130,47 +232,117 @@ async def create_or_update_subscription(user_id: str, plan_type: str):
                 }
             )
             await session.commit()  # 🔑 commit immediately
+        invalidate_subscription(user_id)
 
         return True, f"اشتراک {plan.name} با موفقیت فعال شد"
     except Exception as e:
         return False, str(e)
 
-async def deduct_pages(user_id: str, pages_used: int) -> Tuple[bool, Optional[int] or str]:
+# ----------------------------
+# Page quota
+# ----------------------------
+# بررسی موجودی و کسر صفحات در یک UPDATE شرطی انجام می‌شود، پس دو آپلود همزمان
+# از یک حساب نمی‌توانند هر دو از موجودی عبور کنند. پلن رایگان صفحه کسر نمی‌کند.
+# موجودی مؤثر (با احتساب ریست سالانه‌ی انجام‌نشده) ملاک است
+_RESERVE_PAGES = text(f"""
+    UPDATE subscriptions
+    SET pages_remaining = {_EFFECTIVE_PAGES_SQL} - :pages, {_APPLY_RESET_SQL}, updated_at = now()
+    WHERE user_id = :uid AND is_active AND plan_type <> 'free' AND {_EFFECTIVE_PAGES_SQL} >= :pages
+    RETURNING pages_remaining
+""")
+
+# برگشت صفحات از سقف پلن بیشتر نمی‌شود (مثلاً اگر در این فاصله ریست سالانه انجام شده باشد)
+_REFUND_PAGES = text(f"""
+    UPDATE subscriptions
+    SET pages_remaining = LEAST({_EFFECTIVE_PAGES_SQL} + :pages, {_plan_max_pages_sql(_EFFECTIVE_PAGES_SQL + ' + :pages')}),
+        {_APPLY_RESET_SQL}, updated_at = now()
+    WHERE user_id = :uid AND plan_type <> 'free'
+    RETURNING pages_remaining
+""")
+
+
+@traced("subscription.reserve_pages")
+async def reserve_pages(user_id: str, pages: int, session=None) -> Tuple[bool, Optional[int] or str]:
+    """کسر اتمیک صفحات اگر موجودی کافی باشد؛ خروجی (True, صفحات باقیمانده) یا (False, پیام خطا)
+
+    اگر session داده شود، commit با فراخواننده است (برای کسر در همان تراکنش ثبت کار).
+    """
     try:
-        subscription = await get_user_subscription(user_id)
-        if not subscription:
-            return False, "اشتراکی یافت نشد"
+        if session is not None:
+            result = await session.execute(_RESERVE_PAGES, {"pages": pages, "uid": user_id})
+            row = result.first()
+        else:
+            async with AsyncSessionLocal() as own_session:
+                result = await own_session.execute(_RESERVE_PAGES, {"pages": pages, "uid": user_id})
+                row = result.first()
+                await own_session.commit()
+    except Exception:
+        logger.exception("Error reserving pages")
+        if session is not None:
+            raise
+        return False, "خطا در کم کردن صفحات"
+    finally:
+        invalidate_subscription(user_id)
 
-        if subscription.plan_type == "free":
-            return True, 0
+    if row is None:
+        return False, f"صفحات کافی در اشتراک شما وجود ندارد. نیاز: {pages} صفحه"
+    return True, row.pages_remaining
 
-        new_pages = max(0, subscription.pages_remaining - pages_used)
-        now = datetime.now(timezone.utc)
 
-        if _db_pool:
-            async with _db_pool.acquire() as conn:
-                await conn.execute(
-                    "UPDATE subscriptions SET pages_remaining=$1, updated_at=$2 WHERE user_id=$3",
-                    new_pages, now, user_id
-                )
+@traced("subscription.refund_pages")
+async def refund_pages(user_id: str, pages: int, session=None) -> Optional[int]:
+    """برگرداندن صفحات رزروشده وقتی پردازش فایل ناموفق بود"""
+    if pages <= 0:
+        return None
+    try:
+        if session is not None:
+            result = await session.execute(_REFUND_PAGES, {"pages": pages, "uid": user_id})
+            row = result.first()
         else:
-            async with AsyncSessionLocal() as session:
-                await session.execute(
-                    text("UPDATE subscriptions SET pages_remaining=:pr, updated_at=:ua WHERE user_id=:uid"),
-                    {"pr": new_pages, "ua": now, "uid": user_id}
-                )
+            async with AsyncSessionLocal() as own_session:
+                result = await own_session.execute(_REFUND_PAGES, {"pages": pages, "uid": user_id})
+                row = result.first()
+                await own_session.commit()
+    except Exception:
+        logger.exception("Error refunding pages")
+        if session is not None:
+            raise
+        return None
+    finally:
+        invalidate_subscription(user_id)
+
+    logger.info("↩️ صفحات به اشتراک کاربر برگشت داده شد", extra={"user_id": user_id, "pages": pages})
+    return row.pages_remaining if row else None
+
 
-        return True, new_pages
+async def deduct_pages(user_id: str, pages_used: int) -> Tuple[bool, Optional[int] or str]:
+    """کسر صفحات بدون بررسی موجودی (حداقل صفر)، در یک دستور"""
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                text(f"""
+                    UPDATE subscriptions
+                    SET pages_remaining = CASE WHEN plan_type = 'free' THEN {_EFFECTIVE_PAGES_SQL}
+                                               ELSE GREATEST({_EFFECTIVE_PAGES_SQL} - :pages, 0) END,
+                        {_APPLY_RESET_SQL}, updated_at = now()
+                    WHERE user_id = :uid
+                    RETURNING plan_type, pages_remaining
+                """),
+                {"pages": pages_used, "uid": user_id}
+            )
+            row = result.first()
+            await session.commit()
+        invalidate_subscription(user_id)
+
+        if not row:
+            return False, "اشتراکی یافت نشد"
+        return True, 0 if row.plan_type == "free" else row.pages_remaining
     except Exception:
-        logging.exception("Error deducting pages")
+        logger.exception("Error deducting pages")
         return False, "خطا در کم کردن صفحات"
 
 async def can_upload_file(user_id: str, file_pages_count: int) -> Tuple[bool, str]:
     try:
-        subscription = await get_user_subscription(user_id)
-        if not subscription:
-            return False, "اشتراکی یافت نشد"
-
         subscription = await check_and_reset_subscription(user_id)
         if not subscription:
             return False, "اشتراکی یافت نشد"
@@ -188,5 +360,5 @@ async def can_upload_file(user_id: str, file_pages_count: int) -> Tuple[bool, st
 
         return True, "مجاز است"
     except Exception:
-        logging.exception("Error in can_upload_file")
+        logger.exception("Error in can_upload_file")
         return False, "خطا در بررسی امکان آپلود فایل"
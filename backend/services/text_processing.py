@@ -1,18 +1,123 @@
 import unicodedata
 import re
 from hazm import Normalizer
+from utils.metrics import STAGE_SECONDS
 
 normalizer = Normalizer()
 
+
+# موتور نرمال‌سازی متن صفحات PDF
+#
+# جدول‌ها و regexها یک بار هنگام import ساخته می‌شوند. قواعد لفظی با
+# str.replace زنجیره‌ای اجرا می‌شوند: در CPython هر replace یک جستجوی C روی
+# بافر است و روی متن فارسی از str.translate (تقریباً 70 برابر) و از یک regex
+# چندالگویی (alternation + جدول جایگزینی، حدود 2 برابر) سریع‌تر بود. گذرهای
+# regex که به یک رشته‌ی لفظی نیاز دارند فقط وقتی اجرا می‌شوند که آن رشته در
+# متن باشد. جایگزینی‌ها به جای قالب r'\1\2' تابع هستند (در Python 3.11
+# قالب برای هر انطباق در پایتون expand می‌شود) و کمیت‌هایی که backtrack آن‌ها
+# هرگز به انطباق نمی‌رسد possessive شده‌اند. خروجی دقیقاً همان پیاده‌سازی
+# قبلی است (benchmarks/normalization.py این را بررسی می‌کند).
+#
+# بیشتر زمان هر صفحه (حدود سه‌چهارم در بنچمارک) در Normalizer هضم است که خودش
+# چند ده گذر regex دارد و بیرون از این ماژول است؛ ادغام آن در یک گذر یعنی
+# بازنویسی هضم و از دست رفتن خروجی یکسان، پس انجام نشده و بهبود کل زنجیره‌ی
+# هر صفحه کم است (بسته به متن و اجرا حدود 1.05 تا 1.4 برابر).
+
+# کلمات معیوب رایج در استخراج PDF فارسی (به همین ترتیب اعمال می‌شوند)
+_COMMON_FIXES = (
+    ('ققی', 'قرارداد'),
+    ('صی', 'سرمایه'),
+    ('قیی', 'شرکت'),
+    ('هرمی', 'سهامی'),
+    ('خ صی', 'خصوصی'),
+    ('پی', 'پذیر'),
+    ('مسو', 'مسئول'),
+    ('تمی', 'تمام'),
+    ('قعفه', 'قطعه'),
+    ('نگر', 'نگار'),
+    ('هوم', 'عموم'),
+    ('مدی', 'مدیر'),
+    ('عمل', 'عامل'),
+    ('دا رودی', 'داوردی'),
+)
+
+_BROKEN_PHONE = re.compile(r'(\d{2,3})\s+(\d{3,4})\s+(\d{4})')
+_BROKEN_EMAIL = re.compile(r'(?<!\w)(\w++)\s*+@\s*+(\w++)\s*+\.\s*+(\w+)')
+_SPACE_BETWEEN_LETTERS = re.compile(r'([آ-ی])\s++([آ-ی])')
+_SPACED_DOT = re.compile(r'\s*+\.\s*')
+_SPACED_COMMA = re.compile(r'\s*+،\s*')
+_DETACHED_MI = re.compile(r'(^|\s)(می|نمی)\s+(?=[آ-ی])')
+_DETACHED_HA = re.compile(r'(?<=[آ-ی])\s+(ها|های)(?=\s|$|\.|،)')
+_DETACHED_TAR = re.compile(r'(?<=[آ-ی])\s+(تر|ترین)(?=\s|$|\.|،)')
+
+# حروف و اعداد عربی به فارسی
+_ARABIC_TO_FARSI = (
+    ('ك', 'ک'), ('ي', 'ی'), ('ى', 'ی'),
+    ('ة', 'ه'), ('ؤ', 'و'), ('إ', 'ا'),
+    ('أ', 'ا'), ('ٱ', 'ا'), ('ء', ''),
+) + tuple(zip('٠١٢٣٤٥٦٧٨٩', '۰۱۲۳۴۵۶۷۸۹'))
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F-\x9F]')
+
+
+def _replace_all(text: str, rules) -> str:
+    for wrong, correct in rules:
+        text = text.replace(wrong, correct)
+    return text
+
+
+def fix_farsi_text_issues(text: str) -> str:
+    """اصلاح مشکلات خاص استخراج PDF فارسی"""
+    if not text:
+        return ""
+    text = _replace_all(text, _COMMON_FIXES)
+    text = _BROKEN_PHONE.sub(lambda m: f'{m[1]}-{m[2]}-{m[3]}', text)
+    if '@' in text:
+        text = _BROKEN_EMAIL.sub(lambda m: f'{m[1]}@{m[2]}.{m[3]}', text)
+    text = _SPACE_BETWEEN_LETTERS.sub(lambda m: m[1] + m[2], text)
+    if '.' in text:
+        text = _SPACED_DOT.sub('. ', text)
+    if '،' in text:
+        text = _SPACED_COMMA.sub('، ', text)
+    # اتصال "می" و "نمی"، "ها" و "های"، "تر" و "ترین" با نیم‌فاصله
+    if 'می' in text:
+        text = _DETACHED_MI.sub(lambda m: m[1] + m[2] + '\u200c', text)
+    if 'ها' in text:
+        text = _DETACHED_HA.sub(lambda m: '\u200c' + m[1], text)
+    if 'تر' in text:
+        text = _DETACHED_TAR.sub(lambda m: '\u200c' + m[1], text)
+    return text
+
+
+def normalize_farsi_text(text: str) -> str:
+    """نرمال‌سازی پیشرفته متن فارسی"""
+    if not text:
+        return ""
+    text = _replace_all(text, _ARABIC_TO_FARSI)
+    text = _CONTROL_CHARS.sub('', text)
+    # معادل re.sub(' +', ' ') و re.sub('\n\n+', '\n\n')
+    while '  ' in text:
+        text = text.replace('  ', ' ')
+    while '\n\n\n' in text:
+        text = text.replace('\n\n\n', '\n\n')
+    return text.replace('\u200c', ' ').strip()
+
+
 def deep_clean_farsi_text(text: str) -> str:
     if not text:
         return ""
     text = unicodedata.normalize("NFKC", text)
-    text = text.replace("ي", "ی").replace("ك", "ک")
-    text = text.replace("‌", " ").replace("\u200c", " ")
+    text = text.replace("ي", "ی").replace("ك", "ک").replace("\u200c", " ")
     text = normalizer.normalize(text)
     return text.strip()
 
+
+_NORMALIZATION_SECONDS = STAGE_SECONDS.labels("normalization")
+
+def clean_extracted_text(text: str) -> str:
+    """زنجیره‌ی کامل پاکسازی متن هر صفحه‌ی PDF"""
+    with _NORMALIZATION_SECONDS.time():
+        return deep_clean_farsi_text(normalize_farsi_text(fix_farsi_text_issues(text)))
+
 def looks_garbled(text: str) -> bool:
     bad_patterns = [
         r"[اآبپتثجچحخدذرزسشصضطظعغفقکگلمنوهی]{1,2}\s[اآبپتثجچحخدذرزسشصضطظعغفقکگلمنوهی]{1,2}",
@@ -21,4 +126,22 @@ def looks_garbled(text: str) -> bool:
     for pattern in bad_patterns:
         if re.search(pattern, text):
             return True
-    return False
\ No newline at end of file
+    return False
+
+# نشانه‌های لایه متنی معیوب: (cid:NN)، کاراکتر جایگزین، گلیف‌های ناحیه‌ی خصوصی
+# یونیکد (فونت‌های بدون ToUnicode) و حروف تکی جدا افتاده
+_BROKEN_TOKEN = re.compile(r"\(cid:\d+\)|[\ufffd\ue000-\uf8ff]")
+# کلمات یک‌حرفی درست که نشانه‌ی خرابی نیستند («و» رایج‌ترین کلمه‌ی متن فارسی است)
+_SINGLE_LETTER_WORDS = frozenset("وaAI")
+
+def garbled_ratio(text: str) -> float:
+    """نسبت توکن‌های معیوب به کل توکن‌های متن (بین 0 و 1)"""
+    tokens = text.split() if text else []
+    if not tokens:
+        return 1.0
+    broken = sum(
+        1 for token in tokens
+        if _BROKEN_TOKEN.search(token)
+        or (len(token) == 1 and token.isalpha() and token not in _SINGLE_LETTER_WORDS)
+    )
+    return broken / len(tokens)
@@ -0,0 +1,465 @@
+"""
+صف کارهای آپلود ناهمزمان
+
+/upload_json_async فایل را روی دیسک ذخیره می‌کند، یک ردیف در جدول upload_jobs
+می‌سازد و بلافاصله job_id برمی‌گرداند. workerها کارها را با
+FOR UPDATE SKIP LOCKED از جدول برمی‌دارند، پس چند پردازه‌ی uvicorn می‌توانند
+همزمان کار کنند. هر کار در حال اجرا heartbeat می‌زند؛ کاری که heartbeat آن
+از UPLOAD_JOB_LEASE_SECONDS قدیمی‌تر شود (مثلاً worker ری‌استارت شده) دوباره
+برداشته می‌شود.
+
+صفحات در همان تراکنشی که کار ثبت می‌شود به صورت اتمیک رزرو (کسر) می‌شوند و
+pages_deducted علامت می‌خورد. اگر کار شکست بخورد، برگشت صفحات و تغییر وضعیت
+به failed در یک تراکنش و فقط برای همان تلاش (attempt) انجام می‌شود؛ پس هر کار
+دقیقاً یک بار صفحه کسر یا برگشت می‌دهد.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Optional
+
+from sqlalchemy import text
+
+from config import (
+    UPLOAD_JOBS_DIR,
+    UPLOAD_JOB_CONCURRENCY,
+    UPLOAD_JOB_POLL_SECONDS,
+    UPLOAD_JOB_LEASE_SECONDS,
+    UPLOAD_JOB_MAX_ATTEMPTS,
+)
+from db_config import AsyncSessionLocal
+from services.answer_cache import answer_cache
+from services.subscribtion_service import check_and_reset_subscription, reserve_pages, refund_pages
+from services.upload_processing import (
+    UPLOADS_IN_FLIGHT,
+    extract_upload_data,
+    save_user_data,
+    build_upload_response,
+)
+from utils.tracing import traced, current_span
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE = text("""
+    CREATE TABLE IF NOT EXISTS upload_jobs (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        category TEXT NOT NULL,
+        filename TEXT,
+        file_type TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        file_size BIGINT NOT NULL,
+        content_hash TEXT NOT NULL,
+        pages_count INTEGER NOT NULL,
+        max_pages INTEGER,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        result JSONB,
+        pages_deducted BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished_at TIMESTAMPTZ
+    )
+""")
+
+_CREATE_INDEX = text(
+    "CREATE INDEX IF NOT EXISTS upload_jobs_status_idx ON upload_jobs (status, created_at)"
+)
+
+# حداکثر یک کار فعال برای هر فایل هر کاربر؛ enqueue_job با ON CONFLICT به آن تکیه دارد
+_ACTIVE_JOB_PREDICATE = "status IN ('queued', 'running')"
+_CREATE_ACTIVE_INDEX = text(f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS upload_jobs_active_uniq
+    ON upload_jobs (user_id, content_hash, category) WHERE {_ACTIVE_JOB_PREDICATE}
+""")
+
+class QuotaExceeded(Exception):
+    """موجودی صفحات اشتراک برای این فایل کافی نیست"""
+
+
+_PUBLIC_COLUMNS = (
+    "id, user_id, category, filename, file_type, pages_count, status, attempts, "
+    "error, created_at, updated_at, finished_at"
+)
+
+
+# کارهای فعال تکراری (از قبل از وجود unique index)؛ جز جدیدترین همه failed می‌شوند
+_FAIL_DUPLICATE_ACTIVE_JOBS = text(f"""
+    WITH ranked AS (
+        SELECT id, pages_deducted,
+               row_number() OVER (
+                   PARTITION BY user_id, content_hash, category ORDER BY created_at DESC, id DESC
+               ) AS rank
+        FROM upload_jobs WHERE {_ACTIVE_JOB_PREDICATE}
+    )
+    UPDATE upload_jobs j
+    SET status = 'failed', error = 'duplicate active job', pages_deducted = FALSE,
+        updated_at = now(), finished_at = now()
+    FROM ranked
+    WHERE j.id = ranked.id AND ranked.rank > 1
+    RETURNING j.id, j.file_path, j.user_id, j.pages_count, ranked.pages_deducted AS refund
+""")
+
+
+async def ensure_jobs_table():
+    async with AsyncSessionLocal() as session:
+        await session.execute(_CREATE_TABLE)
+        await session.execute(_CREATE_INDEX)
+        await session.commit()
+
+    # enqueue_job بدون این index کار نمی‌کند (ON CONFLICT)، پس شکست آن شروع برنامه را متوقف می‌کند
+    duplicates = []
+    async with AsyncSessionLocal() as session:
+        exists = await session.execute(text("SELECT to_regclass('upload_jobs_active_uniq') IS NOT NULL"))
+        if not exists.scalar():
+            # قفل جدول: ثبت کار همزمان (یا شروع همزمان پردازه‌ی دیگر) بین حذف تکراری‌ها و ساخت index نمی‌آید
+            await session.execute(text("LOCK TABLE upload_jobs IN SHARE ROW EXCLUSIVE MODE"))
+            duplicates = (await session.execute(_FAIL_DUPLICATE_ACTIVE_JOBS)).fetchall()
+            for r in duplicates:
+                if r.refund:
+                    await refund_pages(r.user_id, r.pages_count, session=session)
+            try:
+                await session.execute(_CREATE_ACTIVE_INDEX)
+            except Exception as e:
+                raise RuntimeError(f"ساخت unique index کارهای فعال upload_jobs ناموفق بود: {e}") from e
+            await session.commit()
+
+    if duplicates:
+        logger.warning("⚠️ کارهای فعال تکراری failed شدند و صفحاتشان برگشت داده شد", extra={
+            "jobs": [r.id for r in duplicates],
+        })
+    for r in duplicates:
+        await asyncio.to_thread(_remove_file, r.file_path)
+
+
+def _write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+_INSERT_JOB = text(f"""
+    INSERT INTO upload_jobs
+    (id, user_id, category, filename, file_type, file_path, file_size,
+     content_hash, pages_count, max_pages, pages_deducted)
+    VALUES (:id, :uid, :category, :filename, :file_type, :file_path, :file_size,
+            :hash, :pages_count, :max_pages, :reserve)
+    ON CONFLICT (user_id, content_hash, category) WHERE {_ACTIVE_JOB_PREDICATE} DO NOTHING
+    RETURNING {_PUBLIC_COLUMNS}
+""")
+
+_SELECT_ACTIVE_JOB = text(f"""
+    SELECT {_PUBLIC_COLUMNS} FROM upload_jobs
+    WHERE user_id = :uid AND content_hash = :hash AND category = :category
+      AND {_ACTIVE_JOB_PREDICATE}
+""")
+
+
+async def enqueue_job(
+        user_id: str,
+        category: str,
+        filename: str,
+        file_type: str,
+        content: bytes,
+        content_hash: str,
+        pages_count: int,
+        max_pages: Optional[int],
+        reserve: bool = False,
+) -> dict:
+    """ثبت کار جدید و رزرو صفحات (اگر reserve)؛ اگر همین فایل برای همین کاربر در صف باشد، همان کار برگردانده می‌شود
+
+    تکراری بودن با unique index کارهای فعال و INSERT ... ON CONFLICT اتمیک بررسی
+    می‌شود، پس دو درخواست همزمان برای یک فایل فقط یک کار، یک فایل و یک رزرو دارند.
+    """
+    job_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOAD_JOBS_DIR, f"{job_id}.bin")
+    async with AsyncSessionLocal() as session:
+        while True:
+            # اگر تراکنش دیگری همین کار را درج کرده باشد، INSERT تا commit آن صبر می‌کند و چیزی برنمی‌گرداند
+            result = await session.execute(_INSERT_JOB, {
+                "id": job_id,
+                "uid": user_id,
+                "category": category,
+                "filename": filename,
+                "file_type": file_type,
+                "file_path": file_path,
+                "file_size": len(content),
+                "hash": content_hash,
+                "pages_count": pages_count,
+                "max_pages": max_pages,
+                "reserve": reserve,
+            })
+            inserted = result.fetchone()
+            if inserted:
+                job = dict(inserted._mapping)
+                break
+
+            result = await session.execute(_SELECT_ACTIVE_JOB, {
+                "uid": user_id, "hash": content_hash, "category": category,
+            })
+            existing = result.fetchone()
+            if existing:
+                await session.rollback()
+                return dict(existing._mapping)
+            # کار فعال بین INSERT و SELECT تمام شد؛ دوباره تلاش
+            await session.rollback()
+
+        try:
+            # فایل فقط برای کاری نوشته می‌شود که درجش موفق بوده (worker قبل از commit آن را نمی‌بیند)
+            await asyncio.to_thread(_write_file, file_path, content)
+            if reserve:
+                success, message = await reserve_pages(user_id, pages_count, session=session)
+                if not success:
+                    await session.rollback()
+                    raise QuotaExceeded(message)
+            await session.commit()
+        except BaseException:
+            await asyncio.to_thread(_remove_file, file_path)
+            raise
+
+    upload_job_worker.notify()
+    return job
+
+
+async def get_job(job_id: str, include_result: bool = False) -> Optional[dict]:
+    columns = _PUBLIC_COLUMNS + (", result" if include_result else "")
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text(f"SELECT {columns} FROM upload_jobs WHERE id = :id"),
+            {"id": job_id}
+        )
+        row = result.fetchone()
+    if not row:
+        return None
+
+    job = dict(row._mapping)
+    if include_result and isinstance(job.get("result"), str):
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+async def claim_next_job() -> Optional[dict]:
+    """برداشتن قدیمی‌ترین کار در صف (یا کاری که worker آن از بین رفته)"""
+    async with AsyncSessionLocal() as session:
+        # کارهایی که بارها worker خود را از دست داده‌اند دیگر تکرار نمی‌شوند
+        abandoned = await session.execute(
+            text("""
+                WITH stale AS (
+                    SELECT id, pages_deducted FROM upload_jobs
+                    WHERE status = 'running'
+                      AND updated_at < now() - make_interval(secs => :lease)
+                      AND attempts >= :max_attempts
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE upload_jobs j
+                SET status = 'failed', error = 'worker lost too many times', pages_deducted = FALSE,
+                    updated_at = now(), finished_at = now()
+                FROM stale
+                WHERE j.id = stale.id
+                RETURNING j.file_path, j.user_id, j.pages_count, stale.pages_deducted AS refund
+            """),
+            {"lease": UPLOAD_JOB_LEASE_SECONDS, "max_attempts": UPLOAD_JOB_MAX_ATTEMPTS}
+        )
+        abandoned = abandoned.fetchall()
+        abandoned_files = [r.file_path for r in abandoned]
+        for r in abandoned:
+            if r.refund:
+                await refund_pages(r.user_id, r.pages_count, session=session)
+        result = await session.execute(
+            text("""
+                UPDATE upload_jobs
+                SET status = 'running', attempts = attempts + 1, updated_at = now()
+                WHERE id = (
+                    SELECT id FROM upload_jobs
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND updated_at < now() - make_interval(secs => :lease))
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+            """),
+            {"lease": UPLOAD_JOB_LEASE_SECONDS}
+        )
+        row = result.fetchone()
+        await session.commit()
+
+    for path in abandoned_files:
+        await asyncio.to_thread(_remove_file, path)
+    return dict(row._mapping) if row else None
+
+
+async def _heartbeat(job_id: str, attempt: int):
+    while True:
+        await asyncio.sleep(UPLOAD_JOB_LEASE_SECONDS / 3)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    text("""
+                        UPDATE upload_jobs SET updated_at = now()
+                        WHERE id = :id AND status = 'running' AND attempts = :attempt
+                    """),
+                    {"id": job_id, "attempt": attempt}
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning("⚠️ heartbeat کار ناموفق بود", extra={"job_id": job_id, "error": str(e)})
+
+
+async def _complete_job(job: dict, subscription, json_data: dict) -> bool:
+    """ذخیره داده + done در یک تراکنش؛ False یعنی کار قبلاً تمام شده یا از دست رفته"""
+    # صفحات هنگام ثبت کار کسر شده‌اند، پس موجودی فعلی همان موجودی بعد از کسر است
+    result_payload = build_upload_response(
+        job["filename"], job["category"], job["file_type"],
+        subscription, job["pages_count"], json_data, subscription.pages_remaining
+    )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("""
+                UPDATE upload_jobs
+                SET status = 'done', result = :result,
+                    error = NULL, updated_at = now(), finished_at = now()
+                WHERE id = :id AND status = 'running' AND attempts = :attempt
+                RETURNING id
+            """),
+            {
+                "id": job["id"],
+                "attempt": job["attempts"],
+                "result": json.dumps(result_payload, ensure_ascii=False),
+            }
+        )
+        if not result.fetchone():
+            await session.rollback()
+            return False
+
+        await save_user_data(session, job["user_id"], job["category"], json_data)
+        await session.commit()
+    await answer_cache.invalidate_user(job["user_id"])
+    return True
+
+
+async def _fail_job(job: dict, error: str):
+    """failed + برگشت صفحات رزروشده در یک تراکنش"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("""
+                WITH current AS (
+                    SELECT id, pages_deducted FROM upload_jobs
+                    WHERE id = :id AND status = 'running' AND attempts = :attempt
+                    FOR UPDATE
+                )
+                UPDATE upload_jobs j
+                SET status = 'failed', error = :error, pages_deducted = FALSE,
+                    updated_at = now(), finished_at = now()
+                FROM current
+                WHERE j.id = current.id
+                RETURNING current.pages_deducted AS refund
+            """),
+            {"id": job["id"], "attempt": job["attempts"], "error": error[:2000]}
+        )
+        row = result.fetchone()
+        if row and row.refund:
+            await refund_pages(job["user_id"], job["pages_count"], session=session)
+        await session.commit()
+
+
+@traced("upload_job", root=True)
+async def process_job(job: dict):
+    current_span().set_attributes(job_id=str(job["id"]), attempt=job["attempts"], file_type=job["file_type"])
+    logger.info("⚙️ شروع کار آپلود", extra={"job_id": job["id"], "attempt": job["attempts"]})
+    heartbeat = asyncio.ensure_future(_heartbeat(job["id"], job["attempts"]))
+    finished = False
+    try:
+        subscription = await check_and_reset_subscription(job["user_id"])
+        if not subscription or not subscription.is_active:
+            await _fail_job(job, "لطفا ابتدا اشتراک خود را انتخاب کنید")
+            finished = True
+            return
+
+        content = await asyncio.to_thread(_read_file, job["file_path"])
+        json_data = await extract_upload_data(
+            content, job["file_type"], job["filename"], job["category"],
+            job["pages_count"], job["max_pages"], job["content_hash"]
+        )
+        if await _complete_job(job, subscription, json_data):
+            logger.info("✅ کار آپلود تمام شد", extra={"job_id": job["id"]})
+        else:
+            logger.info("ℹ️ کار آپلود قبلاً تمام شده یا به worker دیگری رسیده است", extra={"job_id": job["id"]})
+        finished = True
+    except asyncio.CancelledError:
+        # خاموش شدن سرور: کار بعد از انقضای lease دوباره برداشته می‌شود
+        raise
+    except Exception as e:
+        logger.exception("❌ خطا در کار آپلود", extra={"job_id": job["id"]})
+        await _fail_job(job, f"Processing failed: {e}")
+        finished = True
+    finally:
+        heartbeat.cancel()
+        if finished:
+            await asyncio.to_thread(_remove_file, job["file_path"])
+
+
+class UploadJobWorker:
+    """چند task که کارهای صف را از دیتابیس برمی‌دارند و پردازش می‌کنند"""
+
+    def __init__(self, concurrency: int = UPLOAD_JOB_CONCURRENCY):
+        self.concurrency = concurrency
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.concurrency)]
+        logger.info("✅ Upload job worker started", extra={"tasks": self.concurrency})
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                job = await claim_next_job()
+            except Exception:
+                logger.exception("❌ خطا در برداشتن کار از صف")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), UPLOAD_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                with UPLOADS_IN_FLIGHT.labels("job").track():
+                    await process_job(job)
+            except Exception:
+                logger.exception("❌ خطا در پردازش کار", extra={"job_id": job["id"]})
+
+
+upload_job_worker = UploadJobWorker()
@@ -0,0 +1,192 @@
+"""
+مراحل مشترک پردازش فایل آپلودی
+
+هم مسیر همزمان /upload_json و هم صف کارهای آپلود (upload_jobs) از همین توابع
+استفاده می‌کنند تا خروجی هر دو یکسان باشد.
+"""
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+
+from config import MAX_CHUNK_SIZE
+from models.subscribtion_models import PLANS, UserSubscription
+from services.answer_cache import compute_data_version, source_data_version
+from services.extraction_pool import extraction_pool
+from services.file_processing import process_txt, process_docx, process_json
+from services.pdf_extraction import process_pdf_advanced, EXTRACTOR_VERSION
+from services.retrieval import build_retrieval_index
+from services.vector_index import build_vector_index, record_vector_index
+from utils.metrics import metrics
+from utils.tracing import traced, current_span
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_IN_FLIGHT = metrics.gauge(
+    "yaroo_uploads_in_flight",
+    "Uploads currently being processed (sync: /upload_json, job: upload job worker)",
+    ["mode"],
+)
+UPLOADS_IN_FLIGHT.labels("sync")
+UPLOADS_IN_FLIGHT.labels("job")
+
+
+def page_limit_for(subscription: UserSubscription, pages_count: int) -> Optional[int]:
+    """محدودیت صفحات پردازش (فقط برای پلن رایگان)"""
+    if subscription.plan_type == "free":
+        plan = PLANS.get("free")
+        if plan and pages_count > plan.max_pages:
+            return plan.max_pages
+    return None
+
+
+async def _extract(
+        content: bytes,
+        file_type: str,
+        filename: str,
+        category: str,
+        pages_count: int,
+        max_pages: Optional[int],
+        content_hash: str,
+) -> dict:
+    if file_type == "pdf":
+        processed = await process_pdf_advanced(content, max_pages, pages_count, content_hash)
+
+        return {
+            "filename": filename,
+            "category": category.strip().lower(),
+            "extraction_method": processed["extraction_method"],
+            "total_characters": processed["total_characters"],
+            "total_blocks": processed["total_blocks"],
+            "pages_total": pages_count,
+            "pages_processed": len(processed["blocks"]),
+            "full_text": processed["full_text"],
+            "blocks": processed["blocks"],
+            "quality": processed.get("quality", "unknown"),
+            "metadata": {
+                "file_size_bytes": len(content),
+                "content_hash": content_hash,
+                "extraction_quality": processed.get("quality", "unknown")
+            }
+        }
+
+    # decode و پاکسازی متن هم CPU-bound است و در extraction_pool اجرا می‌شود
+    if file_type == "json":
+        return await extraction_pool.run(process_json, content)
+    if file_type == "txt":
+        return await extraction_pool.run(process_txt, content)
+    if file_type == "docx":
+        return await extraction_pool.run(process_docx, content)
+
+    raise ValueError(f"Unsupported file type: {file_type}")
+
+
+@traced("upload.extract")
+async def extract_upload_data(
+        content: bytes,
+        file_type: str,
+        filename: str,
+        category: str,
+        pages_count: int,
+        max_pages: Optional[int],
+        content_hash: str,
+) -> dict:
+    """تبدیل فایل به json_data که در ai_assist ذخیره می‌شود (همراه با ایندکس بازیابی)"""
+    current_span().set_attributes(file_type=file_type, pages=pages_count, max_pages=max_pages)
+    json_data = await _extract(content, file_type, filename, category, pages_count, max_pages, content_hash)
+
+    # تکه‌بندی و ایندکس BM25 برای بازیابی در /ask
+    if isinstance(json_data, dict):
+        json_data["retrieval"] = await extraction_pool.run(build_retrieval_index, json_data)
+        # بردارها یک بار اینجا حساب و روی دیسک ذخیره می‌شوند؛ /ask فقط mmap می‌کند
+        chunks = [c["text"] for c in json_data["retrieval"]["chunks"]]
+        try:
+            vectors = await extraction_pool.run(build_vector_index, chunks)
+            json_data["retrieval"]["vectors"] = await asyncio.to_thread(record_vector_index, vectors)
+        except Exception as e:
+            logger.warning("⚠️ ساخت ایندکس برداری ناموفق بود، فقط BM25 استفاده می‌شود", extra={"error": str(e)})
+        # کلید کش پاسخ‌های /ask؛ داده فقط تابع همین ورودی‌هاست، پس لازم نیست کل آن هش شود
+        json_data["data_version"] = source_data_version(
+            content_hash, category, file_type, max_pages, EXTRACTOR_VERSION, MAX_CHUNK_SIZE,
+            (json_data["retrieval"].get("vectors") or {}).get("embedder"),
+        )
+    return json_data
+
+
+def _serialize_user_data(json_data, related_data: list, category: str) -> tuple:
+    if isinstance(json_data, dict) and not json_data.get("data_version"):
+        json_data["data_version"] = compute_data_version(json_data, category)
+    return json.dumps(json_data, ensure_ascii=False), json.dumps(related_data or [], ensure_ascii=False)
+
+
+@traced("db.save_user_data")
+async def save_user_data(session, user_id: str, category: str, json_data: dict, related_data: list = None):
+    """درج یا به‌روزرسانی رکورد ai_assist کاربر (commit با فراخواننده است)"""
+    # داده (همراه ایندکس بازیابی) چند مگابایت است؛ سریال‌کردن بیرون از event loop
+    data, related = await asyncio.to_thread(_serialize_user_data, json_data, related_data, category)
+
+    result = await session.execute(
+        text("SELECT id FROM ai_assist WHERE user_id = :user_id LIMIT 1"),
+        {"user_id": user_id}
+    )
+    if result.fetchone():
+        await session.execute(
+            text(
+                """
+                UPDATE ai_assist
+                SET category = :category,
+                    data = :data,
+                    related_sources = :related
+                WHERE user_id = :user_id
+                """
+            ),
+            {"category": category, "data": data, "related": related, "user_id": user_id}
+        )
+    else:
+        await session.execute(
+            text(
+                """
+                INSERT INTO ai_assist (user_id, category, data, related_sources)
+                VALUES (:user_id, :category, :data, :related)
+                """
+            ),
+            {"user_id": user_id, "category": category, "data": data, "related": related}
+        )
+
+
+def build_upload_response(
+        filename: str,
+        category: str,
+        file_type: str,
+        subscription: UserSubscription,
+        pages_count: int,
+        json_data: dict,
+        pages_remaining: int,
+) -> dict:
+    """pages_remaining موجودی بعد از کسر صفحات همین فایل است"""
+    plan = PLANS.get(subscription.plan_type)
+    summary = json_data if isinstance(json_data, dict) else {}
+    return {
+        "message": f"فایل '{filename}' با موفقیت آپلود شد ✅",
+        "category": category,
+        "file_type": file_type,
+        "subscription_info": {
+            "plan": subscription.plan_type,
+            "plan_name": plan.name if plan else "نامشخص",
+            "pages_used": pages_count if subscription.plan_type != "free" else 0,
+            "pages_remaining": pages_remaining if subscription.plan_type != "free" else 0,
+            "max_allowed_pages": plan.max_pages if plan else 0,
+            "file_pages": pages_count,
+            "upload_status": "موفق"
+        },
+        "extraction_summary": {
+            "method": summary.get("extraction_method", "unknown"),
+            "quality": summary.get("quality", "unknown"),
+            "total_characters": summary.get("total_characters", 0),
+            "total_blocks": summary.get("total_blocks", 0),
+            "pages_processed": summary.get("pages_processed", 0)
+        },
+        "json_data_preview": json.dumps(json_data, ensure_ascii=False)[:500] if isinstance(json_data, dict) else str(json_data)[:500],
+    }
@@ -0,0 +1,314 @@
+"""
+ایندکس برداری تکه‌های سند برای بازیابی معنایی در /ask
+
+بردار تکه‌ها یک بار در مسیر آپلود (داخل extraction_pool) محاسبه و به صورت یک
+ماتریس float32 نرمال‌شده در VECTOR_INDEX_DIR/<key>.npy ذخیره می‌شود. کلید از
+متن تکه‌ها و نام embedder ساخته می‌شود، پس سند تکراری دوباره embed نمی‌شود.
+هنگام پرسش، ماتریس با mmap باز می‌شود و شباهت کسینوسی با یک ضرب ماتریسی
+حساب می‌شود.
+
+embedder پیش‌فرض hashing است (n-gram کاراکتری و کلمه‌ای با feature hashing،
+بدون وابستگی). با EMBEDDER=onnx یک مدل ONNX محلی (و tokenizer آن) استفاده
+می‌شود؛ اگر onnxruntime یا tokenizers نصب نباشد همان hashing استفاده می‌شود.
+
+ماتریس‌ها بین کاربران مشترک‌اند (کلید از محتواست)، پس با بازنویسی ai_assist
+حذف نمی‌شوند؛ پردازه‌ی اصلی حجم پوشه را بعد از هر آپلود (record_vector_index)
+به صورت افزایشی نگه می‌دارد و با گذشتن از VECTOR_INDEX_DISK_MAX_MB قدیمی‌ترین
+فایل‌ها (بر اساس آخرین استفاده) حذف می‌شوند. /ask برای ماتریس حذف‌شده فقط
+BM25 را استفاده می‌کند.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from config import (
+    EMBEDDER,
+    EMBEDDING_DIM,
+    EMBEDDING_ONNX_MODEL,
+    EMBEDDING_ONNX_TOKENIZER,
+    VECTOR_INDEX_DIR,
+    VECTOR_INDEX_DISK_MAX_MB,
+)
+from services.retrieval import tokenize, search
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbedder:
+    """feature hashing روی کلمات و سه‌حرفی‌های داخل کلمه، با وزن log(1 + tf)"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in tokenize(text):
+            features.append(token)
+            padded = f"<{token}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            # crc32 بر خلاف hash() بین پردازه‌ها ثابت است
+            hashes = np.fromiter(
+                (zlib.crc32(f.encode("utf-8")) for f in self._features(text)),
+                dtype=np.uint32,
+            )
+            if not hashes.size:
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dim, signs)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        return _normalize(matrix)
+
+
+class OnnxEmbedder:
+    """مدل sentence-embedding محلی با خروجی last_hidden_state و mean pooling"""
+
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 256):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self.name = f"onnx-{os.path.basename(model_path)}"
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def embed(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            outputs.append(pooled.astype(np.float32))
+        if not outputs:
+            return np.zeros((0, self.dim or EMBEDDING_DIM), dtype=np.float32)
+        return _normalize(np.vstack(outputs))
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDER == "onnx":
+            try:
+                _embedder = OnnxEmbedder(EMBEDDING_ONNX_MODEL, EMBEDDING_ONNX_TOKENIZER)
+            except Exception as e:
+                logger.warning("⚠️ مدل ONNX بارگذاری نشد، از embedder hashing استفاده می‌شود", extra={"error": str(e)})
+        if _embedder is None:
+            _embedder = HashingEmbedder()
+    return _embedder
+
+
+def _path(key: str) -> str:
+    return os.path.join(VECTOR_INDEX_DIR, f"{key}.npy")
+
+
+def build_vector_index(texts: List[str]) -> Optional[dict]:
+    """embed تکه‌ها و ذخیره‌ی ماتریس؛ خروجی متادیتایی است که کنار داده‌ها ذخیره می‌شود"""
+    if not texts:
+        return None
+    embedder = get_embedder()
+    digest = hashlib.sha256(embedder.name.encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    key = digest.hexdigest()[:40]
+
+    path = _path(key)
+    written = 0
+    if not os.path.exists(path):
+        matrix = embedder.embed(texts)
+        os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=VECTOR_INDEX_DIR, suffix=".npy.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, matrix)
+            written = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        dim = int(matrix.shape[1])
+    else:
+        os.utime(path)  # سند تکراری؛ ماتریس تازه استفاده شده است
+        dim = int(np.load(path, mmap_mode="r").shape[1])
+
+    # written فقط برای record_vector_index است و ذخیره نمی‌شود
+    return {"key": key, "embedder": embedder.name, "count": len(texts), "dim": dim, "written": written}
+
+
+# حجم پوشه‌ی ماتریس‌ها در این پردازه؛ با اولین ثبت یک بار شمرده می‌شود
+_disk_bytes: Optional[int] = None
+_disk_lock = threading.Lock()
+
+
+def record_vector_index(meta: Optional[dict]) -> Optional[dict]:
+    """در پردازه‌ی اصلی بعد از build_vector_index: حساب حجم و هرس در صورت نیاز"""
+    global _disk_bytes
+    if not meta:
+        return meta
+    written = meta.pop("written", 0)
+    with _cache_lock:
+        _missing.pop(meta["key"], None)
+    with _disk_lock:
+        if _disk_bytes is None:
+            _disk_bytes = _scan_disk()[1]
+        else:
+            _disk_bytes += written
+        if _disk_bytes > VECTOR_INDEX_DISK_MAX_MB * 1024 * 1024:
+            _prune_disk()
+    return meta
+
+
+def _scan_disk() -> tuple:
+    """(فهرست (mtime, size, path)، حجم کل) ماتریس‌های روی دیسک"""
+    entries = []
+    total = 0
+    try:
+        with os.scandir(VECTOR_INDEX_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    except FileNotFoundError:
+        pass
+    return entries, total
+
+
+def _prune_disk():
+    """حذف ماتریس‌هایی که مدت بیشتری استفاده نشده‌اند تا زیر سقف (با _disk_lock)"""
+    global _disk_bytes
+    max_bytes = VECTOR_INDEX_DISK_MAX_MB * 1024 * 1024
+    entries, total = _scan_disk()
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    _disk_bytes = total
+    logger.info("ایندکس‌های برداری قدیمی حذف شدند", extra={"removed": removed, "disk_bytes": total})
+
+
+# ماتریس‌های باز (mmap) در این پردازه
+_OPEN_MATRICES_LIMIT = 32
+_open_matrices: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+# کلیدهایی که فایلشان نیست (هرس‌شده یا خراب) → زمان بررسی؛ تا مدتی دوباره خوانده و لاگ نمی‌شوند
+_MISSING_LIMIT = 1024
+_MISSING_RETRY_SECONDS = 300
+_missing: "OrderedDict[str, float]" = OrderedDict()
+# load_vectors در threadهای asyncio.to_thread اجرا می‌شود؛ هر دو OrderedDict با این قفل تغییر می‌کنند
+_cache_lock = threading.Lock()
+
+
+def load_vectors(key: str) -> Optional[np.ndarray]:
+    with _cache_lock:
+        matrix = _open_matrices.get(key)
+        if matrix is not None:
+            _open_matrices.move_to_end(key)
+            return matrix
+        checked_at = _missing.get(key)
+    if checked_at is not None and time.monotonic() - checked_at < _MISSING_RETRY_SECONDS:
+        return None
+
+    # خواندن از دیسک بیرون از قفل
+    path = _path(key)
+    try:
+        matrix = np.load(path, mmap_mode="r")
+        os.utime(path)  # برای هرس بر اساس آخرین استفاده
+    except (FileNotFoundError, ValueError) as e:
+        if checked_at is None:
+            logger.warning("⚠️ ایندکس برداری در دسترس نیست، فقط BM25 استفاده می‌شود",
+                           extra={"key": key, "error": str(e)})
+        with _cache_lock:
+            _missing[key] = time.monotonic()
+            _missing.move_to_end(key)
+            while len(_missing) > _MISSING_LIMIT:
+                _missing.popitem(last=False)
+        return None
+    with _cache_lock:
+        _missing.pop(key, None)
+        _open_matrices[key] = matrix
+        _open_matrices.move_to_end(key)
+        while len(_open_matrices) > _OPEN_MATRICES_LIMIT:
+            _open_matrices.popitem(last=False)
+    return matrix
+
+
+def vector_search(meta: dict, query: str, k: int) -> List[tuple]:
+    """(شماره تکه، شباهت کسینوسی) برای k تکه‌ی نزدیک به سؤال"""
+    embedder = get_embedder()
+    if not meta or meta.get("embedder") != embedder.name:
+        return []
+    matrix = load_vectors(meta["key"])
+    if matrix is None or not len(matrix):
+        return []
+
+    query_vector = embedder.embed([query])[0]
+    if not query_vector.any():
+        return []
+    scores = matrix @ query_vector
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def hybrid_search(index: dict, query: str, k: int, rrf_k: int = 60) -> List[dict]:
+    """ترکیب رتبه‌های BM25 و برداری با reciprocal rank fusion"""
+    chunks = index.get("chunks") or []
+    lexical = search(index, query, k * 2)
+    semantic = vector_search(index.get("vectors"), query, k * 2)
+    if not semantic:
+        return lexical[:k]
+
+    scores = {}
+    for rank, chunk in enumerate(lexical):
+        scores[chunk["id"]] = scores.get(chunk["id"], 0.0) + 1.0 / (rrf_k + rank + 1)
+    for rank, (chunk_id, _) in enumerate(semantic):
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [{**chunks[chunk_id], "score": round(score, 4)} for chunk_id, score in best]
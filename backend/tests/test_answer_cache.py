@@ -0,0 +1,120 @@
+"""کش پاسخ /ask و باطل شدن آن بعد از آپلود (services.answer_cache)"""
+import asyncio
+import fnmatch
+
+from services.answer_cache import AnswerCache, MemoryAnswerBackend, RedisAnswerBackend
+
+
+class FakeRedis:
+    """فقط دستورهایی که RedisAnswerBackend استفاده می‌کند، با همان معنای glob در SCAN MATCH"""
+
+    def __init__(self):
+        self.items = {}
+        self.patterns = []
+
+    async def get(self, key):
+        return self.items.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.items[key] = value.encode("utf-8")
+
+    async def delete(self, key):
+        return 1 if self.items.pop(key, None) is not None else 0
+
+    async def scan_iter(self, match=None, count=None):
+        self.patterns.append(match)
+        # در fnmatch «\» escape نیست؛ «[*]» معادل «\*» در glob ردیس است
+        pattern = "".join(
+            f"[{c}]" if escaped else c
+            for escaped, c in _unescape(match)
+        )
+        for key in list(self.items):
+            if fnmatch.fnmatchcase(key, pattern):
+                yield key
+
+
+def _unescape(pattern):
+    chars = iter(pattern)
+    for c in chars:
+        if c == "\\":
+            yield True, next(chars)
+        else:
+            yield False, c
+
+
+class BrokenBackend:
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    set = delete_prefix = get
+
+    def __len__(self):
+        return 0
+
+
+async def _fill(cache: AnswerCache):
+    await cache.set("a", "v1", "سؤال اول", "پاسخ ۱")
+    await cache.set("a", "v1", "سؤال دوم", "پاسخ ۲")
+    await cache.set("a:b", "v1", "سؤال اول", "پاسخ دیگر")
+
+
+def test_invalidate_user_removes_only_that_user():
+    async def scenario():
+        cache = AnswerCache(MemoryAnswerBackend())
+        await _fill(cache)
+        await cache.invalidate_user("a")
+        return (
+            await cache.get("a", "v1", "سؤال اول"),
+            await cache.get("a:b", "v1", "سؤال اول"),
+            cache.stats(),
+        )
+
+    own, other, stats = asyncio.run(scenario())
+    assert own is None
+    assert other == "پاسخ دیگر"
+    assert stats["invalidations"] == 2
+    assert stats["items"] == 1
+
+
+def test_question_is_normalized_in_key():
+    async def scenario():
+        cache = AnswerCache(MemoryAnswerBackend())
+        await cache.set("a", "v1", "سؤال  اول؟", "پاسخ")
+        return await cache.get("a", "v1", "سؤال اول"), await cache.get("a", "v2", "سؤال اول")
+
+    assert asyncio.run(scenario()) == ("پاسخ", None)
+
+
+def test_user_prefixes_do_not_overlap():
+    for user, other in [("a", "a:b"), ("a:", "a"), ("ab", "a")]:
+        assert not AnswerCache.make_key(other, "v", "q").startswith(AnswerCache.user_prefix(user))
+
+
+def test_redis_invalidation_escapes_glob_in_namespace():
+    async def scenario():
+        client = FakeRedis()
+        cache = AnswerCache(RedisAnswerBackend(client, namespace="ns*[x]"))
+        await _fill(cache)
+        # کلید namespace دیگری که فقط با glob بدون escape منطبق می‌شد
+        client.items["nsZx:" + AnswerCache.user_prefix("a") + "other"] = b"x"
+        await cache.invalidate_user("a")
+        return client, await cache.get("a:b", "v1", "سؤال اول")
+
+    client, other = asyncio.run(scenario())
+    assert client.patterns == [r"ns\*\[x\]:" + AnswerCache.user_prefix("a") + "*"]
+    assert len(client.items) == 2
+    assert other == "پاسخ دیگر"
+
+
+def test_backend_errors_do_not_raise():
+    async def scenario():
+        cache = AnswerCache(BrokenBackend())
+        await cache.set("a", "v1", "q", "answer")
+        value = await cache.get("a", "v1", "q")
+        await cache.invalidate_user("a")
+        return value, cache.stats()
+
+    value, stats = asyncio.run(scenario())
+    assert value is None
+    assert stats["errors"] == 3
+    assert stats["hits"] == stats["misses"] == stats["stores"] == 0
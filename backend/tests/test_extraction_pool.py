@@ -0,0 +1,125 @@
+"""timeout، مرگ worker و ساخت دوباره در استخر پردازه‌ها (services.extraction_pool)"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from services import extraction_pool as extraction_pool_module
+from services.extraction_pool import ExtractionPool, ExtractionTimeout, ExtractionWorkerError
+
+
+def _with_pool(scenario, **kwargs):
+    async def main():
+        pool = ExtractionPool(**{"max_workers": 1, "acquire_check_interval": 0.2, **kwargs})
+        await pool.start()
+        try:
+            return await scenario(pool)
+        finally:
+            await pool.shutdown()
+
+    return asyncio.run(main())
+
+
+async def _wait_for_idle(pool: ExtractionPool, workers: int = 1, limit: float = 30):
+    deadline = time.monotonic() + limit
+    while pool.stats()["idle_workers"] < workers:
+        assert time.monotonic() < deadline, pool.stats()
+        await asyncio.sleep(0.05)
+
+
+def _fail_spawns(pool: ExtractionPool, count: int):
+    """count بار اول ساخت worker شکست می‌خورد"""
+    spawn = pool._spawn
+    failures = {"left": count}
+
+    async def failing_spawn():
+        if failures["left"] > 0:
+            failures["left"] -= 1
+            raise RuntimeError("spawn failed")
+        return await spawn()
+
+    pool._spawn = failing_spawn
+
+
+@pytest.fixture(autouse=True)
+def fast_respawn(monkeypatch):
+    monkeypatch.setattr(extraction_pool_module, "EXTRACTION_RESPAWN_MAX_DELAY", 0.2)
+
+
+def test_run_returns_result():
+    async def scenario(pool):
+        return await pool.run(abs, -3)
+
+    assert _with_pool(scenario) == 3
+
+
+def test_job_error_is_raised_and_worker_kept():
+    async def scenario(pool):
+        with pytest.raises(ValueError):
+            await pool.run(int, "x")
+        return await pool.run(abs, -1), pool.stats()
+
+    result, stats = _with_pool(scenario)
+    assert result == 1
+    assert stats["respawning"] == 0
+
+
+def test_timeout_replaces_worker():
+    async def scenario(pool):
+        with pytest.raises(ExtractionTimeout):
+            await pool.run(time.sleep, 5, timeout=0.5)
+        # کار بعدی منتظر worker جدید می‌ماند و خطا نمی‌گیرد
+        return await pool.run(abs, -2), pool.stats()
+
+    result, stats = _with_pool(scenario)
+    assert result == 2
+    assert stats["workers"] == 1
+
+
+def test_crashed_worker_is_respawned():
+    async def scenario(pool):
+        with pytest.raises(ExtractionWorkerError):
+            await pool.run(os._exit, 1)
+        await _wait_for_idle(pool)
+        return await pool.run(abs, -4), pool.stats()
+
+    result, stats = _with_pool(scenario)
+    assert result == 4
+    assert stats["respawn_failures"] == 0
+
+
+def test_queued_job_waits_for_busy_worker():
+    async def scenario(pool):
+        # کار دوم چند برابر acquire_check_interval منتظر می‌ماند ولی worker زنده است
+        return await asyncio.gather(pool.run(time.sleep, 1), pool.run(abs, -5))
+
+    assert _with_pool(scenario) == [None, 5]
+
+
+def test_acquire_fails_when_respawns_keep_failing():
+    async def scenario(pool):
+        _fail_spawns(pool, 1000)
+        with pytest.raises(ExtractionWorkerError):
+            await pool.run(os._exit, 1)
+        with pytest.raises(ExtractionWorkerError, match="no extraction worker alive"):
+            await pool.run(abs, -1)
+        return pool.stats()
+
+    stats = _with_pool(scenario)
+    assert stats["workers"] == 0
+    assert stats["respawn_failures"] >= 1
+
+
+def test_pool_recovers_once_respawn_succeeds():
+    async def scenario(pool):
+        _fail_spawns(pool, 2)
+        with pytest.raises(ExtractionWorkerError):
+            await pool.run(os._exit, 1)
+        await _wait_for_idle(pool)
+        return await pool.run(abs, -6), pool.stats()
+
+    result, stats = _with_pool(scenario)
+    assert result == 6
+    assert stats["respawn_failures"] == 2
+    assert stats["respawning"] == 0
@@ -0,0 +1,115 @@
+"""رزرو و برگشت اتمیک صفحات اشتراک (services.subscribtion_service)"""
+import asyncio
+
+from sqlalchemy import text
+
+from db_config import AsyncSessionLocal
+from models.subscribtion_models import PLANS
+from services.subscribtion_service import (
+    create_or_update_subscription,
+    reserve_pages,
+    refund_pages,
+)
+
+
+async def _pages(user_id: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("SELECT pages_remaining, last_reset FROM subscriptions WHERE user_id = :uid"),
+            {"uid": user_id},
+        )
+        return result.one()
+
+
+async def _set_pages(user_id: str, pages: int, reset_days_ago: int = 0):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            text("""
+                UPDATE subscriptions
+                SET pages_remaining = :pages, last_reset = now() - make_interval(days => :days)
+                WHERE user_id = :uid
+            """),
+            {"uid": user_id, "pages": pages, "days": reset_days_ago},
+        )
+        await session.commit()
+
+
+def test_reserve_deducts_when_balance_is_enough(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        ok, remaining = await reserve_pages(user_id, 20)
+        return ok, remaining, (await _pages(user_id)).pages_remaining
+
+    assert db(scenario()) == (True, PLANS["basic"].max_pages - 20, PLANS["basic"].max_pages - 20)
+
+
+def test_reserve_fails_without_changing_balance(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        await _set_pages(user_id, 5)
+        ok, message = await reserve_pages(user_id, 6)
+        return ok, message, (await _pages(user_id)).pages_remaining
+
+    ok, message, pages = db(scenario())
+    assert not ok
+    assert "6" in message
+    assert pages == 5
+
+
+def test_free_plan_is_never_reserved(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "free")
+        return await reserve_pages(user_id, 1), (await _pages(user_id)).pages_remaining
+
+    (ok, _), pages = db(scenario())
+    assert not ok
+    assert pages == PLANS["free"].max_pages
+
+
+def test_concurrent_reserves_never_overdraw(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "pro")
+        results = await asyncio.gather(*(reserve_pages(user_id, 30) for _ in range(10)))
+        return results, (await _pages(user_id)).pages_remaining
+
+    results, pages = db(scenario())
+    granted = [remaining for ok, remaining in results if ok]
+    assert len(granted) == PLANS["pro"].max_pages // 30
+    assert pages == PLANS["pro"].max_pages - 30 * len(granted)
+    assert min(granted) == pages
+
+
+def test_reserve_applies_overdue_annual_reset(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        await _set_pages(user_id, 0, reset_days_ago=400)
+        ok, remaining = await reserve_pages(user_id, 10)
+        return ok, remaining, await _pages(user_id)
+
+    ok, remaining, row = db(scenario())
+    assert ok
+    assert remaining == row.pages_remaining == PLANS["basic"].max_pages - 10
+
+
+def test_refund_restores_pages_up_to_plan_limit(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        await reserve_pages(user_id, 20)
+        restored = await refund_pages(user_id, 20)
+        # برگشت بیشتر از رزرو (مثلاً بعد از ریست سالانه) از سقف پلن نمی‌گذرد
+        capped = await refund_pages(user_id, 20)
+        return restored, capped
+
+    assert db(scenario()) == (PLANS["basic"].max_pages, PLANS["basic"].max_pages)
+
+
+def test_refund_inside_caller_transaction_rolls_back_with_it(db, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        await reserve_pages(user_id, 20)
+        async with AsyncSessionLocal() as session:
+            await refund_pages(user_id, 20, session=session)
+            await session.rollback()
+        return (await _pages(user_id)).pages_remaining
+
+    assert db(scenario()) == PLANS["basic"].max_pages - 20
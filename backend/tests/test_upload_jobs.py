@@ -0,0 +1,156 @@
+"""ثبت اتمیک کارهای آپلود با unique index کارهای فعال (services.upload_jobs)"""
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from config import UPLOAD_JOBS_DIR
+from db_config import AsyncSessionLocal
+from models.subscribtion_models import PLANS
+from services.subscribtion_service import create_or_update_subscription
+from services.upload_jobs import QuotaExceeded, enqueue_job, ensure_jobs_table
+
+CONTENT = b"%PDF-1.4 test"
+
+
+def _enqueue(user_id: str, category: str = "test", pages: int = 10, **kwargs):
+    return enqueue_job(
+        user_id, category, "test.pdf", "pdf", CONTENT, uuid.uuid5(uuid.NAMESPACE_OID, user_id).hex,
+        pages, None, **kwargs,
+    )
+
+
+async def _rows(user_id: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("SELECT id, status, file_path, pages_deducted FROM upload_jobs WHERE user_id = :uid ORDER BY created_at"),
+            {"uid": user_id},
+        )
+        return result.fetchall()
+
+
+async def _pages(user_id: str) -> int:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("SELECT pages_remaining FROM subscriptions WHERE user_id = :uid"), {"uid": user_id}
+        )
+        return result.scalar()
+
+
+async def _finish(job_id: str, status: str):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            text("UPDATE upload_jobs SET status = :status, finished_at = now() WHERE id = :id"),
+            {"id": job_id, "status": status},
+        )
+        await session.commit()
+
+
+@pytest.fixture
+def jobs_table(db):
+    db(ensure_jobs_table())
+    return db
+
+
+def test_concurrent_enqueue_creates_one_job(jobs_table, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        jobs = await asyncio.gather(*(_enqueue(user_id, reserve=True) for _ in range(8)))
+        return jobs, await _rows(user_id), await _pages(user_id)
+
+    jobs, rows, pages = jobs_table(scenario())
+    assert len({job["id"] for job in jobs}) == 1
+    assert len(rows) == 1
+    assert rows[0].pages_deducted
+    assert os.path.exists(rows[0].file_path)
+    assert sorted(os.listdir(UPLOAD_JOBS_DIR)).count(f"{rows[0].id}.bin") == 1
+    assert pages == PLANS["basic"].max_pages - 10
+
+
+def test_other_category_is_a_separate_job(jobs_table, user_id):
+    async def scenario():
+        first = await _enqueue(user_id, "a")
+        second = await _enqueue(user_id, "b")
+        return first, second, await _rows(user_id)
+
+    first, second, rows = jobs_table(scenario())
+    assert first["id"] != second["id"]
+    assert len(rows) == 2
+
+
+@pytest.mark.parametrize("status", ["done", "failed"])
+def test_finished_job_does_not_block_new_upload(jobs_table, user_id, status):
+    async def scenario():
+        first = await _enqueue(user_id)
+        await _finish(first["id"], status)
+        second = await _enqueue(user_id)
+        return first, second
+
+    first, second = jobs_table(scenario())
+    assert first["id"] != second["id"]
+    assert second["status"] == "queued"
+
+
+def test_quota_exceeded_leaves_no_job_or_file(jobs_table, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        with pytest.raises(QuotaExceeded):
+            await _enqueue(user_id, pages=PLANS["basic"].max_pages + 1, reserve=True)
+        return await _rows(user_id), await _pages(user_id)
+
+    files_before = set(os.listdir(UPLOAD_JOBS_DIR)) if os.path.isdir(UPLOAD_JOBS_DIR) else set()
+    rows, pages = jobs_table(scenario())
+    files_after = set(os.listdir(UPLOAD_JOBS_DIR)) if os.path.isdir(UPLOAD_JOBS_DIR) else set()
+    assert rows == []
+    assert files_after == files_before
+    assert pages == PLANS["basic"].max_pages
+
+
+async def _insert_legacy_job(user_id: str, pages: int = 10) -> str:
+    """درج مستقیم مثل نسخه‌های قبل از unique index (بدون ON CONFLICT)"""
+    job_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOAD_JOBS_DIR, f"{job_id}.bin")
+    os.makedirs(UPLOAD_JOBS_DIR, exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(CONTENT)
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            text("""
+                INSERT INTO upload_jobs
+                (id, user_id, category, file_type, file_path, file_size, content_hash, pages_count, pages_deducted)
+                VALUES (:id, :uid, 'test', 'pdf', :path, :size, :hash, :pages, TRUE)
+            """),
+            {"id": job_id, "uid": user_id, "path": file_path, "size": len(CONTENT),
+             "hash": uuid.uuid5(uuid.NAMESPACE_OID, user_id).hex, "pages": pages},
+        )
+        await session.execute(
+            text("UPDATE subscriptions SET pages_remaining = pages_remaining - :pages WHERE user_id = :uid"),
+            {"uid": user_id, "pages": pages},
+        )
+        await session.commit()
+    return job_id
+
+
+def test_ensure_jobs_table_resolves_duplicate_active_jobs(jobs_table, user_id):
+    async def scenario():
+        await create_or_update_subscription(user_id, "basic")
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("DROP INDEX upload_jobs_active_uniq"))
+            await session.commit()
+        for _ in range(3):
+            await _insert_legacy_job(user_id)
+        await ensure_jobs_table()
+        # حالا index برگشته و فایل تکراری کار فعال موجود را برمی‌گرداند
+        again = await _enqueue(user_id, reserve=True)
+        return await _rows(user_id), await _pages(user_id), again
+
+    rows, pages, again = jobs_table(scenario())
+    active = [r for r in rows if r.status == "queued"]
+    failed = [r for r in rows if r.status == "failed"]
+    assert len(active) == 1 and len(failed) == 2
+    assert again["id"] == active[0].id
+    assert all(not r.pages_deducted and not os.path.exists(r.file_path) for r in failed)
+    assert os.path.exists(active[0].file_path)
+    assert pages == PLANS["basic"].max_pages - 10
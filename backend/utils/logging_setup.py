@@ -0,0 +1,181 @@
+"""
+لاگ ساختاریافته و غیرمسدودکننده
+
+setup_logging() یک QueueHandler روی root logger می‌گذارد: فراخواننده فقط رکورد
+را در صف می‌گذارد و یک thread جداگانه (QueueListener) آن را قالب‌بندی و در
+stdout می‌نویسد، پس کندی stdout یا حجم زیاد لاگ روی event loop اثری ندارد.
+اگر صف پر شود رکورد دور ریخته و شمرده می‌شود (log_stats).
+
+هر ماژول logger خودش را دارد و مقادیر به جای متن پیام در extra می‌آیند:
+
+    logger = logging.getLogger(__name__)
+    logger.info("استخراج PDF تمام شد", extra={"method": method, "chars": chars})
+
+هر رکورد request_id درخواست جاری (utils.request_context) و trace_id
+(utils.tracing) را هم دارد. LOG_LEVEL سطح پیش‌فرض و سطح هر logger را تعیین
+می‌کند و LOG_SAMPLING نسبت رکوردهای زیر WARNING هر logger را که نوشته
+می‌شوند؛ هشدارها و خطاها همیشه نوشته می‌شوند.
+"""
+import atexit
+import datetime
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING, LOG_QUEUE_SIZE
+from utils.request_context import request_id
+from utils.tracing import current_span
+
+# ویژگی‌های استاندارد LogRecord؛ بقیه همان فیلدهای extra هستند
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "trace_id"}
+
+# کتابخانه‌هایی که در INFO برای هر درخواست چند خط می‌نویسند (قابل تغییر با LOG_LEVEL)
+_DEFAULT_LEVELS = {"azure": "WARNING"}
+
+_listener = None
+_handler = None
+
+
+def _parse_spec(spec: str, default_key: str = "") -> dict:
+    """«INFO,services.pdf_extraction=WARNING» → {"": "INFO", "services.pdf_extraction": "WARNING"}"""
+    parsed = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, value = item.rpartition("=")
+        parsed[name.strip() if sep else default_key] = value.strip()
+    return parsed
+
+
+class ContextFilter(logging.Filter):
+    """در thread فراخواننده: افزودن request_id/trace_id و نمونه‌گیری هر logger"""
+
+    def __init__(self, sample_rates: dict):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    @functools.lru_cache(maxsize=1024)
+    def sample_rate(self, name: str) -> float:
+        # نزدیک‌ترین logger والد که نرخ دارد (services.pdf_extraction → services)
+        while True:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            if "." not in name:
+                return 1.0
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        record.request_id = request_id()
+        record.trace_id = current_span().trace_id
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # فقط ادغام آرگومان‌ها در thread فراخواننده؛ قالب‌بندی JSON در thread listener
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        if record.trace_id:
+            entry["trace_id"] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """برای اجرای محلی: یک خط خوانا با فیلدهای extra به صورت key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = [f"{k}={v}" for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES]
+        if record.request_id:
+            fields.insert(0, f"request_id={record.request_id}")
+        if fields:
+            line = line.split("\n", 1)
+            line[0] += "  " + " ".join(fields)
+            line = "\n".join(line)
+        return line
+
+
+def setup_logging():
+    """یک بار در هر پردازه (برنامه‌ی اصلی و workerهای extraction_pool)"""
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    levels = {**_DEFAULT_LEVELS, **_parse_spec(LOG_LEVEL)}
+    root = logging.getLogger()
+    root.setLevel(levels.pop("", "INFO").upper())
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(ContextFilter({name: float(rate) for name, rate in _parse_spec(LOG_SAMPLING).items()}))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    # handlerهای قبلی root (مثلاً basicConfig) جایگزین می‌شوند تا چیزی مستقیم در stdout ننویسد
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """نوشتن رکوردهای باقیمانده‌ی صف (در shutdown برنامه یا پایان worker)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_stats() -> dict:
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
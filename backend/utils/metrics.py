@@ -0,0 +1,270 @@
+"""
+متریک‌های درون‌پردازه‌ای با خروجی متنی Prometheus
+
+    STAGE_SECONDS = metrics.histogram("yaroo_stage_duration_seconds", "...", ["stage"])
+    STAGE_SECONDS.labels("count_pdf_pages").observe(elapsed)
+
+metrics.render() همه‌ی متریک‌ها را در قالب text exposition برمی‌گرداند
+(GET /metrics). workerهای extraction_pool رجیستری جداگانه‌ی خودشان را دارند؛
+بعد از هر کار، drain() مقادیر جدید worker را برمی‌دارد و همراه نتیجه
+فرستاده می‌شود و merge() آن‌ها را در رجیستری پردازه‌ی اصلی جمع می‌کند.
+مقادیری که فقط هنگام خواندن معنا دارند (مثلاً اشباع pool دیتابیس) با
+metrics.collect() به صورت gauge از dict آمار خوانده می‌شوند.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# ثانیه؛ از یک میلی‌ثانیه (کوئری دیتابیس) تا چند دقیقه (OCR کل سند)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _HistogramChild:
+    __slots__ = ("_family", "counts", "sum", "count")
+
+    def __init__(self, family: "Histogram"):
+        self._family = family
+        self.counts = [0] * (len(family.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._family.buckets, value)
+        with self._family.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _GaugeChild:
+    __slots__ = ("_family", "value")
+
+    def __init__(self, family: "Gauge"):
+        self._family = family
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._family.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self.value = value
+
+    @contextmanager
+    def track(self):
+        """افزایش در شروع و کاهش در پایان بلوک (مثلاً تعداد کارهای در حال اجرا)"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        bounds = [_format_value(float(b)) for b in self.buckets] + ["+Inf"]
+        for key, child in sorted(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+    def drain(self) -> dict:
+        # شمارنده‌ها در جا صفر می‌شوند تا childهایی که از قبل با labels() گرفته شده‌اند معتبر بمانند
+        delta = {}
+        with self.lock:
+            for key, child in self.children.items():
+                if child.count:
+                    delta[key] = (child.counts, child.sum, child.count)
+                    child.counts = [0] * len(child.counts)
+                    child.sum = 0.0
+                    child.count = 0
+        return delta
+
+    def merge(self, delta: dict):
+        for key, (counts, total, count) in delta.items():
+            child = self.labels(*key)
+            with self.lock:
+                for i, c in enumerate(counts):
+                    child.counts[i] += c
+                child.sum += total
+                child.count += count
+
+
+class Gauge(_Family):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild(self)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def track(self):
+        return self.labels().track()
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in sorted(self.children.items())
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = "yaroo"):
+        self.namespace = namespace
+        self._families: Dict[str, _Family] = {}
+        self._collectors: List[Tuple[str, str, Callable[[], dict]]] = []
+
+    def _register(self, family: _Family) -> _Family:
+        existing = self._families.get(family.name)
+        if existing is not None:
+            return existing
+        self._families[family.name] = family
+        return family
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def collect(self, subsystem: str, documentation: str, stats: Callable[[], dict]):
+        """هر مقدار عددی dict آمار به gauge یک {namespace}_{subsystem}_{key} تبدیل می‌شود"""
+        self._collectors.append((f"{self.namespace}_{subsystem}", documentation, stats))
+
+    def drain(self) -> dict:
+        """مقادیر histogramها از آخرین drain (برای فرستادن از worker به پردازه‌ی اصلی)"""
+        delta = {}
+        for name, family in self._families.items():
+            if isinstance(family, Histogram):
+                observed = family.drain()
+                if observed:
+                    delta[name] = observed
+        return delta
+
+    def merge(self, delta: dict):
+        for name, observed in (delta or {}).items():
+            family = self._families.get(name)
+            if isinstance(family, Histogram):
+                family.merge(observed)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(family.render())
+
+        for prefix, documentation, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                lines.append(f"# {prefix} unavailable: {_escape(e)}")
+                continue
+            for key, value in values.items():
+                # مقادیر غیرعددی (مثلاً نام backend کش) در /stats هر سرویس می‌مانند
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# مرحله‌های مسیر داغ که در چند ماژول اندازه گرفته می‌شوند
+STAGE_SECONDS = metrics.histogram(
+    "yaroo_stage_duration_seconds",
+    "Duration of hot-path stages (count_pdf_pages, normalization, process_pdf_advanced, ...)",
+    ["stage"],
+)
@@ -0,0 +1,408 @@
+"""
+پروفایل opt-in یک درخواست
+
+ProfilingMiddleware درخواستی را پروفایل می‌کند که هدر X-Profile آن برابر
+PROFILE_ADMIN_TOKEN باشد یا با احتمال PROFILE_SAMPLE_RATE انتخاب شود. حداکثر
+PROFILE_MAX_CONCURRENT درخواست همزمان پروفایل می‌شوند و بقیه بدون سربار اجرا
+می‌شوند؛ پس روشن ماندن آن در production امن است. نتیجه بعد از پاسخ، خارج از
+event loop در PROFILE_DIR/<request_id>/ نوشته می‌شود:
+
+- sampling (پیش‌فرض): یک thread هر PROFILE_INTERVAL_MS پشته‌ی task همان
+  درخواست را نمونه می‌گیرد؛ وقتی task در حال اجراست پشته‌ی thread و وقتی
+  منتظر است (دیتابیس، LLM، extraction_pool) زنجیره‌ی await آن. پس wall.folded
+  (ورودی flamegraph.pl / speedscope) کل زمان درخواست را نشان می‌دهد.
+- cprofile: cProfile روی thread اصلی در طول درخواست (main.pstats). event loop
+  مشترک است، پس کار درخواست‌های همزمان دیگر هم در آن دیده می‌شود و در هر
+  لحظه فقط یک درخواست در این حالت پروفایل می‌شود.
+
+با PROFILE_WORKERS کارهای extraction_pool همین درخواست هم در worker با
+cProfile اجرا و در workers.pstats جمع می‌شوند. summary.json خلاصه و
+پرهزینه‌ترین توابع را دارد. هدر X-Profile-Mode (فقط همراه توکن) حالت را
+برای همان درخواست عوض می‌کند.
+"""
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+from config import (
+    PROFILE_ADMIN_TOKEN,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_MAX_CONCURRENT,
+    PROFILE_MODE,
+    PROFILE_INTERVAL_MS,
+    PROFILE_WORKERS,
+    PROFILE_DIR,
+    PROFILE_KEEP,
+)
+from utils.request_context import request_state
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_MODE_HEADER = b"x-profile-mode"
+MODES = ("sampling", "cprofile")
+TOP_FUNCTIONS = 25
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# task در حال اجرای هر loop (از thread نمونه‌بردار خوانده می‌شود)
+_current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+# برچسب فریم‌های کد خود برنامه (برای نسبت دادن زمان انتظار در summary)
+_app_labels = set()
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    in_app = filename.startswith(_BACKEND_DIR)
+    if in_app:
+        filename = os.path.relpath(filename, _BACKEND_DIR)
+    else:
+        filename = os.path.basename(filename)
+    # ; جداکننده‌ی فریم‌ها در قالب folded است
+    label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+    if in_app:
+        _app_labels.add(label)
+    return label
+
+
+def _thread_stack(frame, root_frame) -> list:
+    """پشته‌ی thread از coroutine اصلی درخواست به پایین (فریم‌های event loop حذف می‌شوند)"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        if frame is root_frame:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(task: asyncio.Task) -> list:
+    """زنجیره‌ی await یک task معلق، از coroutine اصلی تا نقطه‌ی انتظار"""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = (getattr(awaitable, "cr_frame", None)
+                 or getattr(awaitable, "ag_frame", None)
+                 or getattr(awaitable, "gi_frame", None))
+        if frame is None:
+            break
+        stack.append(_frame_label(frame.f_code))
+        awaitable = (getattr(awaitable, "cr_await", None)
+                     or getattr(awaitable, "ag_await", None)
+                     or getattr(awaitable, "gi_yieldfrom", None))
+    stack.append("[await]")
+    return stack
+
+
+def _top_functions(stats: dict, limit: int = TOP_FUNCTIONS) -> list:
+    """پرهزینه‌ترین توابع یک آمار cProfile بر اساس زمان خود تابع"""
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{func} ({os.path.relpath(path, _BACKEND_DIR) if path.startswith(_BACKEND_DIR) else path}:{line})",
+            "calls": nc,
+            "self_ms": round(tt * 1000, 2),
+            "cumulative_ms": round(ct * 1000, 2),
+        }
+        for (path, line, func), (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def profiled_call(fn, *args, **kwargs):
+    """در worker اجرا می‌شود: fn زیر cProfile و آمار marshal‌شده همراه نتیجه"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return result, marshal.dumps(profiler.stats)
+
+
+class RequestProfile:
+    def __init__(self, request_id: str, mode: str, trigger: str, scope):
+        self.request_id = request_id
+        self.mode = mode
+        self.trigger = trigger
+        self.method = scope.get("method", "")
+        self.path = scope.get("path", "")
+        self.profile_workers = PROFILE_WORKERS
+        self.status = None
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        # پشته (tuple) ← تعداد نمونه
+        self.samples = Counter()
+        self.cpu_samples = 0
+        self.wait_samples = 0
+        self.worker_stats = []
+        self._started = 0.0
+        self._cprofile = None
+        self._task = None
+        self._loop = None
+        self._thread_id = None
+        self._root_frame = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            return
+        self._task = asyncio.current_task()
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._root_frame = self._task.get_coro().cr_frame
+        _sampler.add(self)
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        else:
+            _sampler.remove(self)
+
+    def sample(self, frames: dict):
+        """از thread نمونه‌بردار صدا زده می‌شود"""
+        root = f"{self.method} {self.path}"
+        if _current_tasks.get(self._loop) is self._task:
+            frame = frames.get(self._thread_id)
+            if frame is None:
+                return
+            stack = _thread_stack(frame, self._root_frame)
+            self.cpu_samples += 1
+        else:
+            stack = _await_stack(self._task)
+            self.wait_samples += 1
+        self.samples[(root, *stack)] += 1
+
+    def _sampled_top(self) -> list:
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            if stack[-1] != "[await]":
+                leaves[stack[-1]] += count
+                continue
+            # انتظار به عمیق‌ترین تابع خود برنامه نسبت داده می‌شود (نه asyncio.wait_for)
+            waiter = next((label for label in reversed(stack) if label in _app_labels), stack[-2])
+            leaves[f"[await] {waiter}"] += count
+        return [
+            {"function": name, "samples": count, "ms": round(count * self.interval * 1000, 1)}
+            for name, count in leaves.most_common(TOP_FUNCTIONS)
+        ]
+
+    def _write_worker_stats(self, directory: str) -> list:
+        parts = []
+        for i, blob in enumerate(self.worker_stats):
+            part = os.path.join(directory, f".worker-{i}.pstats")
+            with open(part, "wb") as f:
+                f.write(blob)
+            parts.append(part)
+        try:
+            stats = pstats.Stats(*parts)
+            stats.dump_stats(os.path.join(directory, "workers.pstats"))
+            return _top_functions(stats.stats)
+        finally:
+            for part in parts:
+                os.unlink(part)
+
+    def write(self, base_dir: str = PROFILE_DIR) -> str:
+        directory = os.path.join(base_dir, self.request_id)
+        os.makedirs(directory, exist_ok=True)
+        summary = {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "mode": self.mode,
+            "trigger": self.trigger,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)),
+            "duration_ms": round(self.duration * 1000, 1),
+            "worker_jobs": len(self.worker_stats),
+        }
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(directory, "main.pstats"))
+            self._cprofile.create_stats()
+            summary["top"] = _top_functions(self._cprofile.stats)
+        else:
+            with open(os.path.join(directory, "wall.folded"), "w", encoding="utf-8") as f:
+                for stack, count in self.samples.items():
+                    f.write(f"{';'.join(stack)} {count}\n")
+            summary.update({
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "samples": self.cpu_samples + self.wait_samples,
+                "cpu_samples": self.cpu_samples,
+                "wait_samples": self.wait_samples,
+                "top": self._sampled_top(),
+            })
+
+        if self.worker_stats:
+            summary["worker_top"] = self._write_worker_stats(directory)
+
+        with open(os.path.join(directory, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        _prune(base_dir, PROFILE_KEEP)
+        return directory
+
+
+class _Sampler:
+    """یک thread مشترک برای همه‌ی درخواست‌های در حال پروفایل"""
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._wakeup.set()
+
+    def remove(self, profile: RequestProfile):
+        # بعد از برگشتن، این پروفایل دیگر نمونه نمی‌گیرد (نمونه‌برداری زیر همین قفل است)
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            self._wakeup.wait()
+            time.sleep(interval)
+            with self._lock:
+                if not self._profiles:
+                    self._wakeup.clear()
+                    continue
+                frames = sys._current_frames()
+                for profile in self._profiles:
+                    try:
+                        profile.sample(frames)
+                    except Exception:
+                        # task در همین لحظه تمام شده یا پشته در حال تغییر بوده است
+                        pass
+
+
+_sampler = _Sampler()
+
+
+def _prune(base_dir: str, keep: int):
+    try:
+        entries = sorted(
+            (e for e in os.scandir(base_dir) if e.is_dir()),
+            key=lambda e: e.stat().st_mtime,
+        )
+    except OSError:
+        return
+    for entry in entries[:max(len(entries) - keep, 0)]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def active_profile() -> Optional[RequestProfile]:
+    """پروفایل درخواست جاری (اگر این درخواست پروفایل می‌شود)"""
+    state = request_state()
+    return state.get("profile") if state is not None else None
+
+
+def _write_profile(profile: RequestProfile):
+    try:
+        directory = profile.write()
+        logger.info("🔬 پروفایل درخواست ذخیره شد", extra={
+            "profile_request_id": profile.request_id,
+            "method": profile.method,
+            "path": profile.path,
+            "duration_ms": round(profile.duration * 1000),
+            "directory": directory,
+        })
+    except Exception as e:
+        logger.warning("⚠️ ذخیره‌ی پروفایل درخواست ناموفق بود", extra={
+            "profile_request_id": profile.request_id, "error": str(e),
+        })
+
+
+class ProfilingMiddleware:
+    """باید داخل RequestContextMiddleware باشد تا request_id و request_state در دسترس باشند"""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+        self.active = 0
+        self._cprofile_active = False
+        self._writes = set()
+
+    def _choose(self, scope) -> Optional[tuple]:
+        """(mode, trigger) اگر این درخواست باید پروفایل شود"""
+        token = requested_mode = None
+        for name, value in scope.get("headers") or ():
+            if name == PROFILE_HEADER:
+                token = value
+            elif name == PROFILE_MODE_HEADER:
+                requested_mode = value.decode("latin-1").strip().lower()
+
+        mode = PROFILE_MODE if PROFILE_MODE in MODES else "sampling"
+        if token is not None and PROFILE_ADMIN_TOKEN and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN.encode()):
+            trigger = "header"
+            if requested_mode in MODES:
+                mode = requested_mode
+        elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        else:
+            return None
+
+        if self.active >= PROFILE_MAX_CONCURRENT:
+            return None
+        if mode == "cprofile" and self._cprofile_active:
+            return None
+        return mode, trigger
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        choice = self._choose(scope)
+        if choice is None:
+            return await self.app(scope, receive, send)
+
+        mode, trigger = choice
+        state = request_state()
+        request_id = state.get("request_id") if state is not None else None
+        profile = RequestProfile(request_id or uuid.uuid4().hex, mode, trigger, scope)
+        if state is not None:
+            state["profile"] = profile
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [*message.get("headers", []), (PROFILE_HEADER, mode.encode())]
+            await send(message)
+
+        self.active += 1
+        if mode == "cprofile":
+            self._cprofile_active = True
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            profile.stop()
+            self.active -= 1
+            if mode == "cprofile":
+                self._cprofile_active = False
+            # نوشتن فایل‌ها بعد از پاسخ و در thread جدا
+            task = asyncio.ensure_future(asyncio.to_thread(_write_profile, profile))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
@@ -0,0 +1,61 @@
+"""
+وضعیت مخصوص هر درخواست HTTP
+
+RequestContextMiddleware برای هر درخواست یک dict تازه در یک ContextVar قرار
+می‌دهد؛ هر کدی که در طول همان درخواست اجرا شود (حتی در taskهای فرزند) با
+request_state() به آن دسترسی دارد. بیرون از درخواست (مثلاً workerهای
+پس‌زمینه) request_state() مقدار None برمی‌گرداند.
+
+هر درخواست یک request_id دارد (از هدر X-Request-ID اگر معتبر باشد، وگرنه
+تصادفی) که در state["request_id"] قرار می‌گیرد و در پاسخ هم برگردانده می‌شود
+تا لاگ‌ها و پروفایل‌ها به همان درخواست ربط داده شوند.
+"""
+import re
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+REQUEST_ID_HEADER = b"x-request-id"
+# شناسه‌ی کلاینت در نام فایل (پروفایل‌ها) هم استفاده می‌شود
+_VALID_REQUEST_ID = re.compile(rb"[A-Za-z0-9._-]{1,64}")
+
+_request_state: ContextVar[Optional[dict]] = ContextVar("request_state", default=None)
+
+
+def request_state() -> Optional[dict]:
+    return _request_state.get()
+
+
+def request_id() -> Optional[str]:
+    state = _request_state.get()
+    return state.get("request_id") if state is not None else None
+
+
+def _incoming_request_id(scope) -> Optional[str]:
+    for name, value in scope.get("headers") or ():
+        if name == REQUEST_ID_HEADER and _VALID_REQUEST_ID.fullmatch(value):
+            return value.decode("ascii")
+    return None
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = _incoming_request_id(scope) or uuid.uuid4().hex
+        encoded_id = rid.encode("ascii")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER, encoded_id)]
+            await send(message)
+
+        token = _request_state.set({"request_id": rid})
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _request_state.reset(token)
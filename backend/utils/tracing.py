@@ -0,0 +1,484 @@
+"""
+spanهای هر درخواست (به سبک distributed tracing) با خروجی فایل یا collector
+
+    with span("pdf.open", bytes=len(content)) as s:
+        ...
+        s.set("pages", page_count)
+
+    @traced("subscription.check")
+    async def check_and_reset_subscription(...): ...
+
+TracingMiddleware برای هر درخواست یک span ریشه می‌سازد (یا هدر traceparent
+W3C را ادامه می‌دهد) و هر span() که در طول همان درخواست باز شود فرزند span
+جاری است؛ بیرون از یک trace (مثلاً task‌های پس‌زمینه) span() هیچ کاری نمی‌کند
+مگر با root=True. کارهای extraction_pool با traced_call در worker اجرا
+می‌شوند و spanهای worker (باز کردن PDF، هر استخراج‌کننده و هر صفحه) همراه
+نتیجه برگردانده می‌شوند.
+
+spanهای تمام‌شده در صف می‌روند و یک thread جداگانه آن‌ها را دسته‌ای می‌نویسد:
+TRACE_EXPORTER=jsonl در TRACE_FILE (هر خط یک span) و otlp به صورت OTLP/HTTP
+JSON به TRACE_OTLP_ENDPOINT (OpenTelemetry Collector، Jaeger، Tempo). اگر صف
+پر شود span دور ریخته می‌شود؛ event loop هیچ‌وقت منتظر خروجی نمی‌ماند.
+
+نمایش آبشاری یک trace از فایل jsonl:
+
+    python -m utils.tracing /tmp/traces.jsonl [--trace TRACE_ID] [--slowest 5]
+"""
+import argparse
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from config import (
+    TRACE_EXPORTER,
+    TRACE_FILE,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SERVICE_NAME,
+    TRACE_SAMPLE_RATE,
+    TRACE_QUEUE_SIZE,
+    TRACE_FLUSH_SECONDS,
+)
+from utils.request_context import request_state
+
+logger = logging.getLogger(__name__)
+
+EXPORTERS = ("none", "jsonl", "otlp")
+TRACEPARENT_HEADER = b"traceparent"
+TRACE_ID_HEADER = b"x-trace-id"
+_TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+
+# والد یک span که در همین پردازه نیست (هدر traceparent یا span پردازه‌ی اصلی در worker)
+SpanContext = namedtuple("SpanContext", "trace_id span_id")
+
+_current: ContextVar[Optional[object]] = ContextVar("current_span", default=None)
+# در worker: spanهای تمام‌شده به جای صف خروجی اینجا جمع می‌شوند
+_collected: ContextVar[Optional[list]] = ContextVar("collected_spans", default=None)
+
+
+class Span:
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "attributes",
+        "start_ns", "_start_perf", "end_ns", "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = None
+        self.error = None
+
+    def __bool__(self):
+        return True
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self, **attributes):
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        # مدت با ساعت یکنواخت؛ زمان شروع با ساعت دیواری تا spanهای workerها هم‌تراز شوند
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+        _finish(self.to_record())
+
+    def to_record(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "service": TRACE_SERVICE_NAME,
+            "pid": os.getpid(),
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """وقتی trace فعال نیست؛ همه‌ی متدها بدون هزینه"""
+    trace_id = span_id = None
+
+    def __bool__(self):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled() -> bool:
+    return TRACE_EXPORTER in EXPORTERS[1:]
+
+
+def current_span():
+    """span جاری این درخواست/task (یا NOOP_SPAN) برای افزودن attribute"""
+    span_ = _current.get()
+    return span_ if isinstance(span_, Span) else NOOP_SPAN
+
+
+def start_span(name: str, root: bool = False, **attributes):
+    """span جدید (بدون جاری کردن آن)؛ فراخواننده end() را صدا می‌زند"""
+    if not enabled():
+        return NOOP_SPAN
+    parent = _current.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    if root and random.random() < TRACE_SAMPLE_RATE:
+        return Span(name, os.urandom(16).hex(), None, attributes)
+    return NOOP_SPAN
+
+
+@contextmanager
+def use_span(span_):
+    """span را تا پایان بلوک جاری می‌کند و در پایان (با ثبت خطا) می‌بندد"""
+    if not span_:
+        yield span_
+        return
+    token = _current.set(span_)
+    try:
+        yield span_
+    except BaseException as e:
+        span_.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        span_.end()
+
+
+def span(name: str, root: bool = False, **attributes):
+    return use_span(start_span(name, root=root, **attributes))
+
+
+def traced(name: str = None, root: bool = False):
+    """decorator برای توابع sync و async؛ نام پیش‌فرض نام تابع است"""
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, root=root):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, root=root):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+# ----------------------------
+# Worker processes
+# ----------------------------
+def worker_context() -> Optional[SpanContext]:
+    """والد spanهای یک کار extraction_pool (اگر درخواست جاری trace می‌شود)"""
+    span_ = _current.get()
+    return SpanContext(span_.trace_id, span_.span_id) if span_ is not None else None
+
+
+def traced_call(parent: SpanContext, fn, *args, **kwargs):
+    """در worker اجرا می‌شود: fn زیر span والد و spanهای تمام‌شده همراه نتیجه"""
+    spans = []
+    collect_token = _collected.set(spans)
+    parent_token = _current.set(parent)
+    try:
+        with span(getattr(fn, "__name__", "job"), pid=os.getpid()):
+            result = fn(*args, **kwargs)
+    finally:
+        _current.reset(parent_token)
+        _collected.reset(collect_token)
+    return result, spans
+
+
+def export_records(records: list):
+    for record in records:
+        _finish(record)
+
+
+# ----------------------------
+# Exporters
+# ----------------------------
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(records: list) -> dict:
+    spans = []
+    for r in records:
+        attributes = [{"key": k, "value": _otlp_value(v)} for k, v in r["attributes"].items() if v is not None]
+        attributes.append({"key": "process.pid", "value": _otlp_value(r["pid"])})
+        spans.append({
+            "traceId": r["trace_id"],
+            "spanId": r["span_id"],
+            "parentSpanId": r["parent_span_id"] or "",
+            "name": r["name"],
+            # 2 = SERVER برای span ریشه‌ی درخواست، 1 = INTERNAL
+            "kind": 2 if r["attributes"].get("http.method") else 1,
+            "startTimeUnixNano": str(r["start_time_unix_nano"]),
+            "endTimeUnixNano": str(r["end_time_unix_nano"]),
+            "attributes": attributes,
+            "status": {"code": 2, "message": r["error"]} if r["error"] else {"code": 1},
+        })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": _otlp_value(TRACE_SERVICE_NAME)}]},
+            "scopeSpans": [{"scope": {"name": "yaroo.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class _Exporter:
+    """thread خروجی: spanها را دسته‌ای در فایل jsonl یا به collector می‌فرستد"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.dropped = 0
+        self.exported = 0
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._failing = False
+
+    def put(self, record: dict):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, records: list):
+        if self.kind == "jsonl":
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records))
+        else:
+            request = urllib.request.Request(
+                TRACE_OTLP_ENDPOINT,
+                data=json.dumps(_otlp_payload(records), default=str).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+            while len(batch) < 512:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            records = [r for r in batch if r is not None]
+            if records:
+                try:
+                    self._write(records)
+                    self.exported += len(records)
+                    if self._failing:
+                        logger.info("✅ خروجی trace دوباره برقرار شد", extra={"exporter": self.kind})
+                    self._failing = False
+                except Exception as e:
+                    self.dropped += len(records)
+                    # فقط اولین خطای پشت سر هم لاگ می‌شود
+                    if not self._failing:
+                        logger.warning("⚠️ خروجی trace ناموفق بود", extra={"exporter": self.kind, "error": str(e)})
+                    self._failing = True
+            if stop:
+                return
+
+    def shutdown(self, timeout: float = 5):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"exported": self.exported, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+exporter = _Exporter(TRACE_EXPORTER)
+
+
+def _finish(record: dict):
+    collected = _collected.get()
+    if collected is not None:
+        collected.append(record)
+    else:
+        exporter.put(record)
+
+
+# ----------------------------
+# Middleware
+# ----------------------------
+def _incoming_parent(scope) -> tuple:
+    """(والد از traceparent یا None، آیا trace شود)"""
+    for name, value in scope.get("headers") or ():
+        if name == TRACEPARENT_HEADER:
+            match = _TRACEPARENT.fullmatch(value.decode("latin-1").strip().lower())
+            if match:
+                trace_id, span_id, flags = match.groups()
+                return SpanContext(trace_id, span_id), bool(int(flags, 16) & 1)
+    return None, random.random() < TRACE_SAMPLE_RATE
+
+
+class TracingMiddleware:
+    """span ریشه‌ی هر درخواست HTTP؛ داخل RequestContextMiddleware تا request_id داشته باشد"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled():
+            return await self.app(scope, receive, send)
+
+        parent, sampled = _incoming_parent(scope)
+        if not sampled:
+            return await self.app(scope, receive, send)
+
+        state = request_state()
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        root = Span(
+            f"{method} {path}",
+            parent.trace_id if parent else os.urandom(16).hex(),
+            parent.span_id if parent else None,
+            {
+                "http.method": method,
+                "http.target": path,
+                "request_id": state.get("request_id") if state is not None else None,
+            },
+        )
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.error = f"HTTP {message['status']}"
+                message["headers"] = [*message.get("headers", []), (TRACE_ID_HEADER, root.trace_id.encode())]
+            await send(message)
+
+        with use_span(root):
+            await self.app(scope, receive, send_with_trace)
+
+
+# ----------------------------
+# Waterfall viewer
+# ----------------------------
+def _load_traces(path: str) -> dict:
+    traces = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+
+def print_waterfall(records: list, width: int = 40):
+    start = min(r["start_time_unix_nano"] for r in records)
+    end = max(r["end_time_unix_nano"] for r in records)
+    total = max(end - start, 1)
+    ids = {r["span_id"] for r in records}
+    children = {}
+    for r in records:
+        parent = r["parent_span_id"] if r["parent_span_id"] in ids else None
+        children.setdefault(parent, []).append(r)
+
+    print(f"\ntrace {records[0]['trace_id']}  {total / 1e6:.1f}ms  {len(records)} spans")
+
+    def walk(parent, depth):
+        for r in sorted(children.get(parent, []), key=lambda r: r["start_time_unix_nano"]):
+            offset = (r["start_time_unix_nano"] - start) / total
+            length = max((r["end_time_unix_nano"] - r["start_time_unix_nano"]) / total, 1 / width)
+            bar = " " * int(offset * width) + "█" * max(1, round(length * width))
+            attributes = ", ".join(
+                f"{k}={v}" for k, v in r["attributes"].items() if v is not None and k != "request_id"
+            )
+            mark = " ❌ " + r["error"] if r["error"] else ""
+            print(f"{bar[:width]:<{width}} {r['duration_ms']:>10.1f}ms {'  ' * depth}{r['name']}"
+                  f"{' (' + attributes + ')' if attributes else ''}{mark}")
+            walk(r["span_id"], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="نمایش آبشاری traceهای فایل jsonl")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--trace", help="شناسه‌ی trace (هدر X-Trace-ID پاسخ)")
+    parser.add_argument("--slowest", type=int, default=1, help="تعداد کندترین traceها")
+    args = parser.parse_args()
+
+    traces = _load_traces(args.path)
+    if args.trace:
+        selected = [traces[args.trace]]
+    else:
+        def duration(records):
+            return max(r["end_time_unix_nano"] for r in records) - min(r["start_time_unix_nano"] for r in records)
+        selected = sorted(traces.values(), key=duration, reverse=True)[:args.slowest]
+    for records in selected:
+        print_waterfall(records)
+
+
+if __name__ == "__main__":
+    main()